@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import FoodLabel, FoodFeedbackSample
+from .models import FoodLabel, FoodFeedbackSample, TrainingJob
 
 @admin.register(FoodLabel)
 class FoodLabelAdmin(admin.ModelAdmin):
@@ -11,3 +11,8 @@ class FoodFeedbackSampleAdmin(admin.ModelAdmin):
     list_display = ['label', 'created_at']
     list_filter = ['label', 'created_at']
     search_fields = ['label__name']
+
+@admin.register(TrainingJob)
+class TrainingJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'progress', 'created_at', 'finished_at']
+    list_filter = ['status', 'kind']
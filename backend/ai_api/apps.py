@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AiApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ai_api"
+
+    def ready(self):
+        from .signals import handlers  # noqa: F401
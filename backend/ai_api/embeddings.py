@@ -0,0 +1,101 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from django.conf import settings
+from django.db import close_old_connections
+
+from model_core.features import extract_embeddings, embeddings_to_bytes, embeddings_from_bytes
+from .models import FoodFeedbackSample, SampleEmbedding
+
+
+def file_sha256(field_file, chunk_size=1024 * 1024):
+    """sha256 of a stored file's content"""
+    digest = hashlib.sha256()
+    with field_file.open('rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ensure_content_hash(sample):
+    """Fill FoodFeedbackSample.content_hash if it is missing and return it"""
+    if not sample.content_hash:
+        sample.content_hash = file_sha256(sample.image)
+        # update() به جای save() تا signalهای حذف فایل اجرا نشوند
+        FoodFeedbackSample.objects.filter(pk=sample.pk).update(content_hash=sample.content_hash)
+    return sample.content_hash
+
+
+def get_embeddings(samples, model, backbone, transform, device='cpu', batch_size=32):
+    """
+    Pooled backbone embeddings for the readable `samples`.
+    `transform` decodes an image file into an input tensor (bundle.build_eval_decoder).
+
+    Returns (embeddings, kept): a (len(kept), 1280) tensor and the indices
+    into `samples` it covers. Images that cannot be read or decoded are left
+    out, as the training shard cache does.
+
+    Embeddings already stored for (content_hash, backbone) are reused; the
+    rest are computed in batches and saved for next time.
+    """
+    hashes = []
+    for sample in samples:
+        try:
+            hashes.append(ensure_content_hash(sample))
+        except (OSError, ValueError):
+            hashes.append(None)  # فایل تصویر وجود ندارد
+    stored = dict(
+        SampleEmbedding.objects.filter(backbone=backbone, content_hash__in={h for h in hashes if h})
+        .values_list('content_hash', 'vector')
+    )
+
+    missing = {}
+    for sample, content_hash in zip(samples, hashes):
+        if content_hash and content_hash not in stored and content_hash not in missing:
+            missing[content_hash] = sample
+    missing = list(missing.items())
+    for start in range(0, len(missing), batch_size):
+        computed, images = [], []
+        for content_hash, sample in missing[start:start + batch_size]:
+            try:
+                with sample.image.open('rb') as f:
+                    images.append(transform(f))
+            except (OSError, ValueError):
+                continue  # تصویر خراب؛ در خروجی نمی‌آید
+            computed.append(content_hash)
+        if not images:
+            continue
+        vectors = embeddings_to_bytes(extract_embeddings(model, torch.stack(images).to(device)))
+        SampleEmbedding.objects.bulk_create(
+            [SampleEmbedding(content_hash=h, backbone=backbone, vector=v) for h, v in zip(computed, vectors)],
+            ignore_conflicts=True,
+        )
+        stored.update(zip(computed, vectors))
+
+    kept = [i for i, content_hash in enumerate(hashes) if content_hash in stored]
+    return embeddings_from_bytes([bytes(stored[hashes[i]]) for i in kept]), kept
+
+
+# محاسبه‌ی embedding نمونه‌های جدید در پس‌زمینه (خارج از مسیر درخواست)
+embedding_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sample-embedding')
+
+
+def embed_sample(pk):
+    """Compute and store the embedding of one sample with the served model's backbone"""
+    from .inference import device, load_model
+    served = load_model()
+    if served is None:
+        return
+    try:
+        sample = FoodFeedbackSample.objects.get(pk=pk)
+        get_embeddings([sample], served.model, served.info['backbone_sha256'], served.transform, device=device)
+    except Exception as e:
+        print(f"Error embedding sample {pk}: {e}")
+    finally:
+        close_old_connections()
+
+
+def schedule_embedding(pk):
+    if getattr(settings, 'EMBED_ON_UPLOAD', True):
+        embedding_executor.submit(embed_sample, pk)
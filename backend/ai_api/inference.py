@@ -0,0 +1,253 @@
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from django.conf import settings
+
+from model_core.batching import MicroBatcher, BoundedExecutor
+from model_core.calibration import top_k_probabilities
+from model_core.backends import load_backend, bundle_prefix
+from model_core.quantize import load_quantized, quantized_path
+from model_core.bundle import load_bundle, build_model, build_eval_decoder, backbone_sha256, state_dict_sha256
+from model_core.registry import ModelRegistry
+from .label_registry import label_registry, read_class_map, write_class_map
+from .prediction_cache import PredictionCache, model_version
+
+# مسیر قدیمی مدل (قبل از registry)؛ فقط وقتی چیزی منتشر نشده استفاده می‌شود
+MODEL_PATH = os.path.join(settings.BASE_DIR, 'data', 'efficientnet_food_classifier.pth')
+
+registry = ModelRegistry(
+    getattr(settings, 'MODEL_REGISTRY_DIR', os.path.join(settings.BASE_DIR, 'data', 'models')),
+    keep=getattr(settings, 'MODEL_REGISTRY_KEEP', 3),
+)
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# Everything needed to serve one model version; swapped as a single reference.
+# `model` is the eager module (also used for embeddings), `runner` what predictions go through,
+# `transform` decodes an image file into the model's input tensor.
+ServedModel = namedtuple(
+    'ServedModel', ['model', 'class_names', 'transform', 'info', 'generation', 'path', 'runner'], defaults=(None,)
+)
+
+served = None
+model_lock = threading.Lock()
+
+# نتایج پیش‌بینی بر اساس hash تصویر و نسخه‌ی مدل
+prediction_cache = PredictionCache(
+    max_entries=getattr(settings, 'PREDICTION_CACHE_SIZE', 1024),
+    alias=getattr(settings, 'PREDICTION_CACHE_ALIAS', None),
+    timeout=getattr(settings, 'PREDICTION_CACHE_TIMEOUT', 24 * 60 * 60),
+)
+_failed_target = None
+
+
+def _target():
+    """(generation, path) of the model that should be served, or None"""
+    pointer = registry.current()
+    if pointer is not None:
+        return pointer['generation'], pointer['path']
+    if os.path.exists(MODEL_PATH):
+        return 0, MODEL_PATH
+    return None
+
+
+def intra_op_threads():
+    """
+    INFERENCE_INTRA_OP_THREADS, or the cores available to this process split between
+    the WEB_CONCURRENCY server processes on the machine, so N processes don't each
+    start one thread per core.
+    """
+    configured = getattr(settings, 'INFERENCE_INTRA_OP_THREADS', None)
+    if configured:
+        return configured
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    processes = int(os.environ.get('WEB_CONCURRENCY') or 1)
+    return max(1, cores // processes)
+
+
+def _load(generation, path):
+    # همه‌ی forward pass ها در thread ی batcher اجرا می‌شوند؛ درخواست‌های همزمان thread اضافه نمی‌سازند
+    torch.set_num_threads(intra_op_threads())
+    bundle = load_bundle(path, map_location=device)
+    class_names = bundle['class_names']
+    if class_names is None:
+        # checkpoint قدیمی (فقط state_dict): لیبل‌ها از فایل کناری یا دیتابیس
+        class_names = read_class_map(path)
+        if class_names is None:
+            class_names = label_registry.class_names
+            if class_names:
+                write_class_map(path, class_names)
+    if not class_names:
+        raise ValueError('No class names available for model.')
+    model = build_model(bundle, class_names).to(device)
+    runner, variant = _prepare_runner(model, bundle, path)
+    return ServedModel(
+        model=model,
+        class_names=list(class_names),
+        transform=build_eval_decoder(bundle['transform']),
+        info={
+            **{k: v for k, v in bundle.items() if k != 'state_dict'},
+            'backbone_sha256': bundle['backbone_sha256'] or backbone_sha256(bundle['state_dict']),
+            'variant': variant,
+        },
+        generation=generation,
+        path=path,
+        runner=runner,
+    )
+
+
+def _prepare_runner(model, bundle, path):
+    """
+    The int8 variant when INFERENCE_PRECISION is 'int8' and one was published,
+    else the model wrapped in the backend chosen by INFERENCE_BACKEND (eager on failure).
+    Returns (runner, variant name).
+    """
+    int8_path = quantized_path(path)
+    if getattr(settings, 'INFERENCE_PRECISION', 'fp32') == 'int8' and device.type == 'cpu' and os.path.exists(int8_path):
+        try:
+            quantization = bundle['metrics'].get('quantization') or {}
+            runner = load_quantized(int8_path, engine=quantization.get('engine'))
+            example = torch.zeros(1, 3, *bundle['transform']['resize'])
+            with torch.inference_mode():
+                runner(example)
+                runner(example)
+            return runner, 'int8'
+        except Exception as e:
+            print(f"Error loading int8 model, serving fp32: {e}")
+
+    backend = getattr(settings, 'INFERENCE_BACKEND', 'eager')
+    try:
+        return load_backend(
+            backend, model,
+            sha256=bundle['sha256'] or state_dict_sha256(bundle['state_dict']),
+            prefix=bundle_prefix(path),
+            input_size=bundle['transform']['resize'],
+            device=device,
+            num_threads=intra_op_threads(),
+            options={
+                'socket_path': getattr(settings, 'INFERENCE_WORKER_SOCKET', os.path.join(settings.BASE_DIR, 'data', 'inference.sock')),
+                'bundle_path': path,
+            } if backend == 'remote' else None,
+        ), backend
+    except Exception as e:
+        print(f"Error preparing {backend} inference backend, serving eager model: {e}")
+        return model, 'eager'
+
+
+def _swap(target):
+    """Load `target` and make it the served model. Caller must hold model_lock."""
+    global served, _failed_target
+    if served is not None and (served.generation, served.path) == target:
+        return
+    try:
+        served = _load(*target)
+        _failed_target = None
+        # کلیدها شامل نسخه‌ی مدل هستند؛ پاک کردن فقط حافظه را آزاد می‌کند
+        prediction_cache.clear()
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        _failed_target = target
+
+
+def _swap_in_background(target):
+    try:
+        _swap(target)
+    finally:
+        model_lock.release()
+
+
+def load_model(wait=False):
+    """
+    Make sure the newest published model is being served and return it.
+
+    When a model is already served, a newer generation is loaded in a
+    background thread and in-flight requests keep using the old one; the
+    swap is a single reference assignment. With `wait=True` (or when no
+    model is loaded yet) the new model is loaded before returning.
+    """
+    current = served
+    target = _target()
+    if target is None or target == _failed_target:
+        return current
+    if current is not None and (current.generation, current.path) == target:
+        return current
+
+    if current is None or wait:
+        with model_lock:
+            _swap(target)
+    elif model_lock.acquire(blocking=False):
+        threading.Thread(target=_swap_in_background, args=(target,), name='model-swap', daemon=True).start()
+    return served
+
+
+def _forward(batch):
+    """Run one batched forward pass (called by the batcher thread)"""
+    current = served
+    with torch.no_grad():
+        outputs = (current.runner or current.model)(batch.to(device)).cpu()
+    # هر خروجی همراه با مدلی که آن را تولید کرده برگردانده می‌شود تا لیبل‌ها درست نگاشت شوند
+    return [(row, current) for row in outputs]
+
+
+# درخواست‌های همزمان در یک batch ترکیب می‌شوند
+predict_batcher = MicroBatcher(
+    _forward,
+    max_batch_size=getattr(settings, 'PREDICT_BATCH_MAX_SIZE', 16),
+    max_wait_ms=getattr(settings, 'PREDICT_BATCH_MAX_WAIT_MS', 5),
+    name='predict-batcher',
+)
+
+
+def load_image_tensor(image_file, current=None):
+    """Decode an uploaded image into a normalized input tensor (reduced-resolution JPEG decode)"""
+    current = current or served
+    return current.transform(image_file)
+
+
+def predict_result(output, top_k=None):
+    """
+    Label, calibrated confidence and top-k probabilities for one (logits, served model)
+    pair. Works on the logits of the batched forward pass; no extra model call.
+    """
+    logits, current = output
+    k = top_k or getattr(settings, 'PREDICT_TOP_K', 3)
+    temperature = (current.info or {}).get('temperature', 1.0)
+    indices, probabilities, calibrated = top_k_probabilities(logits.unsqueeze(0), k, temperature)
+    top = [
+        {'label': current.class_names[i], 'probability': p, 'calibrated_probability': c}
+        for i, p, c in zip(indices[0].tolist(), probabilities[0].tolist(), calibrated[0].tolist())
+    ]
+    return {'predicted_label': top[0]['label'], 'confidence': top[0]['calibrated_probability'], 'top_k': top}
+
+
+def served_model_stats():
+    """Version of the model currently served by this process (no loading, no queries)"""
+    current = served
+    if current is None:
+        return None
+    info = current.info or {}
+    return {
+        'version': model_version(current),
+        'generation': current.generation,
+        'sha256': info.get('sha256'),
+        'variant': info.get('variant'),
+        'created_at': info.get('created_at'),
+        'num_classes': len(current.class_names),
+    }
+
+
+# رمزگشایی موازی تصاویر در endpoint دسته‌ای
+decode_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'PREDICT_DECODE_WORKERS', min(8, os.cpu_count() or 1)),
+    thread_name_prefix='image-decode',
+)
+
+# decode و inference ی endpoint ی async؛ وقتی پر باشد درخواست با 429 رد می‌شود
+predict_executor = BoundedExecutor(
+    max_workers=getattr(settings, 'ASYNC_PREDICT_WORKERS', min(8, os.cpu_count() or 1)),
+    max_pending=getattr(settings, 'ASYNC_PREDICT_MAX_PENDING', None),
+    name='async-predict',
+)
@@ -0,0 +1,130 @@
+import os
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import TrainingJob
+
+
+# job kind -> management command that runs it
+JOB_COMMANDS = {
+    'retrain': 'retrain_model',
+}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def enqueue_job(kind='retrain', options=None):
+    """
+    Queue a training job unless one of the same kind is already queued or
+    running. Returns (job, created).
+    """
+    try:
+        with transaction.atomic():
+            return TrainingJob.objects.create(kind=kind, options=options or {}), True
+    except IntegrityError:
+        # unique_active_training_job: یک job فعال از قبل وجود دارد
+        job = TrainingJob.objects.filter(kind=kind, status__in=TrainingJob.ACTIVE_STATUSES).first()
+        if job is None:
+            raise
+        return job, False
+
+
+def cancel_job(job):
+    """Cancel a queued job right away, or ask the worker to stop a running one"""
+    if job.status == TrainingJob.STATUS_QUEUED:
+        updated = TrainingJob.objects.filter(pk=job.pk, status=TrainingJob.STATUS_QUEUED).update(
+            status=TrainingJob.STATUS_CANCELLED, cancel_requested=True, finished_at=timezone.now()
+        )
+        if updated:
+            job.refresh_from_db()
+            return True
+        job.refresh_from_db()
+    if job.status == TrainingJob.STATUS_RUNNING:
+        TrainingJob.objects.filter(pk=job.pk).update(cancel_requested=True)
+        job.refresh_from_db()
+        return True
+    return False
+
+
+def awaiting_worker(job):
+    """
+    True when a queued job has not been claimed within
+    TRAINING_JOB_PICKUP_TIMEOUT seconds, i.e. no training worker is running.
+    """
+    if job.status != TrainingJob.STATUS_QUEUED:
+        return False
+    # فقط یک job فعال از هر نوع وجود دارد، پس job در صف منتظر job دیگری نیست
+    timeout = getattr(settings, 'TRAINING_JOB_PICKUP_TIMEOUT', 60)
+    return timezone.now() - job.created_at > timedelta(seconds=timeout)
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to running and return it (or None)"""
+    for job in TrainingJob.objects.filter(status=TrainingJob.STATUS_QUEUED).order_by('created_at', 'pk')[:5]:
+        claimed = TrainingJob.objects.filter(pk=job.pk, status=TrainingJob.STATUS_QUEUED).update(
+            status=TrainingJob.STATUS_RUNNING, started_at=timezone.now(), worker_pid=os.getpid()
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def fail_orphaned_jobs():
+    """Mark running jobs whose worker process no longer exists as failed"""
+    count = 0
+    for job in TrainingJob.objects.filter(status=TrainingJob.STATUS_RUNNING):
+        if job.worker_pid and _pid_alive(job.worker_pid):
+            continue
+        job.status = TrainingJob.STATUS_FAILED
+        job.error = 'Worker exited before the job finished.'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        count += 1
+    return count
+
+
+def run_job(job):
+    """Run a claimed job in this process and record its outcome"""
+    def epoch_callback(epoch, epochs, metrics):
+        cancel_requested = TrainingJob.objects.filter(pk=job.pk).values_list('cancel_requested', flat=True).first()
+        job.metrics = job.metrics + [{'epoch': epoch, **metrics}]
+        job.epoch = epoch
+        job.total_epochs = epochs
+        job.progress = epoch / epochs if epochs else 1.0
+        job.save(update_fields=['metrics', 'epoch', 'total_epochs', 'progress'])
+        if cancel_requested:
+            raise JobCancelled()
+
+    out = StringIO()
+    try:
+        call_command(JOB_COMMANDS[job.kind], stdout=out, epoch_callback=epoch_callback, **job.options)
+    except JobCancelled:
+        job.status = TrainingJob.STATUS_CANCELLED
+    except Exception as e:
+        job.status = TrainingJob.STATUS_FAILED
+        job.error = str(e)
+    else:
+        job.status = TrainingJob.STATUS_SUCCEEDED
+        job.progress = 1.0
+    job.output = out.getvalue()
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'progress', 'output', 'finished_at'])
+    return job
@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+
+from .models import FoodLabel
+
+
+class LabelRegistry:
+    """
+    Versioned in-memory cache of the FoodLabel names.
+
+    The list is read from the database once and kept until a FoodLabel is
+    saved or deleted (see `signals.handlers`), which bumps `version`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._class_names = None
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def class_names(self):
+        class_names = self._class_names
+        if class_names is None:
+            with self._lock:
+                if self._class_names is None:
+                    try:
+                        self._class_names = list(FoodLabel.objects.order_by('name').values_list('name', flat=True))
+                    except Exception:
+                        return []
+                class_names = self._class_names
+        return list(class_names)
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._class_names = None
+
+
+label_registry = LabelRegistry()
+
+
+def class_map_path(model_path):
+    """Path of the class-name file saved next to a model checkpoint"""
+    return os.path.splitext(model_path)[0] + '.labels.json'
+
+
+def read_class_map(model_path):
+    """Return the class names a checkpoint was trained with, or None if unknown"""
+    try:
+        with open(class_map_path(model_path), encoding='utf-8') as f:
+            return json.load(f)['class_names']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_class_map(model_path, class_names):
+    """Save the ordered class names next to a checkpoint"""
+    with open(class_map_path(model_path), 'w', encoding='utf-8') as f:
+        json.dump({'class_names': list(class_names)}, f, ensure_ascii=False)
@@ -1,31 +1,186 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 import os
 import torch
 import torchvision
-from torchvision import transforms, datasets
+from torchvision import transforms
 from torch import nn
-from torch.utils.data import DataLoader, random_split
-from ai_api.models import FoodLabel, SystemInfo
+from torch.utils.data import random_split
+from ai_api.models import FoodLabel, FoodFeedbackSample, SystemInfo
 from model_core import engine, data_setup
+from model_core.bundle import DEFAULT_TRANSFORM, save_bundle, load_bundle, build_model
+from model_core.incremental import remap_classifier, select_with_replay
+from model_core.bundle import backbone_sha256, build_eval_transform, build_eval_decoder
+from ai_api.embeddings import get_embeddings, ensure_content_hash
+from model_core.shards import TensorShardCache, ShardDataset
+from model_core.metrics import ClassificationMetrics
+from model_core.calibration import collect_logits, fit_temperature
+from model_core.backends import export_onnx, artifact_path, bundle_prefix
+from model_core.quantize import quantize_model, accuracy_regression, save_quantized, quantized_path, default_engine
+from torch.utils.data import TensorDataset, Subset
+from model_core.registry import ModelRegistry
+from django.conf import settings
 from django.utils import timezone
 
 class Command(BaseCommand):
     help = 'Train EfficientNet-B0 on food images and save the model.'
+    # Passed programmatically by the training worker (ai_api.jobs)
+    stealth_options = ('epoch_callback',)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Warm-start from the published model and train on new samples plus a replay buffer.')
+        parser.add_argument('--epochs', type=int, default=None,
+                            help='Number of epochs (default: 15, 5 with --incremental, 30 with --head-only).')
+        parser.add_argument('--replay-size', type=int, default=64,
+                            help='Number of older samples mixed into an incremental run.')
+        parser.add_argument('--head-only', action='store_true',
+                            help='Keep the published backbone frozen and fit only the classifier on cached embeddings.')
+        parser.add_argument('--no-shard-cache', action='store_true',
+                            help='Decode the original images every epoch instead of reading the pre-resized shard cache.')
+        parser.add_argument('--num-workers', type=int, default=None,
+                            help='DataLoader worker processes (default: tuned to the number of CPU cores).')
+        parser.add_argument('--sharing-strategy', choices=sorted(torch.multiprocessing.get_all_sharing_strategies()),
+                            default=None, help='How DataLoader workers share tensors with the training process.')
+        parser.add_argument('--bf16', action='store_true',
+                            help='Run forward passes under bfloat16 autocast.')
+        parser.add_argument('--channels-last', action='store_true',
+                            help='Use channels_last memory format for the model and image batches.')
+        parser.add_argument('--accumulation-steps', type=int, default=1,
+                            help='Batches per optimizer step (effective batch size = 16 x steps).')
+        parser.add_argument('--no-quantize', action='store_true',
+                            help='Do not produce the int8 variant of the published model.')
+        parser.add_argument('--export-onnx', action='store_true',
+                            help='Also export the published model to ONNX (dynamic batch axis) for the onnxruntime backend.')
+
+    def get_samples(self, class_names):
+        """(sample, image path, class index) for every feedback sample whose file exists"""
+        class_index = {name: i for i, name in enumerate(class_names)}
+        samples = []
+        for sample in FoodFeedbackSample.objects.select_related('label').order_by('created_at'):
+            try:
+                path = sample.image.path
+            except ValueError:
+                continue
+            if sample.label.name in class_index and os.path.isfile(path):
+                samples.append((sample, path, class_index[sample.label.name]))
+        return samples
+
+    def train_head(self, all_samples, pointer, class_names, epochs, device, epoch_callback=None, train_options=None):
+        """
+        Fit only the classifier of the published model on pooled backbone
+        embeddings. Embeddings come from the SampleEmbedding cache, so only
+        images never seen by this backbone go through the network.
+        """
+        if len(all_samples) < 2:
+            raise CommandError("At least two images are required for training.")
+        bundle = load_bundle(pointer['path'], mmap=False)
+        model = build_model(bundle).to(device)
+        backbone = bundle['backbone_sha256'] or backbone_sha256(bundle['state_dict'])
+        changes = remap_classifier(model, bundle['class_names'], class_names)
+        self.stdout.write(self.style.SUCCESS(
+            f"Head-only run on backbone {backbone[:12]} of generation {pointer['generation']} "
+            f"({changes['kept']} classes kept, {changes['added']} added, {changes['removed']} removed)"
+        ))
+
+        embeddings, kept = get_embeddings(
+            [sample for sample, _, _ in all_samples], model, backbone,
+            build_eval_decoder(bundle['transform']), device=device,
+        )
+        if len(kept) < len(all_samples):
+            self.stdout.write(self.style.WARNING(f"Skipped {len(all_samples) - len(kept)} unreadable images"))
+            all_samples = [all_samples[i] for i in kept]
+            if len(all_samples) < 2:
+                raise CommandError("At least two readable images are required for training.")
+        targets = torch.tensor([target for _, _, target in all_samples])
+        dataset = TensorDataset(embeddings, targets)
+        train_size = int(0.75 * len(dataset))
+        train_dataset, test_dataset = random_split(
+            dataset, [train_size, len(dataset) - train_size], generator=torch.Generator().manual_seed(42)
+        )
+        # embeddingها در حافظه هستند؛ worker فقط سربار دارد
+        train_loader = data_setup.make_dataloader(train_dataset, batch_size=64, shuffle=True, num_workers=0)
+        test_loader = data_setup.make_dataloader(test_dataset, batch_size=256, shuffle=False, num_workers=0)
+
+        head = model.classifier
+        optimizer = torch.optim.Adam(params=head.parameters(), lr=1e-3)
+        results = engine.train(
+            head, train_loader, test_loader, optimizer, nn.CrossEntropyLoss(), epochs, device=device,
+            epoch_callback=epoch_callback, **(train_options or {}),
+        )
+        heldout = [(all_samples[i][1], all_samples[i][2]) for i in test_dataset.indices]
+        return model.eval(), results, len(dataset), heldout
+
+    def split(self, dataset, train_fraction=0.75):
+        """
+        Seeded random train/test split. Returns (train, test, held-out samples);
+        the held-out samples are taken from dataset.samples, which can be
+        shorter than the list the dataset was built from (ShardDataset drops
+        images that failed to decode).
+        """
+        train_size = int(train_fraction * len(dataset))
+        train_dataset, test_dataset = random_split(
+            dataset, [train_size, len(dataset) - train_size], generator=torch.Generator().manual_seed(42)
+        )
+        return train_dataset, test_dataset, [dataset.samples[i] for i in test_dataset.indices]
+
+    def quantize(self, model, heldout_dataset):
+        """
+        Build the int8 variant, calibrated on held-out images, and check its
+        top-1 accuracy against the fp32 model. Returns (int8 model or None, report).
+        """
+        max_samples = getattr(settings, 'QUANTIZE_CALIBRATION_SAMPLES', 128)
+        if len(heldout_dataset) > max_samples:
+            heldout_dataset = Subset(heldout_dataset, range(max_samples))
+        if len(heldout_dataset) == 0:
+            return None, {'published': False, 'reason': 'No held-out images for calibration.'}
+        batches = list(data_setup.make_dataloader(heldout_dataset, batch_size=16, num_workers=0))
+        engine_name = default_engine()
+        try:
+            int8_model = quantize_model(model, batches, engine=engine_name)
+            report = accuracy_regression(
+                model, int8_model, batches, max_drop=getattr(settings, 'QUANTIZE_MAX_ACCURACY_DROP', 0.02),
+            )
+        except Exception as e:
+            return None, {'published': False, 'reason': f'Quantization failed: {e}'}
+        report.update({'engine': engine_name, 'calibration_samples': len(heldout_dataset), 'published': report['passed']})
+        if not report['passed']:
+            self.stdout.write(self.style.WARNING(
+                f"int8 variant blocked: top-1 {report['int8_acc']:.4f} vs fp32 {report['fp32_acc']:.4f} "
+                f"(drop {report['drop']:.4f} > {report['max_drop']:.4f})"
+            ))
+            return None, report
+        self.stdout.write(self.style.SUCCESS(
+            f"int8 variant: top-1 {report['int8_acc']:.4f} vs fp32 {report['fp32_acc']:.4f}"
+        ))
+        return int8_model, report
 
     def handle(self, *args, **options):
         # Paths
         BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) )
-        DATA_DIR = os.path.join(BASE_DIR, 'data', 'media', 'food_feedback')
-        MODEL_PATH = os.path.join(BASE_DIR, 'data', 'efficientnet_food_classifier.pth')
+        DATA_DIR = os.path.join(getattr(settings, 'MEDIA_ROOT', os.path.join(BASE_DIR, 'data', 'media')), 'food_feedback')
+        REGISTRY_DIR = getattr(settings, 'MODEL_REGISTRY_DIR', os.path.join(BASE_DIR, 'data', 'models'))
 
         # Hyperparameters
         BATCH_SIZE = 16
-        EPOCHS = 15
+        EPOCHS = options.get('epochs') or (30 if options.get('head_only') else 5 if options.get('incremental') else 15)
         LEARNING_RATE = 1e-4
+        REPLAY_SIZE = options.get('replay_size', 64)
+
+        # نمونه‌هایی که بعد از این لحظه اضافه شوند در آموزش بعدی «جدید» حساب می‌شوند
+        started_at = timezone.now()
 
         # Device
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+        # حالت کارایی engine (bf16 / channels_last / gradient accumulation)
+        if options.get('accumulation_steps', 1) < 1:
+            raise CommandError("--accumulation-steps must be at least 1.")
+        train_options = {
+            'amp_dtype': torch.bfloat16 if options.get('bf16') else None,
+            'channels_last': bool(options.get('channels_last')),
+            'accumulation_steps': options.get('accumulation_steps', 1),
+        }
+
         # Get class names from database
         def get_class_names_from_db():
             try:
@@ -38,15 +193,20 @@ class Command(BaseCommand):
         num_classes = len(class_names)
 
         if num_classes < 2:
-            self.stdout.write(self.style.ERROR("At least two classes are required for training."))
-            return
+            raise CommandError("At least two classes are required for training.")
 
         self.stdout.write(self.style.SUCCESS(f"Found {num_classes} classes from database: {class_names}"))
 
+        # معیارهای ارزیابی روی داده‌ی تست (در همان pass محاسبه می‌شوند)
+        train_options['test_metrics'] = ClassificationMetrics(
+            top_k=(1, 3) if num_classes > 3 else (1,), per_class_recall=True, confusion_matrix=True,
+        )
+
         # Transforms with data augmentation for training
-        normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        transform_spec = DEFAULT_TRANSFORM
+        normalize = transforms.Normalize(mean=transform_spec['mean'], std=transform_spec['std'])
         custom_transforms = transforms.Compose([
-            transforms.Resize((224, 224)),
+            transforms.Resize(tuple(transform_spec['resize'])),
             transforms.RandomHorizontalFlip(),                    # قرینه‌سازی افقی
             transforms.RandomVerticalFlip(),                      # قرینه‌سازی عمودی
             transforms.RandomRotation(30),                        # چرخش تصادفی
@@ -54,77 +214,175 @@ class Command(BaseCommand):
             transforms.ToTensor(),
             normalize,
         ])
+        # همان augmentationها روی تنسورهای uint8 از قبل resize شده (shard cache)
+        shard_transforms = transforms.Compose([
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomVerticalFlip(),
+            transforms.RandomRotation(30),
+            transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
+            transforms.ConvertImageDtype(torch.float),
+            normalize,
+        ])
 
-        # Load dataset
+        # Load dataset (class indices follow the database label order)
         if not os.path.exists(DATA_DIR):
-            self.stdout.write(self.style.ERROR(f"Data directory not found: {DATA_DIR}"))
-            return
+            raise CommandError(f"Data directory not found: {DATA_DIR}")
 
-        dataset = datasets.ImageFolder(root=DATA_DIR, transform=custom_transforms)
-        folder_class_names = dataset.classes
-        folder_num_classes = len(folder_class_names)
+        all_samples = self.get_samples(class_names)
+        if not all_samples:
+            raise CommandError(f"No training images found under {DATA_DIR}")
 
-        self.stdout.write(self.style.SUCCESS(f"Found {folder_num_classes} classes in folder structure: {folder_class_names}"))
+        registry = ModelRegistry(REGISTRY_DIR, keep=getattr(settings, 'MODEL_REGISTRY_KEEP', 3))
+        pointer = registry.current()
+        info = SystemInfo.objects.first()
+        incremental = options.get('incremental')
+        head_only = options.get('head_only')
+        if head_only and pointer is None:
+            raise CommandError("--head-only needs a published model to take the backbone from.")
+        if incremental and (pointer is None or info is None or info.last_trained is None):
+            self.stdout.write(self.style.WARNING("No published model to warm-start from; running full training."))
+            incremental = False
 
-        # Verify that folder classes match database classes
-        if set(class_names) != set(folder_class_names):
-            self.stdout.write(self.style.WARNING("Warning: Database classes don't match folder classes!"))
-            self.stdout.write(self.style.WARNING(f"Database: {class_names}"))
-            self.stdout.write(self.style.WARNING(f"Folders: {folder_class_names}"))
-            self.stdout.write(self.style.WARNING("Using database classes for model output."))
+        if head_only:
+            model, results, trained_samples, heldout = self.train_head(
+                all_samples, pointer, class_names, EPOCHS, device, options.get('epoch_callback'), train_options
+            )
+        else:
+            shard_dir = getattr(settings, 'TRAINING_SHARD_CACHE_DIR', None)
+            use_shards = bool(shard_dir) and not options.get('no_shard_cache')
+            if use_shards:
+                # تصاویر یک بار decode و resize می‌شوند؛ فقط نمونه‌های جدید/حذف‌شده به‌روز می‌شوند
+                shard_cache = TensorShardCache(shard_dir, size=transform_spec['resize'])
+                keys = {sample.pk: ensure_content_hash(sample) for sample, _, _ in all_samples}
+                changes = shard_cache.update({keys[sample.pk]: path for sample, path, _ in all_samples})
+                self.stdout.write(self.style.SUCCESS(
+                    f"Shard cache: {len(shard_cache)} images ({changes['added']} added, "
+                    f"{changes['removed']} removed, {changes['failed']} unreadable)"
+                ))
+            # هر نمونه با کلید shard یا مسیر فایل اصلی
+            item = (lambda sample, path: keys[sample.pk]) if use_shards else (lambda sample, path: path)
 
-        # Split dataset
-        train_size = int(0.75 * len(dataset))
-        test_size = len(dataset) - train_size
-        train_dataset, test_dataset = random_split(dataset, [train_size, test_size], generator=torch.Generator().manual_seed(42))
-
-        # DataLoaders
-        train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-        test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=False)
-
-        # Model
-        weights = torchvision.models.EfficientNet_B0_Weights.DEFAULT
-        model = torchvision.models.efficientnet_b0(weights=weights).to(device)
-        model.classifier = nn.Sequential(
-            nn.Dropout(p=0.2, inplace=True),
-            nn.Linear(in_features=1280, out_features=num_classes),
-        ).to(device)
-
-        # Loss and optimizer
-        loss_fn = nn.CrossEntropyLoss()
-        optimizer = torch.optim.Adam(params=model.parameters(), lr=LEARNING_RATE)
-
-        # Import engine and data_setup modules from model_core dir
-        # import sys
-        # sys.path.append(os.path.join(BASE_DIR, 'model_core'))
-        # try:
-        #     import engine
-        #     import data_setup
-        # except ImportError:
-        #     self.stdout.write(self.style.ERROR("engine.py or data_setup.py not found in model_core directory."))
-        #     return
-
-        # Train
-        results = engine.train(
-            model, train_loader, test_loader, optimizer, loss_fn, EPOCHS, device=device
+            if incremental:
+                new_samples = [(item(sample, path), target) for sample, path, target in all_samples if sample.created_at > info.last_trained]
+                if not new_samples:
+                    raise CommandError(f"No new samples since last training ({info.last_trained}).")
+                old_samples = [((item(sample, path), target), target) for sample, path, target in all_samples if sample.created_at <= info.last_trained]
+                samples = select_with_replay(new_samples, old_samples, REPLAY_SIZE)
+                self.stdout.write(self.style.SUCCESS(
+                    f"Incremental run: {len(new_samples)} new samples + {len(samples) - len(new_samples)} replayed"
+                ))
+            else:
+                samples = [(item(sample, path), target) for sample, path, target in all_samples]
+
+            if use_shards:
+                dataset = ShardDataset(shard_cache, samples, class_names, transform=shard_transforms)
+            else:
+                dataset = data_setup.SampleListDataset(
+                    samples, class_names, transform=custom_transforms, decode_size=transform_spec['resize'],
+                )
+            if len(dataset) < 2:
+                raise CommandError("At least two images are required for training.")
+
+            # Split dataset
+            train_dataset, test_dataset, heldout = self.split(dataset)
+
+            # DataLoaders (decode و augmentation در worker processها، موازی با آموزش)
+            loader_options = {
+                'num_workers': options.get('num_workers'),
+                'sharing_strategy': options.get('sharing_strategy'),
+            }
+            train_loader = data_setup.make_dataloader(train_dataset, BATCH_SIZE, shuffle=True, **loader_options)
+            test_loader = data_setup.make_dataloader(test_dataset, BATCH_SIZE, shuffle=False, **loader_options)
+            self.stdout.write(self.style.SUCCESS(
+                f"Loading data with {train_loader.num_workers} worker processes"
+            ))
+
+            # Model
+            if incremental:
+                # ادامه‌ی آموزش از آخرین مدل منتشرشده؛ سطرهای لیبل‌های قبلی حفظ می‌شوند
+                bundle = load_bundle(pointer['path'], mmap=False)
+                model = build_model(bundle).to(device)
+                changes = remap_classifier(model, bundle['class_names'], class_names)
+                self.stdout.write(self.style.SUCCESS(
+                    f"Warm-started from generation {pointer['generation']} "
+                    f"({changes['kept']} classes kept, {changes['added']} added, {changes['removed']} removed)"
+                ))
+            else:
+                weights = torchvision.models.EfficientNet_B0_Weights.DEFAULT
+                model = torchvision.models.efficientnet_b0(weights=weights).to(device)
+                model.classifier = nn.Sequential(
+                    nn.Dropout(p=0.2, inplace=True),
+                    nn.Linear(in_features=1280, out_features=num_classes),
+                ).to(device)
+
+            # Loss and optimizer
+            loss_fn = nn.CrossEntropyLoss()
+            optimizer = torch.optim.Adam(params=model.parameters(), lr=LEARNING_RATE)
+
+            # Train
+            results = engine.train(
+                model, train_loader, test_loader, optimizer, loss_fn, EPOCHS, device=device,
+                epoch_callback=options.get('epoch_callback'), **train_options,
+            )
+            trained_samples = len(dataset)
+
+        # داده‌ی کنار گذاشته‌شده با transform ارزیابی (بدون augmentation)
+        if not head_only and use_shards:
+            heldout_dataset = ShardDataset(shard_cache, heldout, class_names, transform=transforms.Compose([
+                transforms.ConvertImageDtype(torch.float), normalize,
+            ]))
+        else:
+            heldout_dataset = data_setup.SampleListDataset(
+                heldout, class_names, transform=build_eval_transform(transform_spec), decode_size=transform_spec['resize'],
+            )
+
+        # Temperature scaling: اطمینان (confidence) کالیبره‌شده در پاسخ predict
+        heldout_logits, heldout_targets = collect_logits(
+            model, data_setup.make_dataloader(heldout_dataset, BATCH_SIZE, num_workers=0), device=device,
         )
+        temperature = fit_temperature(heldout_logits, heldout_targets)
+        self.stdout.write(self.style.SUCCESS(
+            f"Calibrated temperature {temperature:.3f} on {len(heldout_targets)} held-out images"
+        ))
+
+        # نسخه‌ی int8 برای سرورهای CPU؛ کالیبره و ارزیابی روی همان داده‌ی کنار گذاشته‌شده
+        int8_model, quantization = None, None
+        if getattr(settings, 'QUANTIZE_ON_PUBLISH', True) and not options.get('no_quantize'):
+            int8_model, quantization = self.quantize(model, heldout_dataset)
+
+        # Publish model bundle (weights + class list + transform spec + metrics).
+        # The bundle is written to a temp file and swapped in atomically, so
+        # running servers never see a missing or half-written model.
+        # The int8 variant (if it passed the accuracy check) is written next to
+        # the bundle before the pointer moves.
+        def write(path):
+            if int8_model is not None:
+                save_quantized(quantized_path(path), int8_model, torch.zeros(1, 3, *transform_spec['resize']))
+            meta = save_bundle(
+                path, model, class_names, transform=transform_spec, temperature=temperature,
+                metrics={**results, 'total_samples': len(all_samples), 'incremental': incremental,
+                         'head_only': bool(head_only), 'trained_samples': trained_samples,
+                         'quantization': quantization},
+            )
+            if options.get('export_onnx'):
+                # همان مسیری که backend‌ـه onnxruntime دنبالش می‌گردد، پس سرور دوباره export نمی‌کند
+                export_onnx(model, artifact_path('onnxruntime', bundle_prefix(path), meta['sha256'], 'cpu'),
+                            transform_spec['resize'])
+            return meta
+
+        pointer = registry.publish(write)
+        self.stdout.write(self.style.SUCCESS(
+            f"Model published to {pointer['path']} (generation {pointer['generation']}, sha256 {pointer['sha256'][:12]})"
+        ))
 
-        # ذخیره دقت مدل در SystemInfo
+        # ذخیره دقت مدل در SystemInfo؛ فقط بعد از publish موفق، وگرنه اجرای بعدی --incremental
+        # نمونه‌هایی را که هیچ مدل منتشرشده‌ای رویشان آموزش ندیده نادیده می‌گیرد
         if 'test_acc' in results and isinstance(results['test_acc'], list):
             accuracy = results['test_acc'][-1]
         else:
             accuracy = results.get('test_acc', None)
         info, _ = SystemInfo.objects.get_or_create(pk=1)
         info.accuracy = accuracy
-        info.last_trained = timezone.now()
-        info.total_samples = len(train_dataset) + len(test_dataset)
+        info.last_trained = started_at
+        info.total_samples = len(all_samples)
         info.save()
-        
-        # Remove old model file if it exists
-        if os.path.exists(MODEL_PATH):
-            os.remove(MODEL_PATH)
-            self.stdout.write(self.style.WARNING(f"Removed old model file: {MODEL_PATH}"))
-
-        # Save model
-        torch.save(model.state_dict(), MODEL_PATH)
-        self.stdout.write(self.style.SUCCESS(f"Model saved to {MODEL_PATH}")) 
\ No newline at end of file
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ai_api.jobs import claim_next_job, run_job
+from ai_api.scheduler import check_and_enqueue
+
+
+class Command(BaseCommand):
+    help = ('Queue a retrain job when enough new feedback samples (or enough label drift) '
+            'have arrived since the last training.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            default=getattr(settings, 'RETRAIN_CHECK_INTERVAL', 60),
+                            help='Seconds between checks.')
+        parser.add_argument('--once', action='store_true', help='Check once and exit.')
+        parser.add_argument('--run-jobs', action='store_true',
+                            help='Also run queued jobs in this process (no separate run_training_worker).')
+
+    def handle(self, *args, **options):
+        while True:
+            job, reason = check_and_enqueue()
+            self.stdout.write(f"{'Queued' if job else 'Skipped'}: {reason}")
+            if options['run_jobs']:
+                claimed = claim_next_job()
+                if claimed is not None:
+                    run_job(claimed)
+                    self.stdout.write(f"{claimed}: {claimed.error or 'done'}")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
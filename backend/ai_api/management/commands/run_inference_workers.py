@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ai_api.inference import MODEL_PATH, registry
+from model_core.worker_pool import InferenceWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Run the inference worker pool used by INFERENCE_BACKEND = 'remote'."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'INFERENCE_WORKERS', 2),
+                            help='Number of worker processes; the CPU cores are split between them.')
+        parser.add_argument('--socket', default=str(getattr(settings, 'INFERENCE_WORKER_SOCKET', os.path.join(settings.BASE_DIR, 'data', 'inference.sock'))),
+                            help='Unix socket to listen on.')
+        parser.add_argument('--backend', default=getattr(settings, 'INFERENCE_WORKER_BACKEND', 'eager'),
+                            help='Inference backend inside each worker (eager, torchscript, onnxruntime).')
+        parser.add_argument('--threads-per-worker', type=int, default=None,
+                            help='Intra-op threads per worker (default: its number of cores).')
+        parser.add_argument('--timeout', type=float, default=getattr(settings, 'INFERENCE_WORKER_TIMEOUT', 30.0),
+                            help='Seconds a worker waits on a silent client before dropping the connection.')
+        parser.add_argument('--max-payload-mb', type=float, default=getattr(settings, 'INFERENCE_WORKER_MAX_PAYLOAD_MB', 64),
+                            help='Largest request payload a worker accepts.')
+
+    def handle(self, *args, **options):
+        pool = InferenceWorkerPool(
+            options['socket'],
+            root=registry.root,
+            # checkpoint قدیمی خارج از registry هم سرو شود
+            allowed_paths=[MODEL_PATH],
+            workers=options['workers'],
+            backend=options['backend'],
+            threads_per_worker=options['threads_per_worker'],
+            timeout=options['timeout'],
+            max_payload=int(options['max_payload_mb'] * 1024 * 1024),
+        )
+        for i, cores in enumerate(pool.cores):
+            self.stdout.write(f"inference-worker-{i}: cores {cores}")
+        self.stdout.write(self.style.SUCCESS(f"Listening on {options['socket']}"))
+        try:
+            pool.serve_forever()
+        except KeyboardInterrupt:
+            pass
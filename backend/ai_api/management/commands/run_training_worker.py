@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ai_api.jobs import claim_next_job, fail_orphaned_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued training jobs (retrain requests) outside the web process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Seconds to wait between checks for new jobs.')
+        parser.add_argument('--once', action='store_true',
+                            help='Run at most one job and exit.')
+
+    def handle(self, *args, **options):
+        orphaned = fail_orphaned_jobs()
+        if orphaned:
+            self.stdout.write(self.style.WARNING(f"Marked {orphaned} orphaned job(s) as failed."))
+
+        while True:
+            job = claim_next_job()
+            if job is not None:
+                self.stdout.write(f"Running {job}")
+                run_job(job)
+                style = self.style.SUCCESS if job.status == job.STATUS_SUCCEEDED else self.style.ERROR
+                self.stdout.write(style(f"{job}: {job.error or 'done'}"))
+            if options['once']:
+                return
+            if job is None:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai_api", "0003_trainingjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="foodfeedbacksample",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                help_text="sha256 محتوای تصویر",
+                max_length=64,
+            ),
+        ),
+        migrations.CreateModel(
+            name="SampleEmbedding",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("content_hash", models.CharField(max_length=64)),
+                (
+                    "backbone",
+                    models.CharField(
+                        help_text="sha256 وزن\u200cهای backbone", max_length=64
+                    ),
+                ),
+                ("vector", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("content_hash", "backbone"),
+                        name="unique_embedding_per_backbone",
+                    )
+                ],
+            },
+        ),
+    ]
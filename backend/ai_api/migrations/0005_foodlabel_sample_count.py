@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:55
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_sample_count(apps, schema_editor):
+    FoodLabel = apps.get_model("ai_api", "FoodLabel")
+    FoodFeedbackSample = apps.get_model("ai_api", "FoodFeedbackSample")
+    counts = (
+        FoodFeedbackSample.objects.filter(label=OuterRef("pk"))
+        .order_by()
+        .values("label")
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    FoodLabel.objects.update(sample_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai_api", "0004_sampleembedding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="foodlabel",
+            name="sample_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_sample_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai_api", "0005_foodlabel_sample_count"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="foodfeedbacksample",
+            index=models.Index(
+                fields=["label", "created_at", "id"], name="feedback_label_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="foodfeedbacksample",
+            index=models.Index(
+                fields=["created_at", "id"], name="feedback_created_idx"
+            ),
+        ),
+    ]
@@ -5,6 +5,8 @@ import uuid
 
 class FoodLabel(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    # تعداد نمونه‌ها؛ توسط signal ها به‌روز نگه داشته می‌شود (signals/handlers.py)
+    sample_count = models.PositiveIntegerField(default=0, editable=False)
     def __str__(self):
         return self.name
 
@@ -21,10 +23,33 @@ class FoodFeedbackSample(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     is_correct = models.BooleanField(null=True, blank=True, help_text='آیا پیش‌بینی مدل درست بوده است؟')
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text='sha256 محتوای تصویر')
+
+    class Meta:
+        indexes = [
+            # فیلتر لیبل + مرتب‌سازی/cursor روی (created_at, id) در لیست فیدبک‌ها
+            models.Index(fields=['label', 'created_at', 'id'], name='feedback_label_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='feedback_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.label} - {self.created_at}"
 
+class SampleEmbedding(models.Model):
+    """Pooled backbone features of an image, keyed by image content and backbone version"""
+    content_hash = models.CharField(max_length=64)
+    backbone = models.CharField(max_length=64, help_text='sha256 وزن‌های backbone')
+    vector = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'backbone'], name='unique_embedding_per_backbone'),
+        ]
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} @ {self.backbone[:12]}"
+
 class SystemInfo(models.Model):
     accuracy = models.FloatField(null=True, blank=True)
     last_trained = models.DateTimeField(null=True, blank=True)
@@ -33,3 +58,52 @@ class SystemInfo(models.Model):
 
     def __str__(self):
         return f"SystemInfo (accuracy={self.accuracy}, last_trained={self.last_trained})"
+
+class TrainingJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    kind = models.CharField(max_length=50, default='retrain')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    options = models.JSONField(default=dict, blank=True)
+    epoch = models.IntegerField(default=0)
+    total_epochs = models.IntegerField(null=True, blank=True)
+    progress = models.FloatField(default=0.0)
+    metrics = models.JSONField(default=list, blank=True, help_text='معیارهای هر epoch')
+    output = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    worker_pid = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # در هر لحظه فقط یک job فعال از هر نوع وجود دارد
+            models.UniqueConstraint(
+                fields=['kind'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_training_job',
+            ),
+        ]
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    def __str__(self):
+        return f"TrainingJob #{self.pk} ({self.kind}, {self.status})"
+
@@ -0,0 +1,105 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import torch
+from django.core.cache import caches
+
+
+def upload_sha256(uploaded_file):
+    """sha256 of an uploaded file's bytes; the file is rewound afterwards"""
+    if getattr(uploaded_file, 'sha256', None):
+        # computed while the upload streamed in (see uploads.StreamingImageUploadHandler)
+        uploaded_file.seek(0)
+        return uploaded_file.sha256
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def model_version(served):
+    """Identifies the weights and variant (fp32 backend / int8) a prediction was made with"""
+    info = served.info or {}
+    return f"{served.generation}:{(info.get('sha256') or '')[:16]}:{info.get('variant', '')}"
+
+
+class PredictionCache:
+    """
+    Logits of recent predictions keyed by (image content hash, model version).
+
+    An in-process LRU bounded to `max_entries`, optionally backed by a Django
+    cache alias (e.g. a file-based cache shared by several workers). Because
+    the model version is part of the key, entries of older models are never
+    returned; the LRU is also cleared whenever a new model is swapped in.
+    """
+
+    def __init__(self, max_entries=1024, alias=None, timeout=24 * 60 * 60):
+        self.max_entries = max_entries
+        self.alias = alias
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or bool(self.alias)
+
+    def _key(self, content_hash, served):
+        return f'predict:{model_version(served)}:{content_hash}'
+
+    def get(self, content_hash, served):
+        """(logits, served) like a batcher output, or None on a miss"""
+        if not self.enabled:
+            return None
+        key = self._key(content_hash, served)
+        with self._lock:
+            logits = self._entries.get(key)
+            if logits is not None:
+                self._entries.move_to_end(key)
+        if logits is None and self.alias:
+            values = caches[self.alias].get(key)
+            if values is not None:
+                logits = torch.tensor(values)
+                self._remember(key, logits)
+        with self._lock:
+            if logits is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return logits, served
+
+    def set(self, content_hash, output):
+        """
+        Store a batcher output (logits, served) for this image. The key uses the
+        model that produced the logits, which differs from the one the request
+        saw if a new model was swapped in meanwhile.
+        """
+        if not self.enabled:
+            return
+        logits, served = output
+        key = self._key(content_hash, served)
+        logits = logits.detach().cpu()
+        self._remember(key, logits)
+        if self.alias:
+            caches[self.alias].set(key, logits.tolist(), self.timeout)
+
+    def _remember(self, key, logits):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = logits
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
@@ -1,7 +1,9 @@
-import time
+import os
 import subprocess
+import sys
 
-while True:
-    subprocess.run(['python', 'retrain_model.py'])
-    # time.sleep(24 * 60 * 60)  # 24 ساعت
-    time.sleep(60)  # 1 دقیقه
\ No newline at end of file
+# زمان‌بندی آموزش مجدد: فقط وقتی داده‌ی جدید کافی اضافه شده باشد مدل آموزش می‌بیند
+# (تنظیمات RETRAIN_* در settings.py)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+subprocess.run([sys.executable, os.path.join(BACKEND_DIR, 'manage.py'), 'retrain_scheduler', '--run-jobs'] + sys.argv[1:])
@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .jobs import enqueue_job
+from .models import FoodFeedbackSample, SystemInfo, TrainingJob
+
+
+def label_drift(old_counts, new_counts):
+    """
+    Total variation distance between the label distributions of the samples
+    the model was trained on and the samples added since (0 = same, 1 = disjoint).
+    """
+    old_total = sum(old_counts.values())
+    new_total = sum(new_counts.values())
+    if not new_total:
+        return 0.0
+    if not old_total:
+        return 1.0
+    labels = set(old_counts) | set(new_counts)
+    return 0.5 * sum(abs(old_counts.get(l, 0) / old_total - new_counts.get(l, 0) / new_total) for l in labels)
+
+
+def retrain_decision(now=None):
+    """
+    Decide whether the data changed enough since SystemInfo.last_trained to
+    justify a retrain. Returns (should_retrain, reason, stats).
+    """
+    now = now or timezone.now()
+    min_new_samples = getattr(settings, 'RETRAIN_MIN_NEW_SAMPLES', 20)
+    drift_threshold = getattr(settings, 'RETRAIN_DRIFT_THRESHOLD', 0.2)
+    drift_min_samples = getattr(settings, 'RETRAIN_DRIFT_MIN_SAMPLES', 5)
+    min_interval = timedelta(seconds=getattr(settings, 'RETRAIN_MIN_INTERVAL', 3600))
+
+    info = SystemInfo.objects.first()
+    last_trained = info.last_trained if info else None
+
+    # یک query: تعداد نمونه‌های هر لیبل قبل و بعد از آخرین آموزش
+    old_counts, new_counts = {}, {}
+    if last_trained is not None:
+        rows = FoodFeedbackSample.objects.values('label_id').annotate(
+            old=Count('id', filter=Q(created_at__lte=last_trained)),
+            new=Count('id', filter=Q(created_at__gt=last_trained)),
+        )
+        for row in rows:
+            if row['old']:
+                old_counts[row['label_id']] = row['old']
+            if row['new']:
+                new_counts[row['label_id']] = row['new']
+    else:
+        for row in FoodFeedbackSample.objects.values('label_id').annotate(new=Count('id')):
+            new_counts[row['label_id']] = row['new']
+    new_samples = sum(new_counts.values())
+    drift = label_drift(old_counts, new_counts)
+    stats = {'last_trained': last_trained, 'new_samples': new_samples, 'drift': drift}
+
+    if new_samples == 0:
+        return False, 'No new samples since last training.', stats
+
+    last_job = TrainingJob.objects.filter(kind='retrain').order_by('-created_at').first()
+    last_attempt = max([t for t in (last_trained, last_job and last_job.created_at) if t], default=None)
+    if last_attempt is not None and now - last_attempt < min_interval:
+        return False, f'Minimum retrain interval not reached (last run {last_attempt.isoformat()}).', stats
+
+    if last_trained is None:
+        if len(new_counts) < 2:
+            return False, 'At least two labels with samples are required for training.', stats
+        return True, 'Model has never been trained.', stats
+    if new_samples >= min_new_samples:
+        return True, f'{new_samples} new samples since last training.', stats
+    if new_samples >= drift_min_samples and drift >= drift_threshold:
+        return True, f'Label drift {drift:.2f} exceeds threshold {drift_threshold:.2f}.', stats
+    return False, f'{new_samples} new samples, drift {drift:.2f}: below thresholds.', stats
+
+
+def check_and_enqueue(now=None):
+    """
+    Queue a retrain job when retrain_decision() says so. Triggers coalesce
+    into the already active job, if there is one. Returns (job or None, reason).
+    """
+    should_retrain, reason, stats = retrain_decision(now)
+    if not should_retrain:
+        return None, reason
+    # وقتی مدلی قبلاً آموزش دیده، فقط روی داده‌ی جدید (+ replay) ادامه بده
+    incremental = getattr(settings, 'RETRAIN_INCREMENTAL', True) and stats['last_trained'] is not None
+    job, created = enqueue_job('retrain', options={'incremental': incremental})
+    if not created:
+        reason = f'{reason} Coalesced into active job #{job.pk}.'
+    return job, reason
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import FoodFeedbackSample, FoodLabel
+from .models import FoodFeedbackSample, FoodLabel, TrainingJob
+from .jobs import awaiting_worker
 import os
 from django.conf import settings
 
@@ -11,7 +12,9 @@ class FoodLabelSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'sample_count']
 
     def get_sample_count(self, obj):
-        return obj.samples.count()
+        # لیست لیبل‌ها تعداد را با یک aggregate محاسبه می‌کند؛ در بقیه‌ی جاها ستون denormalized خوانده می‌شود
+        annotated = getattr(obj, 'annotated_sample_count', None)
+        return annotated if annotated is not None else obj.sample_count
 
 class FoodFeedbackSampleSerializer(serializers.ModelSerializer):
     label = FoodLabelSerializer(read_only=True)
@@ -37,4 +40,20 @@ class ShowFoodFeedbackSampleSerializer(serializers.ModelSerializer):
 
 
 class ImageOnlySerializer(serializers.Serializer):
-    image = serializers.ImageField() 
\ No newline at end of file
+    image = serializers.ImageField()
+
+
+class TrainingJobSerializer(serializers.ModelSerializer):
+    # job در صف که هیچ worker آن را برنداشته (run_training_worker اجرا نمی‌شود)
+    waiting_for_worker = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TrainingJob
+        fields = ['id', 'kind', 'status', 'options', 'epoch', 'total_epochs', 'progress', 'metrics',
+                  'output', 'error', 'cancel_requested', 'created_at', 'started_at', 'finished_at',
+                  'waiting_for_worker']
+        read_only_fields = fields
+
+    def get_waiting_for_worker(self, obj):
+        return awaiting_worker(obj)
+
@@ -1,11 +1,61 @@
-from itertools import islice
 import os
 
-from django.conf import settings
+from django.db.models import F
 from django.db.models.signals import post_save, post_delete, pre_save
+from django.db import transaction
 from django.dispatch import receiver
 from .remove_functions import delete_file_when_delete, delete_file_when_update
-from ..models import FoodFeedbackSample
+from ..models import FoodFeedbackSample, FoodLabel, SystemInfo
+from ..label_registry import label_registry
+from ..embeddings import schedule_embedding
+from ..prediction_cache import upload_sha256
+from ..stats import invalidate_system_stats
+
+
+#  HASH NEW IMAGE OF  -- FoodFeedbackSample --
+@receiver(pre_save, sender=FoodFeedbackSample)
+def set_content_hash_from_upload(sender, instance, raw=False, **kwargs):
+    image = instance.image
+    if raw or not image or image._committed:
+        return
+    # digest ای که StreamingImageUploadHandler حین آپلود حساب کرده؛ فایل ذخیره‌شده دوباره خوانده نمی‌شود
+    instance.content_hash = upload_sha256(image.file)
+
+
+#  EMBED NEW IMAGE OF  -- FoodFeedbackSample --
+@receiver(post_save, sender=FoodFeedbackSample)
+def embed_food_feedback_on_create(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: schedule_embedding(instance.pk))
+
+
+#  KEEP sample_count OF  -- FoodLabel --  IN SYNC
+def _adjust_sample_count(label_id, delta):
+    labels = FoodLabel.objects.filter(pk=label_id)
+    if delta < 0:
+        labels = labels.filter(sample_count__gte=-delta)
+    labels.update(sample_count=F('sample_count') + delta)
+
+@receiver(post_save, sender=FoodFeedbackSample)
+def update_label_sample_count_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_label_id', None)
+    if created:
+        _adjust_sample_count(instance.label_id, 1)
+    elif previous is not None and previous != instance.label_id:
+        _adjust_sample_count(previous, -1)
+        _adjust_sample_count(instance.label_id, 1)
+    else:
+        return
+    instance._previous_label_id = instance.label_id
+    if FoodFeedbackSample.label.is_cached(instance):
+        # پاسخ API همان شیء label را serialize می‌کند
+        instance.label.refresh_from_db(fields=['sample_count'])
+
+@receiver(post_delete, sender=FoodFeedbackSample)
+def update_label_sample_count_on_delete(sender, instance, **kwargs):
+    _adjust_sample_count(instance.label_id, -1)
 
 
 #  DELETE IMAGE OF  -- FoodFeedbackSample --
@@ -26,14 +76,16 @@ def auto_delete_file_food_feedback_on_change(sender, instance, **kwargs):
     try:
         old_object = FoodFeedbackSample.objects.get(pk=instance.pk)
         old_image = old_object.image
-        old_label = old_object.label.id
+        old_label = old_object.label_id
     except FoodFeedbackSample.DoesNotExist:
         return False
 
+    # برای به‌روزرسانی sample_count در post_save
+    instance._previous_label_id = old_label
     new_image = instance.image
-    new_label = instance.label.id
-    
-    if (old_image != new_image or old_label != new_label) and old_image:
+
+    # فقط وقتی خود تصویر عوض شده حذف شود؛ با تغییر لیبل، ردیف هنوز به همان فایل اشاره می‌کند
+    if old_image != new_image and old_image:
         try:
             if os.path.isfile(old_image.path):
                 os.remove(old_image.path)
@@ -41,3 +93,21 @@ def auto_delete_file_food_feedback_on_change(sender, instance, **kwargs):
             return False
 
 
+#  INVALIDATE CACHED LABELS OF  -- FoodLabel --
+@receiver(post_save, sender=FoodLabel)
+@receiver(post_delete, sender=FoodLabel)
+def invalidate_label_registry(sender, instance, **kwargs):
+    label_registry.invalidate()
+
+
+#  INVALIDATE CACHED SYSTEM STATS OF  -- FoodFeedbackSample / FoodLabel / SystemInfo --
+@receiver(post_save, sender=FoodFeedbackSample)
+@receiver(post_delete, sender=FoodFeedbackSample)
+@receiver(post_save, sender=FoodLabel)
+@receiver(post_delete, sender=FoodLabel)
+@receiver(post_save, sender=SystemInfo)
+@receiver(post_delete, sender=SystemInfo)
+def invalidate_cached_system_stats(sender, **kwargs):
+    invalidate_system_stats()
+    # دوباره بعد از commit، اگر درخواستی در این فاصله داده‌ی قدیمی را کش کرده باشد
+    transaction.on_commit(invalidate_system_stats)
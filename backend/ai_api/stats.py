@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import CharField, Count, DateTimeField, FloatField, IntegerField, Q, Subquery, Value
+
+from .models import FoodLabel, SystemInfo
+
+CACHE_KEY = 'ai_api:system_stats'
+
+
+def _ratio(part, total):
+    return part / total if total else None
+
+
+def _cache():
+    return caches[getattr(settings, 'SYSTEM_STATS_CACHE_ALIAS', 'default')]
+
+
+def compute_system_stats():
+    """
+    Feedback totals, per-label counts and SystemInfo in a single query: one
+    row per label with conditional counts over its samples, UNION ALL one
+    row with the SystemInfo fields (there even when no label exists).
+    """
+    labels = FoodLabel.objects.order_by().values('id', 'name').annotate(
+        samples_total=Count('samples'),
+        correct=Count('samples', filter=Q(samples__is_correct=True)),
+        incorrect=Count('samples', filter=Q(samples__is_correct=False)),
+        accuracy=Value(None, FloatField()),
+        last_trained=Value(None, DateTimeField()),
+        total_samples=Value(None, IntegerField()),
+    )
+    # ردیف SystemInfo با id=None از ردیف لیبل‌ها جدا می‌شود
+    info = SystemInfo.objects.filter(
+        pk=Subquery(SystemInfo.objects.order_by('pk').values('pk')[:1])
+    ).annotate(
+        label_id=Value(None, IntegerField()),
+        label_name=Value(None, CharField()),
+        samples_total=Value(0, IntegerField()),
+        correct=Value(0, IntegerField()),
+        incorrect=Value(0, IntegerField()),
+    ).values('label_id', 'label_name', 'samples_total', 'correct', 'incorrect', 'accuracy', 'last_trained', 'total_samples')
+
+    rows = list(labels.union(info, all=True).order_by('name'))
+    system_info = next((row for row in rows if row['id'] is None), {})
+    rows = [row for row in rows if row['id'] is not None]
+
+    labels = [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'sample_count': row['samples_total'],
+            'correct': row['correct'],
+            'incorrect': row['incorrect'],
+            'correct_ratio': _ratio(row['correct'], row['correct'] + row['incorrect']),
+        }
+        for row in rows
+    ]
+    feedback_count = sum(label['sample_count'] for label in labels)
+    correct = sum(label['correct'] for label in labels)
+    incorrect = sum(label['incorrect'] for label in labels)
+    return {
+        'feedback_count': feedback_count,
+        'label_count': len(labels),
+        'correct_predictions': correct,
+        'incorrect_predictions': incorrect,
+        'unreviewed_predictions': feedback_count - correct - incorrect,
+        'correct_ratio': _ratio(correct, correct + incorrect),
+        'incorrect_ratio': _ratio(incorrect, correct + incorrect),
+        'accuracy': system_info.get('accuracy'),
+        'last_trained': system_info.get('last_trained'),
+        'total_samples': system_info.get('total_samples'),
+        'labels': labels,
+    }
+
+
+def system_stats_snapshot():
+    """
+    compute_system_stats() cached for SYSTEM_STATS_CACHE_TIMEOUT seconds.
+    Signals invalidate it in the process that made the change; other
+    processes see the change once their copy expires, unless
+    SYSTEM_STATS_CACHE_ALIAS names a cache they share.
+    """
+    cache = _cache()
+    stats = cache.get(CACHE_KEY)
+    if stats is None:
+        stats = compute_system_stats()
+        cache.set(CACHE_KEY, stats, getattr(settings, 'SYSTEM_STATS_CACHE_TIMEOUT', 10))
+    return stats
+
+
+def invalidate_system_stats():
+    _cache().delete(CACHE_KEY)
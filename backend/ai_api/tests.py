@@ -1,9 +1,10 @@
 from django.test import TestCase
 from rest_framework.test import APIClient
 from django.urls import reverse
-from .models import FoodLabel, FoodFeedbackSample
+from .models import FoodLabel, FoodFeedbackSample, TrainingJob
 from django.core.files.uploadedfile import SimpleUploadedFile
 import io
+from unittest import mock
 from PIL import Image
 
 def create_test_image():
@@ -63,3 +64,1046 @@ class APITest(TestCase):
         response = self.client.post('/api/food/submit-feedback/', data, format='multipart')
         self.assertEqual(response.status_code, 400)
         self.assertIn('error', response.json())
+
+class MicroBatcherTest(TestCase):
+    def test_concurrent_requests_are_coalesced(self):
+        import threading
+        import torch
+        from model_core.batching import MicroBatcher
+
+        seen = []
+        def forward(batch):
+            seen.append(batch.shape[0])
+            return batch * 2
+
+        batcher = MicroBatcher(forward, max_batch_size=4, max_wait_ms=200)
+        results = {}
+        def worker(i):
+            results[i] = batcher.submit(torch.tensor([float(i)]))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual({i: float(r) for i, r in results.items()}, {i: 2.0 * i for i in range(4)})
+        self.assertLess(len(seen), 4)
+        stats = batcher.stats()
+        self.assertEqual(stats['items'], 4)
+        self.assertEqual(sum(stats['batch_size_histogram'].values()), len(seen))
+
+    def test_inference_stats(self):
+        response = APIClient().get('/api/food/inference-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('batch_size_histogram', response.json())
+
+def tiny_model(num_classes=2):
+    import torch
+    return torch.nn.Sequential(
+        torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(3, num_classes)
+    ).eval()
+
+def tiny_served(class_names=('pizza', 'steak')):
+    from ai_api.inference import ServedModel
+    from model_core.bundle import build_eval_decoder
+    import uuid
+    # a fresh "weights hash" per model so prediction cache entries never leak between tests
+    return ServedModel(
+        tiny_model(len(class_names)), list(class_names), build_eval_decoder(), {'sha256': uuid.uuid4().hex}, 0, None,
+    )
+
+class PredictBatchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        FoodLabel.objects.create(name='pizza')
+        FoodLabel.objects.create(name='steak')
+
+    def test_no_images(self):
+        response = self.client.post('/api/food/predict-batch/', {}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_multipart_list_with_invalid_file(self):
+        from unittest import mock
+        from ai_api import inference
+        bad = SimpleUploadedFile('notes.txt', b'hello', content_type='text/plain')
+        with mock.patch.object(inference, 'served', tiny_served()):
+            response = self.client.post(
+                '/api/food/predict-batch/',
+                {'images': [create_test_image(), bad, create_test_image()]},
+                format='multipart',
+            )
+        self.assertEqual(response.status_code, 200)
+        predictions = response.json()['predictions']
+        self.assertEqual(len(predictions), 3)
+        self.assertIn(predictions[0]['predicted_label'], ['pizza', 'steak'])
+        self.assertIn('error', predictions[1])
+        self.assertIn('predicted_label', predictions[2])
+
+    def test_zip_archive(self):
+        import zipfile
+        from unittest import mock
+        from ai_api import inference
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as archive:
+            archive.writestr('a.jpg', create_test_image().read())
+            archive.writestr('b.jpg', create_test_image().read())
+        archive_file = SimpleUploadedFile('album.zip', buf.getvalue(), content_type='application/zip')
+        with mock.patch.object(inference, 'served', tiny_served()):
+            response = self.client.post('/api/food/predict-batch/', {'archive': archive_file}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['filename'] for p in response.json()['predictions']], ['a.jpg', 'b.jpg'])
+
+    def test_zip_archive_is_streamed_in_batch_sized_chunks(self):
+        import zipfile
+        from django.test import override_settings
+        from ai_api import inference
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as archive:
+            for i in range(5):
+                image = Image.new('RGB', (32, 32), color=(i * 40, 0, 0))
+                member = io.BytesIO()
+                image.save(member, format='PNG')
+                archive.writestr(f'{i}.png', member.getvalue())
+            archive.writestr('notes.txt', b'hello')
+        archive_file = SimpleUploadedFile('album.zip', buf.getvalue(), content_type='application/zip')
+        submit_many = inference.predict_batcher.submit_many
+        with mock.patch.object(inference, 'served', tiny_served()), override_settings(PREDICT_BATCH_MAX_SIZE=2), \
+                mock.patch.object(zipfile.ZipFile, 'read', side_effect=AssertionError('member read into memory')), \
+                mock.patch.object(inference.predict_batcher, 'submit_many', side_effect=submit_many) as batches:
+            response = self.client.post('/api/food/predict-batch/', {'archive': archive_file}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        predictions = response.json()['predictions']
+        self.assertEqual([p['filename'] for p in predictions], ['0.png', '1.png', '2.png', '3.png', '4.png', 'notes.txt'])
+        self.assertTrue(all('predicted_label' in p for p in predictions[:5]))
+        self.assertIn('error', predictions[5])
+        self.assertEqual([len(call.args[0]) for call in batches.call_args_list], [2, 2, 1])
+
+    def test_repeated_image_is_served_from_prediction_cache(self):
+        from unittest import mock
+        from ai_api import inference
+        served = tiny_served()
+        with mock.patch.object(inference, 'served', served):
+            first = self.client.post('/api/food/predict/', {'image': create_test_image()}, format='multipart')
+            with mock.patch('ai_api.views.load_image_tensor', side_effect=AssertionError('decoded again')), \
+                    mock.patch.object(inference.predict_batcher, 'submit', side_effect=AssertionError('ran model')):
+                again = self.client.post('/api/food/predict/', {'image': create_test_image()}, format='multipart')
+                batch = self.client.post('/api/food/predict-batch/', {'images': [create_test_image()]}, format='multipart')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(batch.json()['predictions'][0]['predicted_label'], first.json()['predicted_label'])
+
+        self.assertEqual([p['label'] for p in first.json()['top_k']][:1], [first.json()['predicted_label']])
+
+        # A new model version never sees the old entries
+        newer = served._replace(info={'sha256': 'f' * 64}, generation=1)
+        self.assertIsNone(inference.prediction_cache.get('0' * 64, newer))
+
+    def test_prediction_cache_keys_on_model_that_ran(self):
+        import hashlib
+        from ai_api import inference
+        old, new = tiny_served(), tiny_served()
+        image = create_test_image()
+        content_hash = hashlib.sha256(image.read()).hexdigest()
+        image.seek(0)
+
+        def swap_then_forward(tensor):
+            # A hot swap lands between load_model() and the forward pass
+            inference.served = new
+            return inference._forward(tensor.unsqueeze(0))[0]
+
+        with mock.patch.object(inference, 'served', old), \
+                mock.patch.object(inference.predict_batcher, 'submit', side_effect=swap_then_forward):
+            response = self.client.post('/api/food/predict/', {'image': image}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(inference.prediction_cache.get(content_hash, old))
+        self.assertIsNotNone(inference.prediction_cache.get(content_hash, new))
+
+    def test_prediction_cache_is_size_bounded(self):
+        import torch
+        from ai_api.prediction_cache import PredictionCache
+        served = tiny_served()
+        cache = PredictionCache(max_entries=2)
+        for key in 'abc':
+            cache.set(key, (torch.zeros(2), served))
+        self.assertIsNone(cache.get('a', served))
+        self.assertIsNotNone(cache.get('c', served))
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_top_k_and_calibrated_confidence(self):
+        from unittest import mock
+        from ai_api import inference
+        served = tiny_served(('pizza', 'steak', 'sushi'))
+        served = served._replace(info={**served.info, 'temperature': 2.0})
+        with mock.patch.object(inference, 'served', served):
+            response = self.client.post('/api/food/predict/', {'image': create_test_image(), 'top_k': 2}, format='multipart')
+            invalid = self.client.post('/api/food/predict/', {'image': create_test_image(), 'top_k': 50}, format='multipart')
+        body = response.json()
+        self.assertEqual(len(body['top_k']), 2)
+        self.assertEqual(body['top_k'][0]['label'], body['predicted_label'])
+        self.assertGreaterEqual(body['top_k'][0]['probability'], body['top_k'][1]['probability'])
+        # T > 1 softens the distribution: the calibrated top-1 is less confident than the raw one
+        self.assertLessEqual(body['confidence'], body['top_k'][0]['probability'])
+        self.assertEqual(invalid.status_code, 400)
+
+
+class LabelRegistryTest(TestCase):
+    def test_cached_until_label_changes(self):
+        from ai_api.label_registry import label_registry
+        FoodLabel.objects.create(name='pizza')
+        self.assertEqual(label_registry.class_names, ['pizza'])
+        version = label_registry.version
+        with self.assertNumQueries(0):
+            label_registry.class_names
+        FoodLabel.objects.create(name='sushi')
+        self.assertGreater(label_registry.version, version)
+        self.assertEqual(label_registry.class_names, ['pizza', 'sushi'])
+
+class ModelBundleTest(TestCase):
+    def test_bundle_roundtrip(self):
+        import os
+        import tempfile
+        import torch
+        import torchvision
+        from model_core.bundle import save_bundle, load_bundle, build_model
+
+        model = torchvision.models.efficientnet_b0(weights=None, num_classes=3).eval()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.pth')
+            meta = save_bundle(path, model, ['pizza', 'steak', 'sushi'], metrics={'test_acc': [0.5]})
+            bundle = load_bundle(path)
+            self.assertEqual(bundle['class_names'], ['pizza', 'steak', 'sushi'])
+            self.assertEqual(bundle['sha256'], meta['sha256'])
+            self.assertEqual(bundle['metrics'], {'test_acc': [0.5]})
+
+            x = torch.rand(1, 3, 224, 224)
+            with torch.no_grad():
+                self.assertTrue(torch.allclose(build_model(bundle)(x), model(x)))
+
+    def test_remote_backend_runs_in_worker_pool(self):
+        import os
+        import tempfile
+        import torch
+        import torchvision
+        from model_core import backends
+        from model_core.bundle import save_bundle
+        from model_core.worker_pool import InferenceWorkerPool, split_cores
+
+        self.assertEqual(split_cores(2, [0, 1, 2, 3, 4]), [[0, 1, 2], [3, 4]])
+        self.assertEqual(split_cores(3, [0, 1]), [[0], [1], [0]])
+
+        model = torchvision.models.efficientnet_b0(weights=None, num_classes=3).eval()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'v000001.pt')
+            save_bundle(path, model, ['pizza', 'steak', 'sushi'])
+            pool = InferenceWorkerPool(os.path.join(tmp, 'inference.sock'), root=tmp, workers=1, threads_per_worker=1)
+            pool.start()
+            try:
+                options = {'socket_path': pool.socket_path, 'bundle_path': path}
+                runner = backends.load_backend('remote', model, 'ab' * 32, os.path.join(tmp, 'v000001'), options=options)
+                x = torch.rand(2, 3, 224, 224)
+                with torch.no_grad():
+                    self.assertTrue(torch.allclose(runner(x), model(x), atol=1e-5))
+                # Only bundles inside the pool's root are served
+                outside = backends.RemoteRunner(pool.socket_path, '/etc/passwd')
+                with self.assertRaisesRegex(RuntimeError, 'PermissionError'):
+                    outside(x)
+            finally:
+                pool.stop()
+            self.assertFalse(os.path.exists(pool.socket_path))
+
+    def test_worker_pool_serves_allowed_legacy_checkpoint(self):
+        import os
+        import tempfile
+        import torch
+        from model_core import backends
+        from model_core.worker_pool import InferenceWorkerPool
+
+        model = torch.nn.Sequential(torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(3, 2)).eval()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.mkdir(os.path.join(tmp, 'models'))
+            # legacy state_dict-only checkpoint outside the registry directory
+            legacy = os.path.join(tmp, 'efficientnet_food_classifier.pth')
+            with mock.patch('model_core.worker_pool.build_model', return_value=model):
+                torch.save({'classifier.1.weight': torch.zeros(2, 1280)}, legacy)
+                pool = InferenceWorkerPool(os.path.join(tmp, 'inference.sock'), root=os.path.join(tmp, 'models'),
+                                           workers=1, threads_per_worker=1, allowed_paths=[legacy])
+                pool.start()
+            try:
+                x = torch.rand(2, 3, 4, 4)
+                with torch.no_grad():
+                    self.assertTrue(torch.allclose(backends.RemoteRunner(pool.socket_path, legacy)(x), model(x), atol=1e-6))
+                with self.assertRaisesRegex(RuntimeError, 'PermissionError'):
+                    backends.RemoteRunner(pool.socket_path, os.path.join(tmp, 'other.pth'))(x)
+            finally:
+                pool.stop()
+
+    def test_worker_pool_drops_silent_and_oversized_clients(self):
+        import os
+        import socket
+        import struct
+        import tempfile
+        import torch
+        from model_core import ipc
+        from model_core.worker_pool import InferenceWorkerPool
+
+        # The payload limit is enforced from the length prefix, before allocating
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(struct.pack('!II', 2, 0xFFFFFFFF) + b'{}')
+            with mock.patch.object(ipc, '_recv_exactly', wraps=ipc._recv_exactly) as recv:
+                with self.assertRaisesRegex(ValueError, 'payload'):
+                    ipc.recv_message(right, max_payload=1024)
+            self.assertEqual([call.args[1] for call in recv.call_args_list], [8])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = InferenceWorkerPool(os.path.join(tmp, 'inference.sock'), root=tmp, workers=1, timeout=0.5, max_payload=1024)
+            pool.start()
+            try:
+                silent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                silent.connect(pool.socket_path)
+                # The only worker is stuck on the silent client until its timeout, then serves the next one
+                runner = ipc.RemoteRunner(pool.socket_path, '/etc/passwd', timeout=5)
+                with self.assertRaisesRegex(RuntimeError, 'PermissionError'):
+                    runner(torch.zeros(1, 3, 4, 4))
+                with self.assertRaises((ConnectionError, OSError)):
+                    runner(torch.zeros(1, 3, 32, 32))  # 12KB > max_payload
+                silent.close()
+            finally:
+                pool.stop()
+
+    def test_publish_and_hot_swap(self):
+        import os
+        import tempfile
+        import time
+        import torchvision
+        from unittest import mock
+        from ai_api import inference
+        from model_core.bundle import save_bundle
+        from model_core.registry import ModelRegistry
+
+        model = torchvision.models.efficientnet_b0(weights=None, num_classes=2).eval()
+        with tempfile.TemporaryDirectory() as tmp:
+            registry = ModelRegistry(tmp, keep=1)
+            with mock.patch.multiple(inference, registry=registry, served=None, _failed_target=None):
+                self.assertIsNone(inference.load_model())
+                registry.publish(lambda path: save_bundle(path, model, ['pizza', 'steak']))
+                first = inference.load_model()
+                self.assertEqual((first.generation, first.class_names), (1, ['pizza', 'steak']))
+
+                registry.publish(lambda path: save_bundle(path, model, ['pizza', 'sushi']))
+                # The old model keeps serving while the new one loads in the background
+                self.assertIn(inference.load_model(), (first, inference.served))
+                for _ in range(100):
+                    if inference.served.generation == 2:
+                        break
+                    time.sleep(0.05)
+                self.assertEqual(inference.served.class_names, ['pizza', 'sushi'])
+                self.assertEqual(sorted(os.listdir(tmp)), ['.lock', 'CURRENT', 'v000002.pt'])
+
+    def test_torchscript_backend_is_cached_by_weights_hash(self):
+        import os
+        import tempfile
+        import torch
+        from model_core.backends import load_backend
+
+        model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 4, 3), torch.nn.BatchNorm2d(4), torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(),
+        ).eval()
+        x = torch.rand(2, 3, 16, 16)
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, 'v000001')
+            runner = load_backend('torchscript', model, 'ab' * 32, prefix, input_size=(16, 16))
+            with torch.no_grad():
+                self.assertTrue(torch.allclose(runner(x), model(x), atol=1e-5))
+            self.assertEqual(os.listdir(tmp), ['v000001.abababababababab.cpu.ts'])
+            with mock.patch('torch.jit.trace', side_effect=AssertionError('recompiled')):
+                load_backend('torchscript', model, 'ab' * 32, prefix, input_size=(16, 16))
+            with self.assertRaises(ValueError):
+                load_backend('tensorrt', model, 'ab' * 32, prefix)
+
+    def test_onnxruntime_backend_matches_eager(self):
+        import os
+        import tempfile
+        import unittest
+        import torch
+        import torchvision
+        from model_core import backends
+
+        if backends.onnxruntime is None:
+            raise unittest.SkipTest('onnxruntime is not installed')
+        model = torchvision.models.efficientnet_b0(weights=None, num_classes=3).eval()
+        with tempfile.TemporaryDirectory() as tmp:
+            runner = backends.load_backend('onnxruntime', model, 'cd' * 32, os.path.join(tmp, 'v000001'), num_threads=1)
+            self.assertEqual(os.listdir(tmp), ['v000001.cdcdcdcdcdcdcdcd.cpu.onnx'])
+            # dynamic batch axis: any batch size runs on the exported graph
+            for batch_size in (1, 3):
+                x = torch.rand(batch_size, 3, 224, 224)
+                with torch.no_grad():
+                    self.assertTrue(torch.allclose(runner(x), model(x), atol=1e-4))
+
+    def test_onnx_export_passes_dynamo_only_when_supported(self):
+        import os
+        import tempfile
+        import torch
+        from model_core.backends import export_onnx
+
+        calls = []
+
+        def old_export(model, args, f, input_names=None, output_names=None, dynamic_axes=None):  # torch < 2.5
+            calls.append('old')
+            open(f, 'wb').close()
+
+        def new_export(model, args, f, input_names=None, output_names=None, dynamic_axes=None, dynamo=True):
+            calls.append(dynamo)
+            open(f, 'wb').close()
+
+        model = torch.nn.Conv2d(3, 2, 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            for export in (old_export, new_export):
+                with mock.patch('torch.onnx.export', export):
+                    export_onnx(model, os.path.join(tmp, 'model.onnx'), (8, 8))
+        self.assertEqual(calls, ['old', False])
+
+    def test_int8_variant_roundtrip_and_accuracy_check(self):
+        import os
+        import tempfile
+        import torch
+        from model_core.quantize import quantize_model, accuracy_regression, save_quantized, load_quantized, quantized_path
+
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, 3), torch.nn.BatchNorm2d(8), torch.nn.ReLU(),
+            torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(8, 2),
+        ).eval()
+        X = torch.rand(8, 3, 16, 16)
+        batches = [(X, model(X).argmax(dim=1).detach())]
+        int8_model = quantize_model(model, batches)
+        report = accuracy_regression(model, int8_model, batches, max_drop=0.5)
+        self.assertEqual(report['fp32_acc'], 1.0)
+        self.assertTrue(report['passed'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = quantized_path(os.path.join(tmp, 'v000003.pt.tmp'))
+            self.assertEqual(os.path.basename(path), 'v000003.int8.ts')
+            save_quantized(path, int8_model, X[:1])
+            with torch.no_grad():
+                self.assertTrue(torch.allclose(load_quantized(path)(X), int8_model(X)))
+
+class TrainingJobTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_retrain_requests_are_deduplicated(self):
+        first = self.client.post('/api/food/retrain/')
+        second = self.client.post('/api/food/retrain/')
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(first.json()['job']['id'], second.json()['job']['id'])
+        self.assertEqual(TrainingJob.objects.count(), 1)
+
+    def test_cancel_queued_job(self):
+        job_id = self.client.post('/api/food/retrain/').json()['job']['id']
+        response = self.client.post(f'/api/food/retrain/jobs/{job_id}/cancel/')
+        self.assertEqual(response.json()['status'], 'cancelled')
+        response = self.client.post(f'/api/food/retrain/jobs/{job_id}/cancel/')
+        self.assertEqual(response.status_code, 409)
+
+    def test_unclaimed_job_reports_missing_worker(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from ai_api import jobs
+        job_id = self.client.post('/api/food/retrain/').json()['job']['id']
+        self.assertFalse(self.client.get(f'/api/food/retrain/jobs/{job_id}/').json()['waiting_for_worker'])
+        TrainingJob.objects.filter(pk=job_id).update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertTrue(self.client.get(f'/api/food/retrain/jobs/{job_id}/').json()['waiting_for_worker'])
+        jobs.claim_next_job()
+        self.assertFalse(self.client.get(f'/api/food/retrain/jobs/{job_id}/').json()['waiting_for_worker'])
+
+    def test_worker_records_epoch_metrics(self):
+        from unittest import mock
+        from ai_api import jobs
+
+        def fake_command(name, stdout, epoch_callback, **options):
+            for epoch in (1, 2):
+                epoch_callback(epoch, 2, {'train_loss': 1.0 / epoch, 'test_acc': 0.5 * epoch})
+            stdout.write('trained')
+
+        job, _ = jobs.enqueue_job()
+        with mock.patch.object(jobs, 'call_command', fake_command):
+            self.assertEqual(jobs.run_job(jobs.claim_next_job()).pk, job.pk)
+        response = self.client.get(f'/api/food/retrain/jobs/{job.pk}/').json()
+        self.assertEqual(response['status'], 'succeeded')
+        self.assertEqual(response['progress'], 1.0)
+        self.assertEqual([m['epoch'] for m in response['metrics']], [1, 2])
+
+class RetrainSchedulerTest(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import SystemInfo
+        self.pizza = FoodLabel.objects.create(name='pizza')
+        self.steak = FoodLabel.objects.create(name='steak')
+        for label in (self.pizza, self.steak):
+            FoodFeedbackSample.objects.create(label=label, image='food_feedback/x.jpg')
+        FoodFeedbackSample.objects.update(created_at=timezone.now() - timedelta(hours=3))
+        SystemInfo.objects.create(pk=1, last_trained=timezone.now() - timedelta(hours=2))
+
+    def add_samples(self, label, n):
+        for _ in range(n):
+            FoodFeedbackSample.objects.create(label=label, image='food_feedback/x.jpg')
+
+    def test_no_new_samples(self):
+        from ai_api.scheduler import check_and_enqueue
+        job, reason = check_and_enqueue()
+        self.assertIsNone(job)
+
+    def test_sample_count_threshold_and_coalescing(self):
+        from django.test import override_settings
+        from ai_api.scheduler import check_and_enqueue
+        self.add_samples(self.pizza, 1)
+        self.add_samples(self.steak, 1)
+        with override_settings(RETRAIN_MIN_NEW_SAMPLES=3, RETRAIN_DRIFT_MIN_SAMPLES=100):
+            self.assertIsNone(check_and_enqueue()[0])
+            self.add_samples(self.pizza, 1)
+            job, _ = check_and_enqueue()
+            self.assertIsNotNone(job)
+            # A second trigger while the job is active joins it instead of queueing another
+            with override_settings(RETRAIN_MIN_INTERVAL=0):
+                self.assertEqual(check_and_enqueue()[0].pk, job.pk)
+        self.assertEqual(TrainingJob.objects.count(), 1)
+
+    def test_label_drift(self):
+        from django.test import override_settings
+        from ai_api.scheduler import check_and_enqueue
+        sushi = FoodLabel.objects.create(name='sushi')
+        self.add_samples(sushi, 2)
+        with override_settings(RETRAIN_MIN_NEW_SAMPLES=100, RETRAIN_DRIFT_MIN_SAMPLES=2):
+            job, reason = check_and_enqueue()
+        self.assertIsNotNone(job)
+        self.assertIn('drift', reason)
+
+class IncrementalTrainingTest(TestCase):
+    def test_remap_classifier_keeps_existing_rows(self):
+        import torch
+        from model_core.incremental import remap_classifier
+        model = torch.nn.Module()
+        model.classifier = torch.nn.Sequential(torch.nn.Dropout(0.2), torch.nn.Linear(4, 2))
+        old_weight = model.classifier[1].weight.detach().clone()
+        changes = remap_classifier(model, ['pizza', 'steak'], ['pizza', 'sushi', 'steak'])
+        self.assertEqual(changes, {'kept': 2, 'added': 1, 'removed': 0})
+        self.assertEqual(model.classifier[1].out_features, 3)
+        self.assertTrue(torch.equal(model.classifier[1].weight[0], old_weight[0]))
+        self.assertTrue(torch.equal(model.classifier[1].weight[2], old_weight[1]))
+
+    def test_replay_buffer_is_class_balanced(self):
+        from model_core.incremental import select_with_replay
+        old = [(f'a{i}', 0) for i in range(10)] + [('b0', 1)]
+        selected = select_with_replay(['new'], old, replay_size=3)
+        self.assertEqual(selected[0], 'new')
+        self.assertEqual(len(selected), 4)
+        self.assertIn('b0', selected)
+
+class EmbeddingCacheTest(TestCase):
+    def test_embeddings_are_computed_once_per_backbone(self):
+        import tempfile
+        import torch
+        from django.test import override_settings
+        from ai_api.embeddings import get_embeddings
+        from ai_api.models import SampleEmbedding
+        from model_core.bundle import build_eval_decoder
+
+        backbone = torch.nn.Module()
+        backbone.features = torch.nn.Conv2d(3, 4, 1)
+        backbone.avgpool = torch.nn.AdaptiveAvgPool2d(1)
+        label = FoodLabel.objects.create(name='pizza')
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            samples = [FoodFeedbackSample.objects.create(label=label, image=create_test_image()) for _ in range(2)]
+            first, kept = get_embeddings(samples, backbone, 'backbone-a', build_eval_decoder())
+            self.assertEqual(kept, [0, 1])
+            self.assertEqual(tuple(first.shape), (2, 4))
+            # Both uploads have identical bytes, so they share one cached embedding
+            self.assertEqual(SampleEmbedding.objects.count(), 1)
+            with mock.patch('ai_api.embeddings.extract_embeddings', side_effect=AssertionError('recomputed')):
+                second, _ = get_embeddings(samples, backbone, 'backbone-a', build_eval_decoder())
+            self.assertTrue(torch.equal(first, second))
+            get_embeddings(samples[:1], backbone, 'backbone-b', build_eval_decoder())
+            self.assertEqual(SampleEmbedding.objects.count(), 2)
+
+    def test_unreadable_images_are_skipped(self):
+        import tempfile
+        import torch
+        from django.test import override_settings
+        from ai_api.embeddings import get_embeddings
+        from model_core.bundle import build_eval_decoder
+
+        backbone = torch.nn.Module()
+        backbone.features = torch.nn.Conv2d(3, 4, 1)
+        backbone.avgpool = torch.nn.AdaptiveAvgPool2d(1)
+        label = FoodLabel.objects.create(name='pizza')
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            corrupt = SimpleUploadedFile('broken.jpg', b'\xff\xd8\xff' + b'\x00' * 64, content_type='image/jpeg')
+            samples = [
+                FoodFeedbackSample.objects.create(label=label, image=create_test_image()),
+                FoodFeedbackSample.objects.create(label=label, image=corrupt),
+            ]
+            missing = FoodFeedbackSample.objects.create(label=label, image=create_test_image())
+            missing.image.storage.delete(missing.image.name)
+            missing.content_hash = ''
+            embeddings, kept = get_embeddings(samples + [missing], backbone, 'backbone-a', build_eval_decoder())
+        self.assertEqual(kept, [0])
+        self.assertEqual(tuple(embeddings.shape), (1, 4))
+
+
+class ShardCacheTest(TestCase):
+    def test_cache_is_updated_incrementally_and_read_from_shards(self):
+        import os
+        import tempfile
+        from model_core.shards import TensorShardCache, ShardDataset
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, color in enumerate(['red', 'green', 'blue']):
+                paths.append(os.path.join(tmp, f'{i}.jpg'))
+                Image.new('RGB', (40, 30), color=color).save(paths[-1])
+
+            cache = TensorShardCache(os.path.join(tmp, 'shards'), size=(8, 8), shard_capacity=2)
+            self.assertEqual(cache.update({'a': paths[0], 'b': paths[1]}), {'added': 2, 'removed': 0, 'failed': 0})
+            image = cache.tensor('a')
+            self.assertEqual((tuple(image.shape), image.dtype.is_floating_point), ((3, 8, 8), False))
+            self.assertGreater(int(image[0].float().mean()), 200)
+
+            # Only the new key is decoded; the removed key's slot is reused
+            reopened = TensorShardCache(os.path.join(tmp, 'shards'), size=(8, 8), shard_capacity=2)
+            with mock.patch.object(reopened, '_load_image', wraps=reopened._load_image) as load:
+                changes = reopened.update({'b': paths[1], 'c': paths[2]})
+            self.assertEqual(changes, {'added': 1, 'removed': 1, 'failed': 0})
+            self.assertEqual(load.call_count, 1)
+            self.assertNotIn('a', reopened)
+            self.assertGreater(int(reopened.tensor('c')[2].float().mean()), 200)
+            self.assertEqual(len(os.listdir(os.path.join(tmp, 'shards'))), 2)  # index + one shard
+
+            dataset = ShardDataset(reopened, [('b', 0), ('c', 1), ('missing', 1)], ['x', 'y'])
+            self.assertEqual(len(dataset), 2)
+            self.assertEqual(dataset[1][1], 1)
+
+    def test_heldout_split_skips_unreadable_images(self):
+        import os
+        import tempfile
+        from ai_api.management.commands.retrain_model import Command
+        from model_core.shards import TensorShardCache, ShardDataset
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = {}
+            for i in range(8):
+                paths[f'k{i}'] = os.path.join(tmp, f'{i}.jpg')
+                Image.new('RGB', (20, 20), color=(i * 30, 0, 0)).save(paths[f'k{i}'])
+            # Upload that fails to decode: dropped by the cache, so indices shift
+            with open(paths['k0'], 'wb') as f:
+                f.write(b'not an image')
+            cache = TensorShardCache(os.path.join(tmp, 'shards'), size=(8, 8))
+            self.assertEqual(cache.update(paths)['failed'], 1)
+            samples = [(key, i % 2) for i, key in enumerate(sorted(paths))]
+            dataset = ShardDataset(cache, samples, ['x', 'y'])
+            self.assertEqual(len(dataset), len(samples) - 1)
+
+            train_dataset, test_dataset, heldout = Command().split(dataset)
+            trained = {dataset.samples[i] for i in train_dataset.indices}
+            self.assertEqual(len(heldout), len(test_dataset))
+            self.assertNotIn(('k0', 0), heldout)
+            self.assertFalse(trained & set(heldout))
+            self.assertEqual(trained | set(heldout), set(dataset.samples))
+
+
+class DataLoaderFactoryTest(TestCase):
+    def test_worker_count_follows_cpu_affinity(self):
+        import os
+        from model_core import data_setup
+        if not hasattr(os, 'sched_getaffinity'):
+            self.skipTest('no sched_getaffinity on this platform')
+        with mock.patch('os.sched_getaffinity', return_value={0, 1, 2}), mock.patch('os.cpu_count', return_value=64):
+            self.assertEqual(data_setup.default_num_workers(), 2)
+            self.assertEqual(data_setup.default_num_workers(dataset_size=10, batch_size=10), 1)
+
+    def test_loader_reports_data_wait_to_engine(self):
+        import torch
+        from torch.utils.data import TensorDataset
+        from model_core import data_setup, engine
+
+        dataset = TensorDataset(torch.randn(10, 4), torch.randint(0, 2, (10,)))
+        self.assertLessEqual(data_setup.default_num_workers(len(dataset), batch_size=8), 2)
+        loader = data_setup.make_dataloader(dataset, batch_size=4, shuffle=True, num_workers=0)
+        self.assertEqual(sum(len(y) for _, y in loader), 10)
+        self.assertTrue(0.0 <= loader.wait_fraction <= 1.0)
+
+        model = torch.nn.Linear(4, 2)
+        seen = []
+        results = engine.train(
+            model, loader, data_setup.make_dataloader(dataset, batch_size=4, num_workers=0),
+            torch.optim.SGD(model.parameters(), lr=0.1), torch.nn.CrossEntropyLoss(), 2, device='cpu',
+            epoch_callback=lambda epoch, epochs, metrics: seen.append(metrics),
+        )
+        self.assertEqual(len(results['train_data_wait']), 2)
+        self.assertIn('train_data_wait', seen[-1])
+
+    def test_perf_mode_trains_and_records_throughput(self):
+        import torch
+        from torch.utils.data import TensorDataset
+        from model_core import data_setup, engine
+
+        dataset = TensorDataset(torch.randn(6, 3, 8, 8), torch.randint(0, 2, (6,)))
+        loader = data_setup.make_dataloader(dataset, batch_size=2, num_workers=0)
+        model = torch.nn.Sequential(torch.nn.Conv2d(3, 2, 3), torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten())
+        optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+        with mock.patch.object(optimizer, 'step', wraps=optimizer.step) as step:
+            results = engine.train(
+                model, loader, loader, optimizer, torch.nn.CrossEntropyLoss(), 1, device='cpu',
+                amp_dtype=torch.bfloat16, channels_last=True, accumulation_steps=2,
+            )
+        # 3 batches with 2 accumulation steps -> 2 optimizer steps (the last one partial)
+        self.assertEqual(step.call_count, 2)
+        self.assertTrue(model[0].weight.is_contiguous(memory_format=torch.channels_last))
+        self.assertGreater(results['train_images_per_sec'][0], 0)
+        self.assertEqual(results['perf_mode'], {'amp_dtype': 'bfloat16', 'channels_last': True, 'accumulation_steps': 2})
+
+
+class EngineMetricsTest(TestCase):
+    def test_fit_temperature_softens_overconfident_logits(self):
+        import torch
+        from model_core.calibration import fit_temperature
+
+        torch.manual_seed(0)
+        targets = torch.randint(0, 3, (200,))
+        # right 70% of the time, but with logits that claim ~100% confidence
+        predicted = torch.where(torch.rand(200) < 0.7, targets, (targets + 1) % 3)
+        logits = torch.nn.functional.one_hot(predicted, 3).float() * 20
+        temperature = fit_temperature(logits, targets)
+        self.assertGreater(temperature, 5)
+        calibrated = torch.softmax(logits / temperature, dim=1).max(dim=1).values.mean()
+        self.assertAlmostEqual(float(calibrated), 0.7, delta=0.05)
+        self.assertEqual(fit_temperature(torch.empty(0, 3), torch.empty(0, dtype=torch.long)), 1.0)
+
+    def test_metrics_are_sample_weighted_and_pluggable(self):
+        import torch
+        from model_core.metrics import ClassificationMetrics
+
+        metrics = ClassificationMetrics(top_k=(1, 2), per_class_recall=True, confusion_matrix=True)
+        # batch 1: 2 of 2 correct, batch 2 (partial): 0 of 1 correct -> 2/3, not the per-batch mean 1/2
+        metrics.update(torch.tensor([[2.0, 1.0, 0.0], [0.0, 3.0, 1.0]]), torch.tensor([0, 1]), torch.tensor(0.5))
+        metrics.update(torch.tensor([[0.0, 2.0, 1.0]]), torch.tensor([2]), torch.tensor(2.0))
+        values = metrics.compute()
+        self.assertAlmostEqual(values['acc'], 2 / 3)
+        self.assertAlmostEqual(values['loss'], (0.5 * 2 + 2.0) / 3)
+        self.assertAlmostEqual(values['top2_acc'], 1.0)
+        self.assertEqual(values['per_class_recall'], [1.0, 1.0, 0.0])
+        self.assertEqual(values['confusion_matrix'], [[1, 0, 0], [0, 1, 0], [0, 1, 0]])
+
+    def test_train_step_does_not_sync_per_batch(self):
+        import torch
+        from torch.utils.data import TensorDataset
+        from model_core import data_setup, engine
+
+        dataset = TensorDataset(torch.randn(10, 4), torch.randint(0, 3, (10,)))
+        # batches are materialized up front: the DataLoader itself reads its seed with item()
+        loader = list(data_setup.make_dataloader(dataset, batch_size=4, num_workers=0))
+        model = torch.nn.Linear(4, 3)
+        calls = []
+        original_item = torch.Tensor.item
+
+        def counting_item(tensor):
+            calls.append(tensor)
+            return original_item(tensor)
+
+        with mock.patch.object(torch.Tensor, 'item', counting_item):
+            engine.train_step(model, loader, torch.nn.CrossEntropyLoss(), torch.optim.SGD(model.parameters(), lr=0.1), 'cpu')
+        # one read of the loss sum per epoch instead of two reads per batch
+        self.assertEqual(len(calls), 1)
+
+
+class ImageDecodeTest(TestCase):
+    def test_draft_decode_matches_eval_transform(self):
+        import numpy as np
+        from model_core.bundle import build_eval_transform, build_eval_decoder
+        from model_core.imaging import open_rgb
+
+        rng = np.random.default_rng(0)
+        image = Image.fromarray((rng.random((60, 80, 3)) * 255).astype('uint8')).resize((1600, 1200))
+        jpeg, png = io.BytesIO(), io.BytesIO()
+        image.save(jpeg, 'JPEG', quality=95)
+        image.save(png, 'PNG')
+
+        # The JPEG is decoded at 1/4 scale (400x300 >= 224x224) instead of full resolution
+        self.assertEqual(open_rgb(io.BytesIO(jpeg.getvalue()), (224, 224)).size, (400, 300))
+
+        reference = build_eval_transform()
+        decode = build_eval_decoder()
+        # reducing_gap and DCT scaling trade a little exactness for speed
+        for data, tolerance in ((png, 0.01), (jpeg, 0.1)):
+            expected = reference(Image.open(io.BytesIO(data.getvalue())).convert('RGB'))
+            actual = decode(io.BytesIO(data.getvalue()))
+            self.assertEqual(actual.shape, expected.shape)
+            self.assertLess(float((actual - expected).abs().mean()), tolerance)
+
+
+class StreamingUploadTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_upload_is_spooled_hashed_and_sniffed(self):
+        import hashlib
+        from django.core.files.uploadedfile import TemporaryUploadedFile
+        from django.test import RequestFactory
+        from ai_api.prediction_cache import upload_sha256
+        payload = create_test_image().read()
+        # The client claims PNG; the bytes are a JPEG
+        request = RequestFactory().post('/', {'image': SimpleUploadedFile('a.png', payload, content_type='image/png')})
+        image_file = request.FILES['image']
+        self.assertIsInstance(image_file, TemporaryUploadedFile)
+        self.assertEqual(image_file.sniffed_type, 'image/jpeg')
+        self.assertEqual(upload_sha256(image_file), hashlib.sha256(payload).hexdigest())
+        self.assertEqual(image_file.read(), payload)
+
+    def test_spoofed_content_type_is_rejected(self):
+        fake = SimpleUploadedFile('evil.jpg', b'<?php echo 1; ?>' * 4, content_type='image/jpeg')
+        response = self.client.post('/api/food/predict/', {'image': fake}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_oversize_upload_is_rejected_while_streaming(self):
+        from django.test import override_settings
+        from ai_api.uploads import StreamingImageUploadHandler
+        payload = create_test_image().read()
+        with override_settings(UPLOAD_MAX_IMAGE_SIZE=len(payload) // 2), \
+                mock.patch.object(StreamingImageUploadHandler, 'chunk_size', 64):
+            with mock.patch.object(StreamingImageUploadHandler, 'file_complete') as complete:
+                response = self.client.post('/api/food/predict/', {'image': SimpleUploadedFile('big.jpg', payload)}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        complete.assert_not_called()
+        with override_settings(UPLOAD_MAX_REQUEST_SIZE=len(payload) // 2):
+            response = self.client.post('/api/food/predict/', {'image': SimpleUploadedFile('big.jpg', payload)}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+
+
+class AsyncPredictTest(TestCase):
+    def setUp(self):
+        FoodLabel.objects.create(name='pizza')
+        FoodLabel.objects.create(name='steak')
+
+    def test_async_predict_matches_sync_view(self):
+        from ai_api import inference
+        with mock.patch.object(inference, 'served', tiny_served()):
+            sync = APIClient().post('/api/food/predict/', {'image': create_test_image()}, format='multipart')
+            inference.prediction_cache.clear()
+            response = self.client.post('/api/food/predict-async/', {'image': create_test_image(), 'top_k': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['predicted_label'], sync.json()['predicted_label'])
+        self.assertEqual(len(response.json()['top_k']), 2)
+        self.assertEqual(self.client.get('/api/food/predict-async/').status_code, 405)
+
+    def test_saturated_executor_returns_429(self):
+        import threading
+        from ai_api import inference
+        from model_core.batching import BoundedExecutor, ExecutorSaturated
+        executor = BoundedExecutor(max_workers=1, max_pending=1)
+        release = threading.Event()
+        blocker = executor.submit(release.wait)
+        with self.assertRaises(ExecutorSaturated):
+            executor.submit(print)
+        with mock.patch.object(inference, 'served', tiny_served()), \
+                mock.patch('ai_api.views.predict_executor', executor):
+            inference.prediction_cache.clear()
+            response = self.client.post('/api/food/predict-async/', {'image': create_test_image()})
+        release.set()
+        blocker.result(timeout=5)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(executor.stats()['rejected'], 2)
+
+
+class ListQueryCountTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.client = APIClient()
+        self.labels = [FoodLabel.objects.create(name=name) for name in ('pizza', 'steak', 'sushi')]
+        for i, label in enumerate(self.labels):
+            for _ in range(i + 1):
+                FoodFeedbackSample.objects.create(label=label, image=create_test_image())
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        with self.assertNumQueries(1):
+            labels = self.client.get('/api/food/labels/').json()
+        self.assertEqual({l['name']: l['sample_count'] for l in labels}, {'pizza': 1, 'steak': 2, 'sushi': 3})
+        # COUNT(*) for the paginator + one joined page query
+        with self.assertNumQueries(2):
+            feedback = self.client.get('/api/food/feedback-list/', {'page_size': 6}).json()
+        self.assertEqual(len(feedback['results']), 6)
+        self.assertEqual(feedback['results'][0]['label']['sample_count'], 3)
+
+    def test_sample_count_follows_create_move_and_delete(self):
+        pizza, steak, _ = self.labels
+        sample = FoodFeedbackSample.objects.filter(label=steak).first()
+        sample.label = pizza
+        sample.save()
+        sample.delete()
+        FoodFeedbackSample.objects.filter(label=steak).delete()
+        counts = dict(FoodLabel.objects.values_list('name', 'sample_count'))
+        self.assertEqual(counts, {'pizza': 1, 'steak': 0, 'sushi': 3})
+        response = self.client.post('/api/food/add/', {'image': create_test_image(), 'label_id': steak.pk}, format='multipart')
+        self.assertEqual(response.json()['label']['sample_count'], 1)
+
+
+class SystemStatsTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.core.cache import cache
+        from django.test import override_settings
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        cache.clear()
+        self.client = APIClient()
+        pizza = FoodLabel.objects.create(name='pizza')
+        FoodLabel.objects.create(name='steak')
+        for is_correct in (True, True, False, None):
+            FoodFeedbackSample.objects.create(label=pizza, image=create_test_image(), is_correct=is_correct)
+
+    def test_single_query_cached_and_invalidated(self):
+        from ai_api import inference
+        from ai_api.models import SystemInfo
+        SystemInfo.objects.create(accuracy=0.9, total_samples=4)
+        served = tiny_served()
+        with mock.patch.object(inference, 'served', served):
+            with self.assertNumQueries(1):
+                stats = self.client.get('/api/food/system-stats/').json()
+            with self.assertNumQueries(0):
+                self.client.get('/api/food/system-stats/')
+        self.assertEqual((stats['feedback_count'], stats['label_count']), (4, 2))
+        self.assertEqual((stats['correct_predictions'], stats['incorrect_predictions'], stats['unreviewed_predictions']), (2, 1, 1))
+        self.assertAlmostEqual(stats['correct_ratio'], 2 / 3)
+        self.assertEqual(stats['accuracy'], 0.9)
+        self.assertEqual([(l['name'], l['sample_count']) for l in stats['labels']], [('pizza', 4), ('steak', 0)])
+        self.assertIsNone(stats['labels'][1]['correct_ratio'])
+        self.assertEqual(stats['model']['generation'], served.generation)
+
+        FoodFeedbackSample.objects.create(label=FoodLabel.objects.get(name='steak'), image=create_test_image(), is_correct=True)
+        stats = self.client.get('/api/food/system-stats/').json()
+        self.assertEqual(stats['feedback_count'], 5)
+        self.assertEqual(stats['labels'][1]['correct_ratio'], 1.0)
+
+    def test_single_query_without_labels(self):
+        import subprocess
+        import sys
+        from ai_api.models import SystemInfo
+        from ai_api.stats import compute_system_stats
+        FoodLabel.objects.all().delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(compute_system_stats()['accuracy'], None)
+        SystemInfo.objects.create(accuracy=0.9, total_samples=4)
+        with self.assertNumQueries(1):
+            stats = compute_system_stats()
+        self.assertEqual((stats['label_count'], stats['feedback_count'], stats['accuracy'], stats['total_samples']), (0, 0, 0.9, 4))
+        # stats.py does not pull in the model, batcher and executors
+        code = "import django; django.setup(); import sys, ai_api.stats; print('ai_api.inference' in sys.modules)"
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+
+class FeedbackCursorPaginationTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from django.utils import timezone
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.client = APIClient()
+        self.label = FoodLabel.objects.create(name='pizza')
+        for _ in range(7):
+            FoodFeedbackSample.objects.create(label=self.label, image=create_test_image())
+        # Ties on created_at are broken by id
+        FoodFeedbackSample.objects.filter(pk__in=FoodFeedbackSample.objects.order_by('pk').values('pk')[2:5]).update(created_at=timezone.now())
+        self.expected = list(FoodFeedbackSample.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_walks_forward_and_back_without_count_queries(self):
+        url, pages = '/api/food/feedback-list/?cursor=&page_size=3', []
+        while url:
+            with self.assertNumQueries(1):
+                body = self.client.get(url).json()
+            pages.append(body)
+            url = body['next']
+        self.assertEqual([len(p['results']) for p in pages], [3, 3, 1])
+        self.assertEqual([r['id'] for p in pages for r in p['results']], self.expected)
+        self.assertIsNone(pages[0]['previous'])
+
+        back = self.client.get(pages[2]['previous']).json()
+        self.assertEqual(back['results'], pages[1]['results'])
+        self.assertEqual(self.client.get(back['previous']).json()['results'], pages[0]['results'])
+        self.assertEqual(self.client.get('/api/food/feedback-list/?cursor=bogus').status_code, 404)
+
+        # Page-number mode is still the default
+        self.assertEqual(self.client.get('/api/food/feedback-list/').json()['count'], 7)
+
+    def test_deep_pages_seek_the_index(self):
+        from django.db import connection
+        from ai_api.views import FeedbackCursorPagination
+        first = self.client.get('/api/food/feedback-list/?cursor=&page_size=2').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual([r['id'] for r in second['results']], self.expected[2:4])
+        by_label = self.client.get(first['next'] + f'&label={self.label.pk}').json()
+        self.assertEqual(by_label['results'], second['results'])
+
+        if connection.vendor != 'sqlite':
+            self.skipTest('query plan check is sqlite-specific')
+        last = FoodFeedbackSample.objects.get(pk=first['results'][-1]['id'])
+        paginator = FeedbackCursorPagination()
+        for queryset, index in ((FoodFeedbackSample.objects.all(), 'feedback_created_idx'),
+                                (FoodFeedbackSample.objects.filter(label=self.label), 'feedback_label_created_idx')):
+            sql, params = paginator.after_cursor(queryset, (last.created_at, last.pk))[:3].query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            # The cursor bounds the index range (a SEARCH on created_at), not a SCAN filtered row by row
+            self.assertTrue(plan[0].startswith('SEARCH'), plan)
+            self.assertIn(index, plan[0])
+            self.assertIn('created_at<', plan[0])
+            self.assertFalse(any('TEMP B-TREE' in line for line in plan), plan)
+
+    def test_label_filter_uses_composite_index(self):
+        from django.db import connection
+        queryset = FoodFeedbackSample.objects.filter(label=self.label).order_by('-created_at', '-id')[:10]
+        if connection.vendor != 'sqlite':
+            self.skipTest('query plan check is sqlite-specific')
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('feedback_label_created_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class FeedbackRelabelTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.client = APIClient()
+
+    def test_relabel_keeps_image_file(self):
+        pizza = FoodLabel.objects.create(name='pizza')
+        steak = FoodLabel.objects.create(name='steak')
+        sample = FoodFeedbackSample.objects.create(label=pizza, image=create_test_image())
+        response = self.client.patch(f'/api/food/feedback/{sample.pk}/', {'label_id': steak.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        sample.refresh_from_db()
+        self.assertEqual(sample.label, steak)
+        self.assertTrue(sample.image.storage.exists(sample.image.name))
+
+    def test_feedback_reuses_upload_digest(self):
+        import hashlib
+        from ai_api.embeddings import ensure_content_hash
+        FoodLabel.objects.create(name='pizza')
+        payload = create_test_image().read()
+        image = SimpleUploadedFile('a.jpg', payload, content_type='image/jpeg')
+        with mock.patch('ai_api.embeddings.file_sha256', side_effect=AssertionError('stored file re-read')):
+            response = self.client.post('/api/food/submit-feedback/', {'image': image, 'predicted_label': 'pizza', 'is_correct': 'true'}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        sample = FoodFeedbackSample.objects.get()
+        self.assertEqual(sample.content_hash, hashlib.sha256(payload).hexdigest())
+        with mock.patch('ai_api.embeddings.file_sha256', side_effect=AssertionError('stored file re-read')):
+            self.assertEqual(ensure_content_hash(sample), sample.content_hash)
@@ -0,0 +1,105 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# (magic bytes, offset, mime type); sniffed instead of trusting the client's content_type
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 0, 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 0, 'image/png'),
+    (b'GIF87a', 0, 'image/gif'),
+    (b'GIF89a', 0, 'image/gif'),
+    (b'WEBP', 8, 'image/webp'),
+    (b'BM', 0, 'image/bmp'),
+    (b'II*\x00', 0, 'image/tiff'),
+    (b'MM\x00*', 0, 'image/tiff'),
+]
+SNIFF_BYTES = 16
+
+
+def sniff_image_type(header):
+    """Image mime type from the first bytes of a file, or None"""
+    for magic, offset, mime in IMAGE_SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            if mime == 'image/webp' and header[:4] != b'RIFF':
+                continue
+            return mime
+    return None
+
+
+def sniff_file(image_file):
+    """Sniffed type of an uploaded file; files from the upload handler already carry it"""
+    if hasattr(image_file, 'sniffed_type'):
+        return image_file.sniffed_type
+    if not hasattr(image_file, 'read'):
+        return None
+    position = image_file.tell()
+    image_file.seek(0)
+    header = image_file.read(SNIFF_BYTES)
+    image_file.seek(position)
+    return sniff_image_type(header)
+
+
+def max_image_size():
+    return getattr(settings, 'UPLOAD_MAX_IMAGE_SIZE', 10 * 1024 * 1024)
+
+
+class UploadTooLarge(APIException, RequestDataTooBig):
+    """413 from DRF views; other views (admin) turn RequestDataTooBig into a 400"""
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Upload too large.'
+    default_code = 'upload_too_large'
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    """
+    Spools every uploaded file to a temporary file chunk by chunk.
+
+    While the body streams in, the file is hashed (reused by the prediction
+    cache), its type is sniffed from the first chunk, and uploads larger than
+    the limit for that type are rejected as soon as they cross it. Memory per
+    request stays at one chunk no matter how large or concurrent the uploads are,
+    and ImageField moves the temporary file into place instead of copying it.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        max_request = getattr(settings, 'UPLOAD_MAX_REQUEST_SIZE', None)
+        if max_request and content_length and content_length > max_request:
+            raise UploadTooLarge(f'Request body ({content_length / 1024 / 1024:.1f}MB) exceeds the {max_request / 1024 / 1024:.0f}MB limit.')
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = TemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+        self.digest = hashlib.sha256()
+        self.header = b''
+        self.sniffed_type = None
+        self.size = 0
+        self.max_size = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.max_size is None:
+            self.header += raw_data[:SNIFF_BYTES - len(self.header)]
+            if len(self.header) >= SNIFF_BYTES:
+                self.sniffed_type = sniff_image_type(self.header)
+                self.max_size = max_image_size() if self.sniffed_type else getattr(settings, 'UPLOAD_MAX_FILE_SIZE', 100 * 1024 * 1024)
+        self.size += len(raw_data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.file.close()
+            raise UploadTooLarge(f'{self.file_name} is larger than the {self.max_size / 1024 / 1024:.0f}MB limit.')
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.sniffed_type is None:
+            self.sniffed_type = sniff_image_type(self.header)
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.digest.hexdigest()
+        self.file.sniffed_type = self.sniffed_type
+        return self.file
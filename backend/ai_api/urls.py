@@ -1,13 +1,19 @@
 from django.urls import path
 from .views import PredictFoodView, AddFoodSampleView, FoodFeedbackListView, api_root, RetrainModelView \
-    , FoodLabelListCreateView, FoodFeedbackSampleUpdateView, SubmitFeedbackView, system_stats, FoodLabelRetrieveUpdateDestroyView
+    , FoodLabelListCreateView, FoodFeedbackSampleUpdateView, SubmitFeedbackView, system_stats, FoodLabelRetrieveUpdateDestroyView \
+    , inference_stats, PredictBatchView, TrainingJobListView, TrainingJobDetailView, TrainingJobCancelView, predict_food_async
 
 urlpatterns = [
     # path('', api_root, name='api-root'),
     path('predict/', PredictFoodView.as_view(), name='predict-food'),
+    path('predict-async/', predict_food_async, name='predict-food-async'),
+    path('predict-batch/', PredictBatchView.as_view(), name='predict-food-batch'),
     path('add/', AddFoodSampleView.as_view(), name='add-food-sample'),
     path('feedback-list/', FoodFeedbackListView.as_view(), name='feedback-list'),
     path('retrain/', RetrainModelView.as_view(), name='retrain-model'),
+    path('retrain/jobs/', TrainingJobListView.as_view(), name='training-job-list'),
+    path('retrain/jobs/<int:pk>/', TrainingJobDetailView.as_view(), name='training-job-detail'),
+    path('retrain/jobs/<int:pk>/cancel/', TrainingJobCancelView.as_view(), name='training-job-cancel'),
     path('labels/', FoodLabelListCreateView.as_view(), name='food-label-list-create'),
     path('labels/<int:pk>/', FoodLabelRetrieveUpdateDestroyView.as_view(), name='food-label-detail'),
     path('feedback/<int:pk>/', FoodFeedbackSampleUpdateView.as_view(), name='feedback-edit'),
@@ -16,4 +22,5 @@ urlpatterns = [
 
 urlpatterns += [
     path('system-stats/', system_stats, name='system-stats'),
+    path('inference-stats/', inference_stats, name='inference-stats'),
 ] 
\ No newline at end of file
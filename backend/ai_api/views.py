@@ -3,28 +3,42 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import status
-from .models import FoodFeedbackSample, FoodLabel, SystemInfo
+from .models import FoodFeedbackSample, FoodLabel, TrainingJob
 from django.conf import settings
-import torch
-import torchvision
-from torchvision import transforms
-from PIL import Image
 import io
 import os
 from rest_framework import serializers
 from rest_framework.decorators import api_view
 from rest_framework.reverse import reverse
-from .serializers import FoodFeedbackSampleSerializer, ImageOnlySerializer, FoodLabelSerializer, ShowFoodFeedbackSampleSerializer
+from .serializers import FoodFeedbackSampleSerializer, ImageOnlySerializer, FoodLabelSerializer, ShowFoodFeedbackSampleSerializer, TrainingJobSerializer
 from rest_framework.permissions import IsAdminUser
 import subprocess
 from rest_framework import generics, permissions
 from datetime import datetime
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+import base64
 from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
-from django.core.management import call_command
-from io import StringIO
+from django.core.files import File
 from django.views.generic import TemplateView
+from .jobs import enqueue_job, cancel_job
+from .inference import load_model, load_image_tensor, predict_result, predict_batcher, decode_executor, prediction_cache, predict_executor, served_model_stats
+from .prediction_cache import upload_sha256
+from .stats import system_stats_snapshot
+from .uploads import sniff_file, max_image_size, UploadTooLarge
+from model_core.batching import ExecutorSaturated
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.db.models import Count, Q
+import asyncio
+from types import SimpleNamespace
+import mimetypes
+import zipfile
+from itertools import islice
 
 def validate_image_file(image_file):
     """Validate image file type and size"""
@@ -38,61 +52,19 @@ def validate_image_file(image_file):
         'image/tiff'
     ]
     
-    # بررسی نوع فایل
-    if image_file.content_type not in allowed_types:
-        return False, f"نوع فایل {image_file.content_type} پشتیبانی نمی‌شود. انواع مجاز: JPEG, PNG, WebP, GIF, BMP, TIFF"
+    # بررسی نوع فایل از روی magic bytes (content_type ارسالی کلاینت قابل اعتماد نیست)
+    # فایل‌های داخل zip قبل از خواندن محتوا فقط از روی نام بررسی می‌شوند
+    content_type = sniff_file(image_file) if hasattr(image_file, 'read') else image_file.content_type
+    if content_type not in allowed_types:
+        return False, f"نوع فایل {content_type or image_file.content_type} پشتیبانی نمی‌شود. انواع مجاز: JPEG, PNG, WebP, GIF, BMP, TIFF"
     
-    # بررسی اندازه فایل (10MB)
-    max_size = 10 * 1024 * 1024
+    # بررسی اندازه فایل (UPLOAD_MAX_IMAGE_SIZE)
+    max_size = max_image_size()
     if image_file.size > max_size:
-        return False, f"حجم فایل ({image_file.size / 1024 / 1024:.1f}MB) بیشتر از حد مجاز (10MB) است"
+        return False, f"حجم فایل ({image_file.size / 1024 / 1024:.1f}MB) بیشتر از حد مجاز ({max_size / 1024 / 1024:.0f}MB) است"
     
     return True, "OK"
 
-# Load class names dynamically from database
-def get_class_names():
-    """Get class names from FoodLabel database table"""
-    try:
-        return list(FoodLabel.objects.order_by('name').values_list('name', flat=True))
-    except Exception:
-        return []
-
-def get_num_classes():
-    """Get number of classes from database"""
-    try:
-        return FoodLabel.objects.count()
-    except Exception:
-        return 0
-
-# Load model and class names from database
-MODEL_PATH = os.path.join(settings.BASE_DIR, 'data', 'efficientnet_food_classifier.pth')
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-# مدل را فقط یکبار بارگذاری کن
-model = None
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
-
-def load_model():
-    global model
-    class_names = get_class_names()
-    num_classes = get_num_classes()
-    
-    if model is None and os.path.exists(MODEL_PATH) and num_classes > 0:
-        try:
-            model = torchvision.models.efficientnet_b0(weights=None)
-            model.classifier[1] = torch.nn.Linear(in_features=1280, out_features=num_classes)
-            model.load_state_dict(torch.load(MODEL_PATH, map_location=device))
-            model.eval()
-            model.to(device)
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            model = None
-
 @api_view(['GET'])
 def api_root(request, format=None):
     return Response({
@@ -103,32 +75,35 @@ def api_root(request, format=None):
 
 @api_view(['GET'])
 def system_stats(request):
-    from .models import FoodFeedbackSample, FoodLabel
-    feedback_count = FoodFeedbackSample.objects.count()
-    label_count = FoodLabel.objects.count()
-    correct_predictions = FoodFeedbackSample.objects.filter(is_correct=True).count()
-    info = SystemInfo.objects.first()
-    accuracy = info.accuracy if info else None
-    last_trained = info.last_trained if info else None
-    total_samples = info.total_samples if info else None
+    # snapshot کش‌شده (یک query)؛ signal ها هنگام تغییر نمونه‌ها/لیبل‌ها آن را باطل می‌کنند
+    return Response({**system_stats_snapshot(), 'model': served_model_stats()})
+
+@api_view(['GET'])
+def inference_stats(request):
     return Response({
-        'feedback_count': feedback_count,
-        'label_count': label_count,
-        'correct_predictions': correct_predictions,
-        'accuracy': accuracy,
-        'last_trained': last_trained,
-        'total_samples': total_samples,
+        **predict_batcher.stats(),
+        'prediction_cache': prediction_cache.stats(),
+        'async_executor': predict_executor.stats(),
     })
 
+def parse_top_k(request):
+    """Optional `top_k` request parameter (1..20); None means PREDICT_TOP_K"""
+    # DRF request یا HttpRequest ی view ی async
+    data = getattr(request, 'data', None) or request.POST
+    params = getattr(request, 'query_params', None) or request.GET
+    value = data.get('top_k') or params.get('top_k')
+    if value in (None, ''):
+        return None
+    top_k = int(value)
+    if not 1 <= top_k <= 20:
+        raise ValueError('top_k must be between 1 and 20.')
+    return top_k
+
 class PredictFoodView(APIView):
     parser_classes = (MultiPartParser, FormParser)
     serializer_class = ImageOnlySerializer
 
     def post(self, request, *args, **kwargs):
-        load_model()  # Ensure model is loaded
-        if model is None:
-            return Response({'error': 'Model not available. Please retrain the model.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-            
         image_file = request.FILES.get('image')
         if not image_file:
             return Response({'error': 'No image provided.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -137,16 +112,25 @@ class PredictFoodView(APIView):
         is_valid, message = validate_image_file(image_file)
         if not is_valid:
             return Response({'error': message}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            top_k = parse_top_k(request)
+        except ValueError as e:
+            return Response({'error': f'Invalid top_k: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        served = load_model()  # Ensure model is loaded
+        if served is None:
+            return Response({'error': 'Model not available. Please retrain the model.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         
         try:
-            class_names = get_class_names()
-            image = Image.open(image_file).convert('RGB')
-            input_tensor = transform(image)
-            input_tensor = input_tensor.unsqueeze(0).to(device)
-            with torch.no_grad():
-                outputs = model(input_tensor)
-                _, predicted = torch.max(outputs, 1)
-                predicted_label = class_names[int(predicted.item())]
+            # تصویر تکراری (مثلاً ارسال مجدد یا retry) بدون decode و اجرای مدل پاسخ داده می‌شود
+            content_hash = upload_sha256(image_file)
+            output = prediction_cache.get(content_hash, served)
+            if output is None:
+                output = predict_batcher.submit(load_image_tensor(image_file, served))
+                prediction_cache.set(content_hash, output)
+            result = predict_result(output, top_k)
+            predicted_label = result['predicted_label']
             
             # اگر کاربر لیبل صحیح را ارسال کرد، ذخیره کن
             correct_label = request.data.get('correct_label')
@@ -156,15 +140,190 @@ class PredictFoodView(APIView):
                     is_correct = (label_instance.name == predicted_label)
                     feedback = FoodFeedbackSample.objects.create(image=image_file, label=label_instance, is_correct=is_correct)
                     serializer = FoodFeedbackSampleSerializer(feedback, context={'request': request})
-                    return Response({'predicted_label': predicted_label, 'feedback': serializer.data})
+                    return Response({**result, 'feedback': serializer.data})
                 except FoodLabel.DoesNotExist:
                     return Response({'error': 'Label not found.'}, status=400)
-            return Response({'predicted_label': predicted_label})
+            return Response(result)
         except Exception as e:
             return Response({'error': f'Prediction failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _predict_uncached(image_file, served, content_hash):
+    output = predict_batcher.submit(load_image_tensor(image_file, served))
+    prediction_cache.set(content_hash, output)
+    return output
+
+@csrf_exempt
+@require_POST
+async def predict_food_async(request):
+    """
+    Async-native PredictFoodView for ASGI: same parameters and response.
+
+    Parsing and DB access stay on the event loop; decode and the forward pass
+    go to predict_executor, and the request gets a 429 when it is saturated.
+    """
+    try:
+        image_file = request.FILES.get('image')
+    except UploadTooLarge as e:
+        return JsonResponse({'error': str(e.detail)}, status=e.status_code)
+    if not image_file:
+        return JsonResponse({'error': 'No image provided.'}, status=400)
+
+    is_valid, message = validate_image_file(image_file)
+    if not is_valid:
+        return JsonResponse({'error': message}, status=400)
+
+    try:
+        top_k = parse_top_k(request)
+    except ValueError as e:
+        return JsonResponse({'error': f'Invalid top_k: {e}'}, status=400)
+
+    served = await sync_to_async(load_model, thread_sensitive=False)()
+    if served is None:
+        return JsonResponse({'error': 'Model not available. Please retrain the model.'}, status=503)
+
+    content_hash = upload_sha256(image_file)
+    output = prediction_cache.get(content_hash, served)
+    if output is None:
+        try:
+            future = predict_executor.submit(_predict_uncached, image_file, served, content_hash)
+        except ExecutorSaturated:
+            response = JsonResponse({'error': 'Too many predictions in progress. Please retry.'}, status=429)
+            response['Retry-After'] = '1'
+            return response
+        try:
+            output = await asyncio.wrap_future(future)
+        except Exception as e:
+            return JsonResponse({'error': f'Prediction failed: {str(e)}'}, status=500)
+    result = predict_result(output, top_k)
+
+    correct_label = request.POST.get('correct_label')
+    if correct_label and correct_label != 'undefined':
+        label_instance = await FoodLabel.objects.filter(pk=correct_label).afirst()
+        if label_instance is None:
+            return JsonResponse({'error': 'Label not found.'}, status=400)
+        feedback = await FoodFeedbackSample.objects.acreate(
+            image=image_file, label=label_instance, is_correct=(label_instance.name == result['predicted_label'])
+        )
+        data = await sync_to_async(lambda: FoodFeedbackSampleSerializer(feedback, context={'request': request}).data)()
+        return JsonResponse({**result, 'feedback': data})
+    return JsonResponse(result)
+
+def archive_members(archive, max_files):
+    """The image candidates inside an open zip archive (directories and metadata files skipped)"""
+    members = [
+        info for info in archive.infolist()
+        if not info.is_dir() and not os.path.basename(info.filename).startswith('.')
+        and not info.filename.startswith('__MACOSX/')
+    ]
+    if len(members) > max_files:
+        raise ValueError(f'Too many files in archive (max {max_files}).')
+    return members
+
+def iter_archive_images(archive, members):
+    """
+    Yield (name, file, error) for archive members, opening each one lazily as a
+    streaming file so no member is decompressed into memory up front
+    """
+    for info in members:
+        content_type = mimetypes.guess_type(info.filename)[0] or 'application/octet-stream'
+        # اعتبارسنجی قبل از خواندن محتوا تا فایل‌های بزرگ از حافظه عبور نکنند
+        stub = SimpleNamespace(name=info.filename, content_type=content_type, size=info.file_size)
+        is_valid, message = validate_image_file(stub)
+        if not is_valid:
+            yield info.filename, None, message
+            continue
+        image_file = File(archive.open(info), name=info.filename)
+        image_file.size = info.file_size
+        yield info.filename, image_file, None
+
+class PredictBatchView(APIView):
+    """Predict many images in one request (multipart `images` list or a zip `archive`)"""
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        max_files = getattr(settings, 'PREDICT_BATCH_MAX_FILES', 32)
+        archive_file = request.FILES.get('archive')
+        archive = None
+        try:
+            if archive_file:
+                try:
+                    archive = zipfile.ZipFile(archive_file)
+                    members = archive_members(archive, max_files)
+                except (zipfile.BadZipFile, ValueError) as e:
+                    return Response({'error': f'Invalid archive: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+                names = [info.filename for info in members]
+                entries = iter_archive_images(archive, members)
+            else:
+                files = request.FILES.getlist('images')
+                names = [f.name for f in files]
+                entries = ((f.name, f, None) for f in files)
+            if not names:
+                return Response({'error': 'No images provided.'}, status=status.HTTP_400_BAD_REQUEST)
+            if len(names) > max_files:
+                return Response({'error': f'Too many images (max {max_files}).'}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                top_k = parse_top_k(request)
+            except ValueError as e:
+                return Response({'error': f'Invalid top_k: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+            served = load_model()  # Ensure model is loaded
+            if served is None:
+                return Response({'error': 'Model not available. Please retrain the model.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            # تصاویر در گروه‌هایی به اندازه‌ی batch باز، decode و پیش‌بینی می‌شوند
+            results = [{'filename': name} for name in names]
+            chunk_size = getattr(settings, 'PREDICT_BATCH_MAX_SIZE', 16)
+            for offset in range(0, len(names), chunk_size):
+                chunk = list(islice(entries, chunk_size))
+                try:
+                    self.predict_chunk(chunk, results[offset:offset + len(chunk)], served, top_k)
+                except Exception as e:
+                    return Response({'error': f'Prediction failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                finally:
+                    if archive is not None:
+                        for _, image_file, _ in chunk:
+                            if image_file is not None:
+                                image_file.close()
+            return Response({'count': len(results), 'predictions': results})
+        finally:
+            if archive is not None:
+                archive.close()
+
+    def predict_chunk(self, chunk, results, served, top_k):
+        """Fill `results` (one dict per entry of `chunk`) with predictions or errors"""
+        pending = []
+        for result, (name, image_file, error) in zip(results, chunk):
+            if error:
+                result['error'] = error
+                continue
+            is_valid, message = validate_image_file(image_file)
+            if not is_valid:
+                result['error'] = message
+                continue
+            content_hash = upload_sha256(image_file)
+            cached = prediction_cache.get(content_hash, served)
+            if cached is not None:
+                result.update(predict_result(cached, top_k))
+                continue
+            pending.append((result, content_hash, decode_executor.submit(load_image_tensor, image_file, served)))
+
+        tensors = []
+        for result, content_hash, future in pending:
+            try:
+                tensors.append((result, content_hash, future.result()))
+            except Exception as e:
+                result['error'] = f'Could not decode image: {e}'
+
+        if not tensors:
+            return
+        outputs = predict_batcher.submit_many([tensor for _, _, tensor in tensors])
+        for (result, content_hash, _), output in zip(tensors, outputs):
+            prediction_cache.set(content_hash, output)
+            result.update(predict_result(output, top_k))
+
 class FoodLabelListCreateView(generics.ListCreateAPIView):
-    queryset = FoodLabel.objects.all()
+    queryset = FoodLabel.objects.annotate(annotated_sample_count=Count('samples'))
     serializer_class = FoodLabelSerializer
 
 class AddFoodSampleView(APIView):
@@ -195,22 +354,108 @@ class FeedbackPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 50
 
+class FeedbackCursorPagination(BasePagination):
+    """
+    Keyset pagination on (created_at, id), newest first.
+
+    Each page is a range scan that starts after the cursor row (backed by the
+    (label, created_at) index), so there is no OFFSET and no COUNT(*): the
+    cost of a page does not depend on its depth or on the table size.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        """(position, reverse) from the cursor parameter; position is None on the first page"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            direction, created_at, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            return (datetime.fromisoformat(created_at), int(pk)), direction == 'r'
+        except ValueError:
+            raise NotFound('Invalid cursor.')
+
+    def encode_cursor(self, row, reverse):
+        position = f"{'r' if reverse else 'f'}|{row.created_at.isoformat()}|{row.pk}"
+        return replace_query_param(self.base_url, self.cursor_query_param, base64.urlsafe_b64encode(position.encode()).decode())
+
+    def after_cursor(self, queryset, position, reverse=False):
+        """`queryset` ordered on (created_at, id) and restricted to the rows after `position`"""
+        # صفحه‌ی قبلی با پیمایش معکوس از همان cursor ساخته می‌شود
+        queryset = queryset.order_by(*(('created_at', 'id') if reverse else ('-created_at', '-id')))
+        if position is None:
+            return queryset
+        created_at, pk = position
+        # the plain range term on created_at lets the index seek to the cursor;
+        # the OR only breaks ties within that timestamp
+        if reverse:
+            return queryset.filter(Q(created_at__gte=created_at), Q(created_at__gt=created_at) | Q(id__gt=pk))
+        return queryset.filter(Q(created_at__lte=created_at), Q(created_at__lt=created_at) | Q(id__lt=pk))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        queryset = self.after_cursor(queryset, position, reverse)
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = has_more if reverse else position is not None
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data})
+
 class FoodFeedbackListView(generics.ListAPIView):
+    """Feedback samples, newest first; `?cursor=` (empty for the first page) switches to keyset pagination"""
     serializer_class = ShowFoodFeedbackSampleSerializer
     pagination_class = FeedbackPagination
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['label']
     ordering = ['-created_at']
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            use_cursor = FeedbackCursorPagination.cursor_query_param in self.request.query_params
+            self._paginator = FeedbackCursorPagination() if use_cursor else self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
-        queryset = FoodFeedbackSample.objects.all().order_by('-created_at')
+        queryset = FoodFeedbackSample.objects.select_related('label').order_by('-created_at')
         label_id = self.request.query_params.get('label')
         if label_id:
             queryset = queryset.filter(label_id=label_id)
         return queryset
 
 class FoodFeedbackSampleUpdateView(generics.RetrieveUpdateAPIView):
-    queryset = FoodFeedbackSample.objects.all()
+    queryset = FoodFeedbackSample.objects.select_related('label')
     serializer_class = ShowFoodFeedbackSampleSerializer
     permission_classes = []  # کنترل دسترسی در متد update
 
@@ -225,26 +470,32 @@ class FoodFeedbackSampleUpdateView(generics.RetrieveUpdateAPIView):
         return Response({'message': 'Feedback deleted successfully.'}, status=204)
 
 class RetrainModelView(APIView):
+    """Queue a retrain job; the training worker (run_training_worker) runs it"""
     def post(self, request, *args, **kwargs):
-        try:
-            # اجرای آموزش مدل با call_command
-            out = StringIO()
-            call_command('retrain_model', stdout=out)
-            output = out.getvalue()
-            # Reload model after retraining
-            global model
-            model = None
-            load_model()
-            return Response({
-                'message': 'Model retrained successfully.',
-                'output': output,
-                'timestamp': datetime.now().isoformat()
-            })
-        except Exception as e:
-            return Response({
-                'error': 'Retrain failed.',
-                'details': str(e)
-            }, status=500)
+        job, created = enqueue_job('retrain')
+        serializer = TrainingJobSerializer(job)
+        return Response({
+            'message': 'Retrain job queued.' if created else 'A retrain job is already in progress.',
+            'job': serializer.data,
+            'status_url': reverse('training-job-detail', args=[job.pk], request=request),
+            'timestamp': datetime.now().isoformat()
+        }, status=status.HTTP_202_ACCEPTED)
+
+class TrainingJobListView(generics.ListAPIView):
+    queryset = TrainingJob.objects.all()
+    serializer_class = TrainingJobSerializer
+    pagination_class = FeedbackPagination
+
+class TrainingJobDetailView(generics.RetrieveAPIView):
+    queryset = TrainingJob.objects.all()
+    serializer_class = TrainingJobSerializer
+
+class TrainingJobCancelView(APIView):
+    def post(self, request, pk, *args, **kwargs):
+        job = generics.get_object_or_404(TrainingJob, pk=pk)
+        if not cancel_job(job):
+            return Response({'error': f'Job is already {job.status}.'}, status=status.HTTP_409_CONFLICT)
+        return Response(TrainingJobSerializer(job).data)
 
 class SubmitFeedbackView(APIView):
     parser_classes = (MultiPartParser, FormParser)
@@ -313,5 +564,5 @@ class SubmitFeedbackView(APIView):
             return Response({'error': str(e)}, status=500)
 
 class FoodLabelRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = FoodLabel.objects.all()
+    queryset = FoodLabel.objects.annotate(annotated_sample_count=Count('samples'))
     serializer_class = FoodLabelSerializer
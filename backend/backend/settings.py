@@ -146,11 +146,75 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 # File upload settings for mobile compatibility
+# فایل‌ها به صورت stream روی دیسک نوشته می‌شوند (hash و تشخیص نوع همزمان با دریافت)
+FILE_UPLOAD_HANDLERS = ['ai_api.uploads.StreamingImageUploadHandler']
+UPLOAD_MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB برای هر تصویر
+UPLOAD_MAX_FILE_SIZE = 100 * 1024 * 1024  # فایل‌های غیر تصویری (مثلاً zip در predict-batch)
+UPLOAD_MAX_REQUEST_SIZE = 200 * 1024 * 1024  # درخواست‌های بزرگ‌تر قبل از خواندن body رد می‌شوند
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 FILE_UPLOAD_TEMP_DIR = None
 FILE_UPLOAD_PERMISSIONS = 0o644
 
+# Published model bundles (see model_core.registry)
+MODEL_REGISTRY_DIR = BASE_DIR / 'data' / 'models'
+MODEL_REGISTRY_KEEP = 3  # تعداد نسخه‌های قبلی که روی دیسک نگه داشته می‌شوند
+
+# Data-driven retrain scheduler (manage.py retrain_scheduler)
+RETRAIN_MIN_NEW_SAMPLES = 20  # تعداد نمونه‌ی جدید لازم برای آموزش مجدد
+RETRAIN_DRIFT_THRESHOLD = 0.2  # فاصله‌ی توزیع لیبل‌های جدید از قبلی (0 تا 1)
+RETRAIN_DRIFT_MIN_SAMPLES = 5  # حداقل نمونه‌ی جدید برای بررسی drift
+RETRAIN_MIN_INTERVAL = 60 * 60  # حداقل فاصله بین دو آموزش (ثانیه)
+RETRAIN_CHECK_INTERVAL = 60  # فاصله‌ی بررسی (ثانیه)
+RETRAIN_INCREMENTAL = True  # ادامه‌ی آموزش از مدل قبلی به جای آموزش از صفر
+# job در صف که بعد از این مدت (ثانیه) برداشته نشده با waiting_for_worker گزارش می‌شود
+TRAINING_JOB_PICKUP_TIMEOUT = 60
+
+# Cache backbone embeddings of new samples at upload time (used by retrain_model --head-only)
+EMBED_ON_UPLOAD = True
+
+# cache تصاویر resize شده (uint8) برای آموزش؛ None = خواندن مستقیم تصاویر اصلی
+TRAINING_SHARD_CACHE_DIR = BASE_DIR / 'data' / 'shards'
+
+# Inference backend: 'eager'، 'torchscript' (trace + freeze)، 'onnxruntime' (نیازمند onnx و onnxruntime) یا 'remote'
+# فایل‌های کامپایل‌شده کنار فایل مدل کش می‌شوند
+INFERENCE_BACKEND = 'eager'
+INFERENCE_INTRA_OP_THREADS = None  # thread های torch/onnxruntime؛ None = تعداد هسته‌ها تقسیم بر WEB_CONCURRENCY
+# 'remote': اجرای مدل در process های جداگانه (manage.py run_inference_workers) از طریق Unix socket
+INFERENCE_WORKER_SOCKET = BASE_DIR / 'data' / 'inference.sock'
+INFERENCE_WORKERS = 2  # تعداد process های inference؛ هسته‌ها بین آن‌ها تقسیم می‌شوند
+INFERENCE_WORKER_BACKEND = 'eager'  # backend ی مدل داخل هر worker
+INFERENCE_WORKER_TIMEOUT = 30  # ثانیه؛ اتصال client ی بی‌پاسخ بسته می‌شود
+INFERENCE_WORKER_MAX_PAYLOAD_MB = 64  # درخواست‌های بزرگ‌تر قبل از تخصیص حافظه رد می‌شوند
+# 'int8': سرو نسخه‌ی کوانتیزه‌شده (اگر هنگام انتشار ساخته شده باشد)، وگرنه fp32
+INFERENCE_PRECISION = 'fp32'
+
+# ساخت نسخه‌ی int8 هنگام انتشار مدل
+QUANTIZE_ON_PUBLISH = True
+QUANTIZE_MAX_ACCURACY_DROP = 0.02  # بیشترین افت مجاز دقت top-1 نسبت به fp32
+QUANTIZE_CALIBRATION_SAMPLES = 128
+
+# Prediction cache (hash تصویر + نسخه‌ی مدل)؛ 0 = غیرفعال
+PREDICTION_CACHE_SIZE = 1024
+PREDICTION_CACHE_ALIAS = None  # نام یک cache در CACHES (مثلاً file-based) برای اشتراک بین processها
+PREDICTION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# system-stats: مدت کش snapshot (ثانیه) و نام cache در CACHES
+# با cache ی 'default' (LocMem) هر process کپی خودش را دارد و signal فقط کپی همان process را باطل می‌کند؛
+# بقیه‌ی processها تا SYSTEM_STATS_CACHE_TIMEOUT ثانیه عدد قبلی را نشان می‌دهند. برای اشتراک، یک cache مشترک (مثلاً file-based) بدهید
+SYSTEM_STATS_CACHE_TIMEOUT = 10
+SYSTEM_STATS_CACHE_ALIAS = 'default'
+
+# Micro-batching of concurrent predict requests
+PREDICT_BATCH_MAX_SIZE = 16  # بیشترین تعداد تصویر در یک forward pass
+PREDICT_BATCH_MAX_WAIT_MS = 5  # حداکثر زمان انتظار برای پر شدن batch
+PREDICT_BATCH_MAX_FILES = 32  # حداکثر تعداد تصویر در endpoint دسته‌ای
+PREDICT_TOP_K = 3  # تعداد لیبل‌های محتمل در پاسخ predict
+
+# Async predict endpoint (predict-async/, برای اجرا زیر ASGI)
+ASYNC_PREDICT_WORKERS = min(8, os.cpu_count() or 1)  # thread های decode و inference
+ASYNC_PREDICT_MAX_PENDING = 32  # درخواست‌های بیشتر در حال اجرا/صف با 429 رد می‌شوند
+
 # Additional CORS settings for mobile
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_METHODS = [
@@ -0,0 +1,170 @@
+"""
+Contains the inference backends a model can be served with.
+
+A backend turns an eval-mode model into a callable that maps a float
+(N, 3, H, W) batch to (N, num_classes) logits:
+
+- "eager": the PyTorch module itself.
+- "torchscript": a traced and frozen TorchScript graph.
+- "onnxruntime": an ONNX export run by ONNX Runtime on the CPU (needs the
+  optional onnx and onnxruntime packages).
+- "remote": the inference worker pool (worker_pool.py) runs the bundle in
+  separate processes; needs the "socket_path" and "bundle_path" options.
+
+Compiled artifacts are cached on disk next to the bundle, keyed by the
+sha256 of the weights, so a restart loads them instead of compiling again.
+"""
+
+import copy
+import inspect
+import os
+import warnings
+
+import torch
+
+from typing import Callable, Dict, Optional, Sequence
+
+from .ipc import RemoteRunner
+
+try:
+    import onnxruntime
+except ImportError:  # optional dependency
+    onnxruntime = None
+
+
+def _eager(model: torch.nn.Module, example: torch.Tensor, artifact_path: str, num_threads=None, **options) -> Callable:
+    return model
+
+
+def _torchscript(model: torch.nn.Module, example: torch.Tensor, artifact_path: str, num_threads=None, **options) -> Callable:
+    """Traces and freezes the model; freezing inlines the weights and folds conv-bn pairs."""
+    with warnings.catch_warnings():
+        # TorchScript is deprecated in favour of torch.compile, whose artifacts cannot be cached on disk
+        warnings.simplefilter("ignore", FutureWarning)
+        if os.path.exists(artifact_path):
+            return torch.jit.load(artifact_path, map_location=example.device)
+        with torch.no_grad():
+            frozen = torch.jit.freeze(torch.jit.trace(model.eval(), example))
+        torch.jit.save(frozen, artifact_path + ".tmp")
+        os.replace(artifact_path + ".tmp", artifact_path)
+        return frozen
+
+
+def export_onnx(model: torch.nn.Module, path: str, input_size: Sequence[int] = (224, 224)):
+    """Exports a model to ONNX with a dynamic batch axis ("input" -> "logits")."""
+    if next(model.parameters()).device.type != "cpu":
+        model = copy.deepcopy(model).cpu()
+    example = torch.zeros(1, 3, *input_size)
+    options = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # torch >= 2.5: keep the TorchScript-based exporter (older versions have no such argument)
+        options["dynamo"] = False
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        torch.onnx.export(
+            model.eval(),
+            (example,),
+            path + ".tmp",
+            input_names=["input"],
+            output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            **options,
+        )
+    os.replace(path + ".tmp", path)
+
+
+class OnnxRuntimeRunner:
+    """Runs an exported model with ONNX Runtime, taking and returning torch tensors.
+
+    Args:
+    path: ONNX file written by export_onnx().
+    num_threads: Intra-op thread count (None: ONNX Runtime's default).
+    """
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, X: torch.Tensor) -> torch.Tensor:
+        inputs = X.detach().cpu().float().contiguous().numpy()
+        return torch.from_numpy(self.session.run(["logits"], {"input": inputs})[0])
+
+
+def _onnxruntime(model: torch.nn.Module, example: torch.Tensor, artifact_path: str, num_threads=None, **options) -> Callable:
+    if onnxruntime is None:
+        raise ImportError("onnxruntime is not installed.")
+    if not os.path.exists(artifact_path):
+        export_onnx(model, artifact_path, example.shape[2:])
+    return OnnxRuntimeRunner(artifact_path, num_threads=num_threads)
+
+
+def _remote(model: torch.nn.Module, example: torch.Tensor, artifact_path: str, num_threads=None, **options) -> Callable:
+    return RemoteRunner(options["socket_path"], options["bundle_path"], timeout=options.get("timeout", 30.0))
+
+
+# name -> (artifact extension or None, factory, runs on the CPU only)
+BACKENDS = {
+    "eager": (None, _eager, False),
+    "torchscript": ("ts", _torchscript, False),
+    "onnxruntime": ("onnx", _onnxruntime, True),
+    "remote": (None, _remote, True),
+}
+
+
+def bundle_prefix(bundle_path: str) -> str:
+    """Artifact path prefix of a bundle (…/v000012.pt or its .tmp file -> …/v000012)."""
+    if bundle_path.endswith(".tmp"):
+        bundle_path = bundle_path[: -len(".tmp")]
+    return os.path.splitext(bundle_path)[0]
+
+
+def artifact_path(name: str, prefix: str, sha256: str, device: torch.device) -> str:
+    """Path of the cached artifact of `name` for the weights hashed as `sha256`."""
+    extension = BACKENDS[name][0]
+    return f"{prefix}.{sha256[:16]}.{torch.device(device).type}.{extension}"
+
+
+def load_backend(
+    name: str,
+    model: torch.nn.Module,
+    sha256: str,
+    prefix: str,
+    input_size: Sequence[int] = (224, 224),
+    device: torch.device = "cpu",
+    warmup_runs: int = 2,
+    num_threads: Optional[int] = None,
+    options: Optional[Dict] = None,
+) -> Callable:
+    """Prepares a model for serving with the given backend.
+
+    Args:
+    name: One of BACKENDS.
+    model: Eval-mode model on `device`.
+    sha256: Hash of the model weights; part of the artifact file name.
+    prefix: Path prefix for cached artifacts, e.g. the bundle path without extension.
+    input_size: (height, width) of the model input.
+    device: Device the model runs on.
+    warmup_runs: Forward passes on a dummy batch before returning, so the
+      first request does not pay for lazy initialization or optimization.
+    num_threads: Intra-op threads for backends that manage their own
+      thread pool (onnxruntime).
+    options: Backend-specific keyword arguments (e.g. "socket_path" for remote).
+
+    Returns:
+    A callable mapping an input batch to logits.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}; choose from {sorted(BACKENDS)}.")
+    extension, factory, cpu_only = BACKENDS[name]
+    if cpu_only:
+        device = "cpu"
+    example = torch.zeros(1, 3, *input_size, device=device)
+    path = artifact_path(name, prefix, sha256, device) if extension else None
+    runner = factory(model, example, path, num_threads=num_threads, **(options or {}))
+    with torch.inference_mode():
+        for _ in range(warmup_runs):
+            runner(example)
+    return runner
@@ -0,0 +1,203 @@
+"""
+Contains a dynamic micro-batching scheduler for serving a PyTorch model
+to many concurrent callers, and a bounded executor that sheds load instead
+of queueing without limit.
+"""
+
+import queue
+import threading
+import time
+
+import torch
+
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+
+class MicroBatcher:
+    """Coalesces single-sample requests from many threads into batches.
+
+    Callers submit one input tensor each from their own thread. A single
+    background thread collects queued inputs until either `max_batch_size`
+    is reached or `max_wait_ms` has passed since the first input of the
+    batch arrived, runs one batched forward pass and hands every caller
+    back its own row of the output.
+
+    Args:
+    forward_fn: Callable taking a stacked batch tensor and returning a
+      tensor whose first dimension matches the batch.
+    max_batch_size: Upper bound on how many inputs go into one forward pass.
+    max_wait_ms: How long to wait for more inputs once a batch has started.
+    name: Name of the background thread (useful in stack dumps).
+    """
+
+    def __init__(
+        self,
+        forward_fn: Callable[[torch.Tensor], torch.Tensor],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        name: str = "micro-batcher",
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.forward_fn = forward_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # Stats
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._max_queue_depth = 0
+
+    def submit(self, item: torch.Tensor, timeout: Optional[float] = None) -> torch.Tensor:
+        """Queues a single (unbatched) input and blocks until its output is ready.
+
+        Args:
+        item: One input sample without the batch dimension.
+        timeout: Seconds to wait for the result, or None to wait forever.
+
+        Returns:
+        The output row belonging to `item`.
+        """
+        return self.submit_many([item], timeout=timeout)[0]
+
+    def submit_many(self, items: List[torch.Tensor], timeout: Optional[float] = None) -> List[torch.Tensor]:
+        """Queues several inputs at once and blocks until all outputs are ready.
+
+        The inputs are coalesced with whatever other callers have queued, so a
+        large request is split into batches of at most `max_batch_size`.
+
+        Args:
+        items: Input samples without the batch dimension.
+        timeout: Seconds to wait for each result, or None to wait forever.
+
+        Returns:
+        A list of output rows in the same order as `items`.
+        """
+        futures = [Future() for _ in items]
+        self._ensure_started()
+        for item, future in zip(items, futures):
+            self._queue.put((item, future))
+        depth = self._queue.qsize()
+        if depth > self._max_queue_depth:
+            self._max_queue_depth = depth
+        return [future.result(timeout=timeout) for future in futures]
+
+    def stats(self) -> Dict:
+        """Returns queue depth and batch-size histogram of the scheduler."""
+        with self._lock:
+            histogram = dict(sorted(self._batch_sizes.items()))
+            batches = sum(histogram.values())
+            items = self._items
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self._max_queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": (items / batches) if batches else 0.0,
+            "batch_size_histogram": histogram,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        # Block for the first item, then keep pulling until the batch is
+        # full or the wait window that started with the first item closes.
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch]
+            try:
+                outputs = self.forward_fn(torch.stack([item for item, _ in batch]))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for i, future in enumerate(futures):
+                    future.set_result(outputs[i])
+
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._items += len(batch)
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised by BoundedExecutor.submit() when all of its slots are taken."""
+
+
+class BoundedExecutor:
+    """A thread pool that rejects work once `max_pending` tasks are in flight.
+
+    Unlike a plain ThreadPoolExecutor, whose queue grows without bound, a
+    saturated BoundedExecutor fails fast so the caller can answer "try again
+    later" while the request is still cheap.
+
+    Args:
+    max_workers: Threads running tasks.
+    max_pending: Tasks allowed in flight (running or queued) at once;
+      defaults to `max_workers`.
+    name: Thread name prefix.
+    """
+
+    def __init__(self, max_workers: int, max_pending: Optional[int] = None, name: str = "bounded-executor"):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending or self.max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Schedules fn(*args, **kwargs), or raises ExecutorSaturated."""
+        with self._lock:
+            if self._in_flight >= self.max_pending:
+                self._rejected += 1
+                raise ExecutorSaturated(f"{self._in_flight} tasks in flight (max {self.max_pending}).")
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected,
+            }
@@ -0,0 +1,158 @@
+"""
+Contains functionality for saving and loading self-describing model bundles.
+
+A bundle is a single torch.save() file holding the model weights together
+with everything needed to serve them: the ordered class list, the eval
+preprocessing spec, the training metrics and a content hash of the weights.
+"""
+
+import functools
+import hashlib
+
+import torch
+import torchvision
+
+from datetime import datetime, timezone
+from torchvision import transforms
+from typing import Callable, Dict, List, Optional
+
+from .imaging import decode_normalized
+
+BUNDLE_FORMAT = "ai-food-bundle"
+BUNDLE_VERSION = 1
+
+DEFAULT_TRANSFORM = {
+    "resize": [224, 224],
+    "mean": [0.485, 0.456, 0.406],
+    "std": [0.229, 0.224, 0.225],
+}
+
+
+def state_dict_sha256(state_dict: Dict[str, torch.Tensor]) -> str:
+    """Hashes the names, dtypes, shapes and contents of a state_dict."""
+    digest = hashlib.sha256()
+    for key in sorted(state_dict):
+        tensor = state_dict[key].detach().cpu().contiguous()
+        digest.update(key.encode())
+        digest.update(str(tensor.dtype).encode())
+        digest.update(str(tuple(tensor.shape)).encode())
+        digest.update(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def backbone_sha256(state_dict: Dict[str, torch.Tensor]) -> str:
+    """Hashes only the feature-extractor weights (everything but the classifier).
+
+    Embeddings computed with one backbone stay valid for every bundle that
+    shares this hash, e.g. after a head-only retrain.
+    """
+    return state_dict_sha256({k: v for k, v in state_dict.items() if not k.startswith("classifier.")})
+
+
+def save_bundle(
+    path: str,
+    model: torch.nn.Module,
+    class_names: List[str],
+    transform: Optional[Dict] = None,
+    metrics: Optional[Dict] = None,
+    temperature: float = 1.0,
+) -> Dict:
+    """Saves a model and its metadata as a bundle.
+
+    Args:
+    path: Target file path.
+    model: Trained model whose state_dict is stored.
+    class_names: Class names in the order of the model outputs.
+    transform: Eval preprocessing spec (defaults to DEFAULT_TRANSFORM).
+    metrics: Training results, e.g. the dictionary returned by engine.train().
+    temperature: Softmax temperature for calibrated confidence (see calibration.py).
+
+    Returns:
+    The saved bundle without the weights.
+    """
+    state_dict = {k: v.detach().cpu() for k, v in model.state_dict().items()}
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "format_version": BUNDLE_VERSION,
+        "class_names": list(class_names),
+        "transform": dict(transform or DEFAULT_TRANSFORM),
+        "metrics": metrics or {},
+        "temperature": float(temperature),
+        "sha256": state_dict_sha256(state_dict),
+        "backbone_sha256": backbone_sha256(state_dict),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "state_dict": state_dict,
+    }
+    torch.save(bundle, path)
+    return {k: v for k, v in bundle.items() if k != "state_dict"}
+
+
+def load_bundle(path: str, map_location="cpu", mmap: bool = True) -> Dict:
+    """Loads a bundle, memory-mapping the weights by default.
+
+    Checkpoints that are a bare state_dict (the format written before bundles
+    existed) are returned as a bundle with `class_names` set to None.
+
+    Args:
+    path: Bundle file path.
+    map_location: Passed to torch.load().
+    mmap: Memory-map the tensors instead of reading them into RAM.
+
+    Returns:
+    A dictionary with at least "state_dict", "class_names", "transform",
+    "metrics", "temperature", "sha256" and "backbone_sha256" keys.
+    """
+    obj = torch.load(path, map_location=map_location, mmap=mmap, weights_only=True)
+    if isinstance(obj, dict) and obj.get("format") == BUNDLE_FORMAT:
+        obj.setdefault("backbone_sha256", None)
+        obj.setdefault("temperature", 1.0)
+        return obj
+    return {
+        "format": BUNDLE_FORMAT,
+        "format_version": 0,
+        "class_names": None,
+        "transform": dict(DEFAULT_TRANSFORM),
+        "metrics": {},
+        "temperature": 1.0,
+        "sha256": None,
+        "backbone_sha256": None,
+        "state_dict": obj,
+    }
+
+
+def build_model(bundle: Dict, class_names: Optional[List[str]] = None) -> torch.nn.Module:
+    """Creates an EfficientNet-B0 in eval mode from a loaded bundle.
+
+    The model is constructed on the meta device and the bundle tensors are
+    assigned in place, so memory-mapped weights are not copied.
+
+    Args:
+    bundle: A bundle returned by load_bundle().
+    class_names: Overrides the bundle class list (needed for legacy checkpoints).
+    """
+    num_classes = len(class_names or bundle["class_names"])
+    with torch.device("meta"):
+        model = torchvision.models.efficientnet_b0(weights=None, num_classes=num_classes)
+    model.load_state_dict(bundle["state_dict"], assign=True)
+    return model.eval()
+
+
+def build_eval_transform(spec: Optional[Dict] = None) -> transforms.Compose:
+    """Builds the torchvision eval transform described by a bundle spec."""
+    spec = spec or DEFAULT_TRANSFORM
+    return transforms.Compose([
+        transforms.Resize(tuple(spec["resize"])),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=spec["mean"], std=spec["std"]),
+    ])
+
+
+def build_eval_decoder(spec: Optional[Dict] = None) -> Callable:
+    """Builds a callable that decodes an image file (path or file object)
+    straight into the normalized input tensor described by a bundle spec.
+
+    Produces the same tensor as build_eval_transform(), but decodes JPEGs
+    at reduced resolution (see imaging.decode_normalized()).
+    """
+    spec = spec or DEFAULT_TRANSFORM
+    return functools.partial(decode_normalized, size=spec["resize"], mean=spec["mean"], std=spec["std"])
@@ -0,0 +1,76 @@
+"""
+Contains temperature scaling for calibrating classifier confidence.
+
+Softmax probabilities of a network trained with cross-entropy tend to be
+over-confident. Dividing the logits by a single temperature fitted on
+held-out data (Guo et al., 2017) fixes most of that without changing which
+class is predicted.
+"""
+
+import torch
+
+from typing import Iterable, Tuple
+
+MIN_TEMPERATURE = 0.05
+MAX_TEMPERATURE = 20.0
+
+
+def collect_logits(model: torch.nn.Module, batches: Iterable, device: torch.device = "cpu") -> Tuple[torch.Tensor, torch.Tensor]:
+    """Runs the model over (X, y) batches and returns all (logits, targets) on the CPU."""
+    logits, targets = [], []
+    model.eval()
+    with torch.inference_mode():
+        for X, y in batches:
+            logits.append(model(X.to(device)).float().cpu())
+            targets.append(y.cpu())
+    if not logits:
+        return torch.empty(0, 0), torch.empty(0, dtype=torch.long)
+    return torch.cat(logits), torch.cat(targets)
+
+
+def fit_temperature(logits: torch.Tensor, targets: torch.Tensor, max_iter: int = 100) -> float:
+    """Finds the temperature minimizing the negative log-likelihood of `targets`.
+
+    Args:
+    logits: (N, num_classes) held-out logits.
+    targets: (N,) class indices.
+    max_iter: LBFGS iterations.
+
+    Returns:
+    The temperature, clamped to [MIN_TEMPERATURE, MAX_TEMPERATURE]; 1.0
+    when there is nothing to fit on.
+    """
+    if len(targets) == 0:
+        return 1.0
+    logits = logits.detach().float()
+    # log(T) is optimized so the temperature stays positive
+    log_t = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_t], lr=0.1, max_iter=max_iter)
+    loss_fn = torch.nn.CrossEntropyLoss()
+
+    def closure():
+        optimizer.zero_grad()
+        loss = loss_fn(logits / log_t.exp(), targets)
+        loss.backward()
+        return loss
+
+    with torch.enable_grad():
+        optimizer.step(closure)
+    temperature = log_t.detach().exp().item()
+    if temperature != temperature:  # NaN
+        return 1.0
+    return min(max(temperature, MIN_TEMPERATURE), MAX_TEMPERATURE)
+
+
+def top_k_probabilities(logits: torch.Tensor, k: int, temperature: float = 1.0):
+    """Top-k classes of each row with raw and temperature-scaled softmax probabilities.
+
+    Returns:
+    A tuple (indices, probabilities, calibrated_probabilities), each of shape (N, k).
+    """
+    logits = logits.float()
+    k = min(k, logits.shape[-1])
+    probabilities = torch.softmax(logits, dim=-1)
+    calibrated = torch.softmax(logits / temperature, dim=-1)
+    top = probabilities.topk(k, dim=-1)
+    return top.indices, top.values, calibrated.gather(-1, top.indices)
@@ -3,12 +3,113 @@ Contains functionality for creating PyTorch DataLoaders for
 image classification data.
 """
 
+import math
 import os
+import time
+
+import torch
 
 from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Dataset
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from .imaging import open_rgb
+
+
+def available_cpus() -> int:
+    """Cores this process may run on (respects affinity/cpuset limits, e.g. in containers)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+NUM_WORKERS = available_cpus()
+
+
+def default_num_workers(dataset_size: Optional[int] = None, batch_size: int = 1) -> int:
+    """Picks a worker count for the host: one core is left for the training loop,
+  and there are never more workers than batches to load."""
+    workers = min(max(available_cpus() - 1, 0), 8)
+    if dataset_size is not None:
+        workers = min(workers, math.ceil(dataset_size / batch_size))
+    return workers
+
 
-NUM_WORKERS = os.cpu_count()
+class TimedDataLoader(DataLoader):
+    """DataLoader that measures how long the consumer waited for batches.
+
+  After every full pass, `wait_time` holds the seconds spent blocked on
+  the next batch and `wait_fraction` that time relative to the whole pass.
+  """
+
+    wait_time = 0.0
+    total_time = 0.0
+
+    def __iter__(self):
+        self.wait_time = 0.0
+        start = time.perf_counter()
+        iterator = super().__iter__()
+        while True:
+            fetch_start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            self.wait_time += time.perf_counter() - fetch_start
+            yield batch
+        self.total_time = time.perf_counter() - start
+
+    @property
+    def wait_fraction(self) -> float:
+        return self.wait_time / self.total_time if self.total_time else 0.0
+
+
+def make_dataloader(
+    dataset: Dataset,
+    batch_size: int,
+    shuffle: bool = False,
+    num_workers: Optional[int] = None,
+    pin_memory: Optional[bool] = None,
+    persistent_workers: bool = True,
+    prefetch_factor: Optional[int] = 2,
+    sharing_strategy: Optional[str] = None,
+) -> TimedDataLoader:
+    """Creates a DataLoader for the training pipeline.
+
+  Args:
+    dataset: Dataset to load from.
+    batch_size: Number of samples per batch.
+    shuffle: Reshuffle the data every epoch.
+    num_workers: Worker processes for decoding/augmentation
+      (default: default_num_workers() for this dataset).
+    pin_memory: Page-lock batches for faster host-to-GPU copies
+      (default: only when CUDA is available).
+    persistent_workers: Keep workers alive between epochs.
+    prefetch_factor: Batches loaded in advance by each worker.
+    sharing_strategy: torch.multiprocessing sharing strategy for worker
+      tensors, e.g. "file_system" when the open file limit is low.
+
+  Returns:
+    A TimedDataLoader, which reports the data-wait fraction of each epoch.
+  """
+    if num_workers is None:
+        num_workers = default_num_workers(len(dataset), batch_size)
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    if sharing_strategy is not None and num_workers > 0:
+        torch.multiprocessing.set_sharing_strategy(sharing_strategy)
+    worker_options = {}
+    if num_workers > 0:
+        # These options are only valid with worker processes
+        worker_options = {"persistent_workers": persistent_workers, "prefetch_factor": prefetch_factor}
+    return TimedDataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        **worker_options,
+    )
 
 
 def create_dataloaders(
@@ -49,19 +150,57 @@ def create_dataloaders(
     class_names = train_data.classes
 
     # Turn images into data loaders
-    train_dataloader = DataLoader(
+    train_dataloader = make_dataloader(
         train_data,
         batch_size=batch_size,
         shuffle=True,
         num_workers=num_workers,
-        pin_memory=True,
     )
-    test_dataloader = DataLoader(
+    test_dataloader = make_dataloader(
         test_data,
         batch_size=batch_size,
         shuffle=False,
         num_workers=num_workers,
-        pin_memory=True,
     )
 
     return train_dataloader, test_dataloader, class_names
+
+
+class SampleListDataset(Dataset):
+    """Image classification dataset over an explicit list of samples.
+
+  Unlike ImageFolder, the class index of every sample is given by the
+  caller, so the label order can come from somewhere other than the folder
+  names (e.g. the database or a previous model's class list).
+
+  Args:
+    samples: List of (image_path, class_index) tuples.
+    classes: Class names, indexed by class_index.
+    transform: Transform applied to each PIL image.
+    decode_size: (height, width) the transform resizes to; JPEGs are then
+      decoded at the smallest DCT scale that is still at least this large.
+  """
+
+    def __init__(
+        self,
+        samples: List[Tuple[str, int]],
+        classes: List[str],
+        transform: Optional[Callable] = None,
+        decode_size: Optional[Sequence[int]] = None,
+    ):
+        self.samples = list(samples)
+        self.targets = [target for _, target in self.samples]
+        self.classes = list(classes)
+        self.transform = transform
+        self.decode_size = decode_size
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        path, target = self.samples[index]
+        image = open_rgb(path, self.decode_size)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, target
+
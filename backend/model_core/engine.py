@@ -2,10 +2,26 @@
 Contains functions for training and testing a PyTorch model.
 """
 
+import time
+
 import torch
 
 from tqdm.auto import tqdm
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .metrics import ClassificationMetrics
+
+
+def _to_device(X: torch.Tensor, device: torch.device, channels_last: bool = False) -> torch.Tensor:
+    """Moves a batch to the device, in channels_last layout for image batches if requested."""
+    if channels_last and X.dim() == 4:
+        return X.to(device, memory_format=torch.channels_last)
+    return X.to(device)
+
+
+def _autocast(device: torch.device, amp_dtype: Optional[torch.dtype]):
+    """Autocast context for the forward pass; a no-op when amp_dtype is None."""
+    return torch.autocast(device_type=torch.device(device).type, dtype=amp_dtype, enabled=amp_dtype is not None)
 
 
 def train_step(
@@ -14,6 +30,10 @@ def train_step(
     loss_fn: torch.nn.Module,
     optimizer: torch.optim.Optimizer,
     device: torch.device,
+    amp_dtype: Optional[torch.dtype] = None,
+    channels_last: bool = False,
+    accumulation_steps: int = 1,
+    metrics: Optional[ClassificationMetrics] = None,
 ) -> Tuple[float, float]:
     """Trains a PyTorch model for a single epoch.
 
@@ -27,9 +47,16 @@ def train_step(
     loss_fn: A PyTorch loss function to minimize.
     optimizer: A PyTorch optimizer to help minimize the loss function.
     device: A target device to compute on (e.g. "cuda" or "cpu").
+    amp_dtype: Autocast dtype for the forward pass (e.g. torch.bfloat16),
+      or None for plain fp32.
+    channels_last: Send image batches in channels_last memory format.
+    accumulation_steps: Number of batches whose gradients are summed
+      before each optimizer step.
+    metrics: Accumulator for the epoch's metrics (reset first); read
+      metrics.compute() afterwards for anything beyond loss and accuracy.
 
     Returns:
-    A tuple of training loss and training accuracy metrics.
+    A tuple of sample-weighted training loss and accuracy.
     In the form (train_loss, train_accuracy). For example:
 
     (0.1112, 0.8743)
@@ -37,38 +64,37 @@ def train_step(
     # Put model in train mode
     model.train()
 
-    # Setup train loss and train accuracy values
-    train_loss, train_acc = 0, 0
+    # Setup metric accumulators (kept on the device until the end of the epoch)
+    metrics = metrics if metrics is not None else ClassificationMetrics()
+    metrics.reset()
+
+    optimizer.zero_grad(set_to_none=True)
 
     # Loop through data loader data batches
     for batch, (X, y) in enumerate(dataloader):
         # Send data to target device
-        X, y = X.to(device), y.to(device)
+        X, y = _to_device(X, device, channels_last), y.to(device)
 
         # 1. Forward pass
-        y_pred = model(X)
-
-        # 2. Calculate  and accumulate loss
-        loss = loss_fn(y_pred, y)
-        train_loss += loss.item()
+        with _autocast(device, amp_dtype):
+            y_pred = model(X)
 
-        # 3. Optimizer zero grad
-        optimizer.zero_grad()
+            # 2. Calculate loss
+            loss = loss_fn(y_pred, y)
 
-        # 4. Loss backward
-        loss.backward()
+        # 3. Loss backward (gradients of accumulated batches add up)
+        (loss / accumulation_steps).backward()
 
-        # 5. Optimizer step
-        optimizer.step()
+        # 4. Optimizer step and zero grad
+        if (batch + 1) % accumulation_steps == 0 or batch + 1 == len(dataloader):
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
 
-        # Calculate and accumulate accuracy metric across all batches
-        y_pred_class = torch.argmax(torch.softmax(y_pred, dim=1), dim=1)
-        train_acc += (y_pred_class == y).sum().item() / len(y_pred)
+        # Accumulate loss and accuracy without syncing with the device
+        metrics.update(y_pred, y, loss)
 
-    # Adjust metrics to get average loss and accuracy per batch
-    train_loss = train_loss / len(dataloader)
-    train_acc = train_acc / len(dataloader)
-    return train_loss, train_acc
+    values = metrics.compute()
+    return values["loss"], values["acc"]
 
 
 def test_step(
@@ -76,6 +102,9 @@ def test_step(
     dataloader: torch.utils.data.DataLoader,
     loss_fn: torch.nn.Module,
     device: torch.device,
+    amp_dtype: Optional[torch.dtype] = None,
+    channels_last: bool = False,
+    metrics: Optional[ClassificationMetrics] = None,
 ) -> Tuple[float, float]:
     """Tests a PyTorch model for a single epoch.
 
@@ -87,9 +116,13 @@ def test_step(
     dataloader: A DataLoader instance for the model to be tested on.
     loss_fn: A PyTorch loss function to calculate loss on the test data.
     device: A target device to compute on (e.g. "cuda" or "cpu").
+    amp_dtype: Autocast dtype for the forward pass, or None for fp32.
+    channels_last: Send image batches in channels_last memory format.
+    metrics: Accumulator for the epoch's metrics (reset first); read
+      metrics.compute() afterwards for anything beyond loss and accuracy.
 
     Returns:
-    A tuple of testing loss and testing accuracy metrics.
+    A tuple of sample-weighted testing loss and accuracy.
     In the form (test_loss, test_accuracy). For example:
 
     (0.0223, 0.8985)
@@ -97,31 +130,29 @@ def test_step(
     # Put model in eval mode
     model.eval()
 
-    # Setup test loss and test accuracy values
-    test_loss, test_acc = 0, 0
+    # Setup metric accumulators (kept on the device until the end of the epoch)
+    metrics = metrics if metrics is not None else ClassificationMetrics()
+    metrics.reset()
 
     # Turn on inference context manager
     with torch.inference_mode():
         # Loop through DataLoader batches
         for batch, (X, y) in enumerate(dataloader):
             # Send data to target device
-            X, y = X.to(device), y.to(device)
+            X, y = _to_device(X, device, channels_last), y.to(device)
 
             # 1. Forward pass
-            test_pred_logits = model(X)
+            with _autocast(device, amp_dtype):
+                test_pred_logits = model(X)
 
-            # 2. Calculate and accumulate loss
-            loss = loss_fn(test_pred_logits, y)
-            test_loss += loss.item()
+                # 2. Calculate loss
+                loss = loss_fn(test_pred_logits, y)
 
-            # Calculate and accumulate accuracy
-            test_pred_labels = test_pred_logits.argmax(dim=1)
-            test_acc += (test_pred_labels == y).sum().item() / len(test_pred_labels)
+            # Accumulate loss and accuracy without syncing with the device
+            metrics.update(test_pred_logits, y, loss)
 
-    # Adjust metrics to get average loss and accuracy per batch
-    test_loss = test_loss / len(dataloader)
-    test_acc = test_acc / len(dataloader)
-    return test_loss, test_acc
+    values = metrics.compute()
+    return values["loss"], values["acc"]
 
 
 def train(
@@ -132,6 +163,11 @@ def train(
     loss_fn: torch.nn.Module,
     epochs: int,
     device: torch.device,
+    epoch_callback: Optional[Callable[[int, int, Dict[str, float]], None]] = None,
+    amp_dtype: Optional[torch.dtype] = None,
+    channels_last: bool = False,
+    accumulation_steps: int = 1,
+    test_metrics: Optional[ClassificationMetrics] = None,
 ) -> Dict[str, List]:
     """Trains and tests a PyTorch model.
 
@@ -149,11 +185,27 @@ def train(
     loss_fn: A PyTorch loss function to calculate loss on both datasets.
     epochs: An integer indicating how many epochs to train for.
     device: A target device to compute on (e.g. "cuda" or "cpu").
+    epoch_callback: Optional callable run after every epoch as
+      epoch_callback(epoch, epochs, metrics), where epoch is 1-based and
+      metrics holds that epoch's values. Raising inside it stops training.
+    amp_dtype: Autocast dtype (e.g. torch.bfloat16 on CPU), or None for fp32.
+    channels_last: Convert the model and image batches to channels_last.
+    accumulation_steps: Batches per optimizer step; the effective batch
+      size is the DataLoader batch size times this value.
+    test_metrics: Metrics accumulated on the test set, e.g.
+      ClassificationMetrics(top_k=(1, 3), confusion_matrix=True).
+      Top-k accuracies are stored per epoch as "test_top{k}_acc";
+      per-class recall and the confusion matrix of the last epoch as
+      "test_per_class_recall" and "test_confusion_matrix".
 
     Returns:
     A dictionary of training and testing loss as well as training and
     testing accuracy metrics. Each metric has a value in a list for
-    each epoch.
+    each epoch. When train_dataloader reports a `wait_fraction` (see
+    data_setup.make_dataloader), the share of each training epoch spent
+    waiting on data is stored under "train_data_wait" as well. Training
+    throughput is stored under "train_images_per_sec" and the settings
+    it was measured with under "perf_mode".
     In the form: {train_loss: [...],
               train_acc: [...],
               test_loss: [...],
@@ -167,21 +219,55 @@ def train(
     # Create empty results dictionary
     results = {"train_loss": [], "train_acc": [], "test_loss": [], "test_acc": []}
 
+    results["perf_mode"] = {
+        "amp_dtype": str(amp_dtype).replace("torch.", "") if amp_dtype is not None else None,
+        "channels_last": channels_last,
+        "accumulation_steps": accumulation_steps,
+    }
+
     # Make sure model on target device
     model.to(device)
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+
+    test_metrics = test_metrics if test_metrics is not None else ClassificationMetrics()
 
     # Loop through training and testing steps for a number of epochs
     for epoch in tqdm(range(epochs)):
+        start = time.perf_counter()
         train_loss, train_acc = train_step(
             model=model,
             dataloader=train_dataloader,
             loss_fn=loss_fn,
             optimizer=optimizer,
             device=device,
+            amp_dtype=amp_dtype,
+            channels_last=channels_last,
+            accumulation_steps=accumulation_steps,
         )
+        train_seconds = time.perf_counter() - start
         test_loss, test_acc = test_step(
-            model=model, dataloader=test_dataloader, loss_fn=loss_fn, device=device
+            model=model,
+            dataloader=test_dataloader,
+            loss_fn=loss_fn,
+            device=device,
+            amp_dtype=amp_dtype,
+            channels_last=channels_last,
+            metrics=test_metrics,
         )
+        test_values = test_metrics.compute()
+
+        metrics = {
+            "train_loss": train_loss,
+            "train_acc": train_acc,
+            "test_loss": test_loss,
+            "test_acc": test_acc,
+            "train_images_per_sec": len(train_dataloader.dataset) / train_seconds if train_seconds else 0.0,
+        }
+        metrics.update({f"test_{key}": value for key, value in test_values.items() if key.startswith("top")})
+        data_wait = getattr(train_dataloader, "wait_fraction", None)
+        if data_wait is not None:
+            metrics["train_data_wait"] = data_wait
 
         # Print out what's happening
         print(
@@ -189,14 +275,22 @@ def train(
             f"train_loss: {train_loss:.4f} | "
             f"train_acc: {train_acc:.4f} | "
             f"test_loss: {test_loss:.4f} | "
-            f"test_acc: {test_acc:.4f}"
+            f"test_acc: {test_acc:.4f} | "
+            f"{metrics['train_images_per_sec']:.1f} img/s"
+            + (f" | data_wait: {data_wait:.1%}" if data_wait is not None else "")
         )
 
         # Update results dictionary
-        results["train_loss"].append(train_loss)
-        results["train_acc"].append(train_acc)
-        results["test_loss"].append(test_loss)
-        results["test_acc"].append(test_acc)
+        for key, value in metrics.items():
+            results.setdefault(key, []).append(value)
+
+        if epoch_callback is not None:
+            epoch_callback(epoch + 1, epochs, metrics)
+
+    if epochs:
+        for key in ("per_class_recall", "confusion_matrix"):
+            if key in test_values:
+                results[f"test_{key}"] = test_values[key]
 
     # Return the filled results at the end of the epochs
     return results
@@ -0,0 +1,46 @@
+"""
+Contains functionality for extracting pooled backbone embeddings and
+fitting a classifier head on them.
+"""
+
+import io
+
+import numpy as np
+import torch
+
+from typing import List
+
+
+EMBEDDING_DIM = 1280
+
+
+def extract_embeddings(model: torch.nn.Module, X: torch.Tensor) -> torch.Tensor:
+    """Returns the pooled backbone features of an EfficientNet for a batch.
+
+    Args:
+    model: An EfficientNet (anything with `features` and `avgpool`).
+    X: A normalized image batch on the model's device.
+
+    Returns:
+    A float32 tensor of shape (batch, EMBEDDING_DIM) on the CPU.
+    """
+    model.eval()
+    with torch.inference_mode():
+        return torch.flatten(model.avgpool(model.features(X)), 1).float().cpu()
+
+
+def embeddings_to_bytes(vectors: torch.Tensor) -> List[bytes]:
+    """Serializes each row of a (batch, dim) tensor as raw float32 bytes."""
+    array = vectors.detach().cpu().numpy().astype(np.float32, copy=False)
+    return [row.tobytes() for row in array]
+
+
+def embeddings_from_bytes(blobs: List[bytes]) -> torch.Tensor:
+    """Inverse of embeddings_to_bytes(): stacks raw float32 rows into one tensor."""
+    if not blobs:
+        return torch.empty(0, EMBEDDING_DIM)
+    buffer = io.BytesIO()
+    for blob in blobs:
+        buffer.write(blob)
+    array = np.frombuffer(buffer.getbuffer(), dtype=np.float32).reshape(len(blobs), -1)
+    return torch.from_numpy(array.copy())
@@ -0,0 +1,55 @@
+"""
+Contains fast image decoding shared by inference and training.
+
+JPEGs are decoded with Image.draft(), which lets libjpeg scale by 1/2, 1/4
+or 1/8 in the DCT domain, so a 12-megapixel photo is never fully decoded
+just to be resized to 224x224. The reduced image is resized once and turned
+into a tensor straight from its pixel buffer.
+"""
+
+import numpy as np
+import torch
+
+from PIL import Image
+from typing import Optional, Sequence
+
+
+def open_rgb(source, size: Optional[Sequence[int]] = None) -> Image.Image:
+    """Opens an image as RGB, decoding JPEGs at reduced resolution when possible.
+
+    Args:
+    source: File path or binary file object.
+    size: (height, width) the image will be resized to; the decoded image
+      is never smaller than this.
+    """
+    image = Image.open(source)
+    if size is not None and image.format == "JPEG":
+        # draft() keeps the result at least as large as the requested size
+        image.draft("RGB", (int(size[1]), int(size[0])))
+    return image.convert("RGB")
+
+
+def decode_resized(source, size: Sequence[int]) -> np.ndarray:
+    """Decodes and resizes an image to a contiguous uint8 (3, H, W) array."""
+    with open_rgb(source, size) as image:
+        height, width = int(size[0]), int(size[1])
+        if image.size != (width, height):
+            image = image.resize((width, height), Image.BILINEAR, reducing_gap=3.0)
+        return np.ascontiguousarray(np.asarray(image, dtype=np.uint8).transpose(2, 0, 1))
+
+
+def decode_normalized(
+    source,
+    size: Sequence[int],
+    mean: Sequence[float],
+    std: Sequence[float],
+) -> torch.Tensor:
+    """Decodes, resizes and normalizes an image into a float (3, H, W) tensor.
+
+    Equivalent to Resize(size) -> ToTensor() -> Normalize(mean, std), without
+    the intermediate full-resolution decode and PIL copies.
+    """
+    tensor = torch.from_numpy(decode_resized(source, size)).float()
+    mean = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1)
+    std = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+    return tensor.div_(255.0).sub_(mean).div_(std)
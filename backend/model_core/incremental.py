@@ -0,0 +1,88 @@
+"""
+Contains helpers for incremental (warm-start) fine-tuning from a previously
+published model.
+"""
+
+import random
+
+import torch
+
+from torch import nn
+from typing import Dict, List, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def remap_classifier(
+    model: torch.nn.Module, old_class_names: Sequence[str], new_class_names: Sequence[str]
+) -> Dict[str, int]:
+    """Resizes the final Linear layer of `model.classifier` to a new class list.
+
+    Rows of classes present in both lists are copied over (matched by name,
+    so reordering is fine); rows for new classes keep the default Linear
+    initialisation and rows of removed classes are dropped.
+
+    Args:
+    model: Model with an nn.Sequential `classifier` ending in nn.Linear.
+    old_class_names: Class names of the current output rows.
+    new_class_names: Class names the resized head should predict.
+
+    Returns:
+    A dictionary with the number of "kept", "added" and "removed" classes.
+    """
+    old_head = model.classifier[-1]
+    new_head = nn.Linear(old_head.in_features, len(new_class_names)).to(
+        device=old_head.weight.device, dtype=old_head.weight.dtype
+    )
+    old_index = {name: i for i, name in enumerate(old_class_names)}
+    kept = 0
+    with torch.no_grad():
+        for new_i, name in enumerate(new_class_names):
+            old_i = old_index.get(name)
+            if old_i is not None:
+                new_head.weight[new_i] = old_head.weight[old_i]
+                new_head.bias[new_i] = old_head.bias[old_i]
+                kept += 1
+    model.classifier[-1] = new_head
+    return {
+        "kept": kept,
+        "added": len(new_class_names) - kept,
+        "removed": len(old_class_names) - kept,
+    }
+
+
+def select_with_replay(
+    new_samples: List[T],
+    old_samples: List[Tuple[T, int]],
+    replay_size: int,
+    seed: int = 42,
+) -> List[T]:
+    """Combines all new samples with a class-balanced replay buffer of old ones.
+
+    The replay buffer keeps the model from forgetting classes that received
+    no new samples since the previous run.
+
+    Args:
+    new_samples: Samples added since the previous training run.
+    old_samples: (sample, class_index) pairs the previous model was trained on.
+    replay_size: Maximum number of old samples to mix in.
+    seed: Random seed, so a run is reproducible.
+
+    Returns:
+    new_samples followed by at most `replay_size` old samples.
+    """
+    rng = random.Random(seed)
+    by_class: Dict[int, List[T]] = {}
+    for sample, target in old_samples:
+        by_class.setdefault(target, []).append(sample)
+    for samples in by_class.values():
+        rng.shuffle(samples)
+
+    # Round-robin over the classes so each one gets a fair share
+    replay: List[T] = []
+    pools = list(by_class.values())
+    while len(replay) < replay_size and any(pools):
+        for pool in pools:
+            if pool and len(replay) < replay_size:
+                replay.append(pool.pop())
+    return list(new_samples) + replay
@@ -0,0 +1,97 @@
+"""
+Contains the wire protocol between web processes and the inference worker
+pool (see worker_pool.py), and the client side of it.
+
+Each message is a fixed 8-byte prefix (header length, payload length), a
+JSON header and a raw payload. Tensors travel as contiguous float32 bytes
+described by the header's "shape", so no pickling is involved and the
+payload is written straight from the tensor's buffer.
+"""
+
+import json
+import socket
+import struct
+
+import torch
+
+from typing import Dict, Optional, Tuple
+
+_PREFIX = struct.Struct("!II")
+MAX_HEADER_BYTES = 64 * 1024
+# a 16-image 224x224 float32 batch is ~9.6MB
+DEFAULT_MAX_PAYLOAD_BYTES = 64 * 1024 * 1024
+
+
+def _recv_exactly(conn: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = conn.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed mid-message.")
+        received += count
+    return buffer
+
+
+def send_message(conn: socket.socket, header: Dict, payload=b""):
+    """Writes one message; `payload` may be any buffer (bytes, memoryview, numpy array)."""
+    payload = memoryview(payload).cast("B")
+    encoded = json.dumps(header).encode()
+    conn.sendall(_PREFIX.pack(len(encoded), payload.nbytes) + encoded)
+    if payload.nbytes:
+        conn.sendall(payload)
+
+
+def recv_message(conn: socket.socket, max_payload: Optional[int] = DEFAULT_MAX_PAYLOAD_BYTES) -> Tuple[Dict, bytearray]:
+    """Reads one message and returns (header, payload).
+
+    Sizes are checked against MAX_HEADER_BYTES and `max_payload` (None: no
+    limit) before anything is allocated, so a bad length prefix cannot make
+    the reader reserve an arbitrary amount of memory.
+    """
+    header_size, payload_size = _PREFIX.unpack(_recv_exactly(conn, _PREFIX.size))
+    if header_size > MAX_HEADER_BYTES:
+        raise ValueError(f"Message header of {header_size} bytes exceeds {MAX_HEADER_BYTES}.")
+    if max_payload is not None and payload_size > max_payload:
+        raise ValueError(f"Message payload of {payload_size} bytes exceeds {max_payload}.")
+    header = json.loads(_recv_exactly(conn, header_size).decode())
+    return header, _recv_exactly(conn, payload_size)
+
+
+def tensor_from_payload(header: Dict, payload: bytearray) -> torch.Tensor:
+    """The float32 tensor a message carries (shares memory with the payload)."""
+    if not payload:
+        return torch.empty(header["shape"])
+    return torch.frombuffer(payload, dtype=torch.float32).view(header["shape"])
+
+
+class RemoteRunner:
+    """Runs a published bundle in the inference worker pool instead of in-process.
+
+    Each call opens a short-lived connection to the pool's Unix socket, so a
+    busy web process never pins a worker between requests and whichever idle
+    worker accepts first serves the batch.
+
+    Args:
+    socket_path: Unix socket the pool listens on.
+    bundle_path: Bundle the workers should run; they load it (memory-mapped)
+      on first use and keep it until a newer bundle is requested.
+    timeout: Seconds to wait for the pool before giving up.
+    """
+
+    def __init__(self, socket_path: str, bundle_path: str, timeout: Optional[float] = 30.0):
+        self.socket_path = str(socket_path)
+        self.bundle_path = str(bundle_path)
+        self.timeout = timeout
+
+    def __call__(self, X: torch.Tensor) -> torch.Tensor:
+        X = X.detach().cpu().float().contiguous()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+            send_message(conn, {"path": self.bundle_path, "shape": list(X.shape)}, X.numpy())
+            header, payload = recv_message(conn)
+        if "error" in header:
+            raise RuntimeError(f"Inference worker failed: {header['error']}")
+        return tensor_from_payload(header, payload)
@@ -0,0 +1,101 @@
+"""
+Contains classification metrics that are accumulated on the compute device.
+
+Batches only add to device tensors; nothing is copied to the host until
+compute() is called once per epoch, so the training loop never waits on a
+per-batch device sync.
+"""
+
+import torch
+
+from typing import Dict, Optional, Sequence
+
+
+class ClassificationMetrics:
+    """Sample-weighted loss, top-k accuracy, per-class recall and confusion matrix.
+
+    Args:
+    top_k: The k values to report accuracy for; top-1 is always reported as "acc".
+    per_class_recall: Also report the recall of every class.
+    confusion_matrix: Also report the confusion matrix (rows: targets, columns: predictions).
+    num_classes: Number of classes; inferred from the logits when None.
+    """
+
+    def __init__(
+        self,
+        top_k: Sequence[int] = (1,),
+        per_class_recall: bool = False,
+        confusion_matrix: bool = False,
+        num_classes: Optional[int] = None,
+    ):
+        self.top_k = sorted(set(top_k) | {1})
+        self.per_class_recall = per_class_recall
+        self.confusion_matrix = confusion_matrix
+        self.num_classes = num_classes
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._loss_sum = None
+        self._correct = None
+        self._confusion = None
+
+    def update(self, logits: torch.Tensor, targets: torch.Tensor, loss: Optional[torch.Tensor] = None):
+        """Adds one batch.
+
+        Args:
+        logits: (batch, num_classes) model outputs; argmax of the logits is
+          the prediction, so no softmax is needed.
+        targets: (batch,) class indices.
+        loss: The batch's mean loss, weighted by the batch size.
+        """
+        logits = logits.detach()
+        batch_size = targets.shape[0]
+        num_classes = self.num_classes or logits.shape[1]
+        ks = [min(k, logits.shape[1]) for k in self.top_k]
+
+        top = logits.topk(max(ks), dim=1).indices
+        hits = top == targets.unsqueeze(1)
+        correct = torch.stack([hits[:, :k].any(dim=1).sum() for k in ks])
+        self._correct = correct if self._correct is None else self._correct + correct
+
+        if loss is not None:
+            loss_sum = loss.detach().float() * batch_size
+            self._loss_sum = loss_sum if self._loss_sum is None else self._loss_sum + loss_sum
+
+        if self.per_class_recall or self.confusion_matrix:
+            self.num_classes = num_classes
+            pairs = targets * num_classes + top[:, 0]
+            confusion = torch.bincount(pairs, minlength=num_classes * num_classes)
+            self._confusion = confusion if self._confusion is None else self._confusion + confusion
+
+        self.count += batch_size
+
+    def compute(self) -> Dict:
+        """Reads the accumulated values (one host transfer) and returns them.
+
+        Returns:
+        A dictionary with "loss" and "acc", plus "top{k}_acc" for every
+        other k, "per_class_recall" and "confusion_matrix" when enabled.
+        """
+        if not self.count:
+            values = {"loss": 0.0, "acc": 0.0}
+            values.update({f"top{k}_acc": 0.0 for k in self.top_k if k != 1})
+            return values
+
+        correct = (self._correct.double() / self.count).tolist()
+        values = {
+            "loss": self._loss_sum.item() / self.count if self._loss_sum is not None else 0.0,
+            "acc": correct[0],
+        }
+        values.update({f"top{k}_acc": acc for k, acc in zip(self.top_k[1:], correct[1:])})
+
+        if self._confusion is not None:
+            confusion = self._confusion.view(self.num_classes, self.num_classes)
+            if self.per_class_recall:
+                support = confusion.sum(dim=1)
+                recall = confusion.diagonal().double() / support.clamp(min=1)
+                values["per_class_recall"] = recall.tolist()
+            if self.confusion_matrix:
+                values["confusion_matrix"] = confusion.tolist()
+        return values
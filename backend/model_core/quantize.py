@@ -0,0 +1,117 @@
+"""
+Contains post-training static int8 quantization for CPU serving.
+
+The quantized model is calibrated on held-out images, checked against the
+fp32 model's top-1 accuracy, and stored as a frozen TorchScript graph next
+to the bundle it was derived from (v000012.pt -> v000012.int8.ts).
+"""
+
+import copy
+import os
+import warnings
+
+import torch
+
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from typing import Dict, Iterable, Optional
+
+from .backends import bundle_prefix
+
+QUANTIZED_SUFFIX = "int8.ts"
+
+
+def default_engine() -> str:
+    """The quantized kernel library for this CPU (fbgemm/onednn on x86, qnnpack on ARM)."""
+    engines = torch.backends.quantized.supported_engines
+    return "x86" if "x86" in engines else "qnnpack"
+
+
+def quantized_path(bundle_path: str) -> str:
+    """Path of the int8 variant of a published bundle."""
+    return f"{bundle_prefix(bundle_path)}.{QUANTIZED_SUFFIX}"
+
+
+def quantize_model(
+    model: torch.nn.Module,
+    calibration_batches: Iterable,
+    engine: Optional[str] = None,
+) -> torch.nn.Module:
+    """Creates a static int8 copy of an fp32 model.
+
+    Args:
+    model: Trained fp32 model (left untouched).
+    calibration_batches: Iterable of (X, y) batches of eval-transformed
+      images, used to observe activation ranges.
+    engine: Quantized engine (default: default_engine()).
+
+    Returns:
+    The quantized model on the CPU, in eval mode.
+    """
+    engine = engine or default_engine()
+    torch.backends.quantized.engine = engine
+    float_model = copy.deepcopy(model).cpu().eval().to(memory_format=torch.contiguous_format)
+    batches = iter(calibration_batches)
+    X, _ = next(batches)
+    with warnings.catch_warnings():
+        # torch.ao.quantization warns about its own upcoming deprecation
+        warnings.simplefilter("ignore")
+        prepared = prepare_fx(float_model, get_default_qconfig_mapping(engine), (X.cpu(),))
+        with torch.no_grad():
+            prepared(X.cpu())
+            for X, _ in batches:
+                prepared(X.cpu())
+        return convert_fx(prepared).eval()
+
+
+def top1_accuracy(model: torch.nn.Module, batches: Iterable) -> float:
+    """Sample-weighted top-1 accuracy of `model` on CPU batches."""
+    correct = total = 0
+    with torch.inference_mode():
+        for X, y in batches:
+            correct += (model(X.cpu()).argmax(dim=1) == y).sum()
+            total += len(y)
+    return int(correct) / total if total else 0.0
+
+
+def accuracy_regression(
+    fp32_model: torch.nn.Module,
+    int8_model: torch.nn.Module,
+    batches: Iterable,
+    max_drop: float,
+) -> Dict:
+    """Compares the top-1 accuracy of both models on held-out batches.
+
+    Returns:
+    A dictionary with "fp32_acc", "int8_acc", "drop", "max_drop" and
+    "passed" (whether the drop is within max_drop).
+    """
+    batches = list(batches)
+    fp32_acc = top1_accuracy(copy.deepcopy(fp32_model).cpu().eval(), batches)
+    int8_acc = top1_accuracy(int8_model, batches)
+    drop = fp32_acc - int8_acc
+    return {
+        "fp32_acc": fp32_acc,
+        "int8_acc": int8_acc,
+        "drop": drop,
+        "max_drop": max_drop,
+        "passed": drop <= max_drop,
+    }
+
+
+def save_quantized(path: str, model: torch.nn.Module, example: torch.Tensor):
+    """Traces, freezes and atomically writes a quantized model."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        with torch.no_grad():
+            frozen = torch.jit.freeze(torch.jit.trace(model, example.cpu()))
+        torch.jit.save(frozen, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def load_quantized(path: str, engine: Optional[str] = None) -> torch.jit.ScriptModule:
+    """Loads a model written by save_quantized() for CPU inference."""
+    torch.backends.quantized.engine = engine or default_engine()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        return torch.jit.load(path, map_location="cpu")
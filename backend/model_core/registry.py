@@ -0,0 +1,155 @@
+"""
+Contains a versioned on-disk model registry with atomic publishing.
+
+Published bundles live in one directory as v<generation>.pt files. A small
+CURRENT file names the generation being served; it is only ever replaced
+with os.replace(), so readers see either the old or the new pointer and
+never a partially written model.
+"""
+
+import json
+import os
+import re
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+POINTER_NAME = "CURRENT"
+# v000012.pt and any artifacts derived from it (v000012.<suffix>)
+_GENERATION_FILE = re.compile(r"^v(\d+)\.")
+
+
+def _fsync_path(path: str, directory: bool = False):
+    flags = os.O_RDONLY | (getattr(os, "O_DIRECTORY", 0) if directory else 0)
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        return  # directories cannot be opened on some platforms
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class ModelRegistry:
+    """Directory of published model bundles plus a generation pointer.
+
+    Args:
+    root: Registry directory (created on first publish).
+    keep: How many published generations to keep on disk.
+    """
+
+    def __init__(self, root: str, keep: int = 3):
+        self.root = str(root)
+        self.keep = max(1, keep)
+        self._pointer_path = os.path.join(self.root, POINTER_NAME)
+        self._cached_stat = None
+        self._cached_pointer = None
+
+    @contextmanager
+    def _publish_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "a+") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def current(self) -> Optional[Dict]:
+        """Returns the pointer of the served generation, or None if nothing is published.
+
+        The pointer file is only re-read when its inode or mtime changes, so
+        this is cheap enough to call on every request.
+        """
+        try:
+            st = os.stat(self._pointer_path)
+        except FileNotFoundError:
+            self._cached_stat = self._cached_pointer = None
+            return None
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if signature != self._cached_stat:
+            try:
+                with open(self._pointer_path, encoding="utf-8") as f:
+                    pointer = json.load(f)
+            except (OSError, ValueError):
+                return self._cached_pointer
+            pointer["path"] = os.path.join(self.root, pointer["file"])
+            self._cached_stat, self._cached_pointer = signature, pointer
+        return self._cached_pointer
+
+    def generation(self) -> int:
+        """Returns the served generation number (0 when nothing is published)."""
+        pointer = self.current()
+        return pointer["generation"] if pointer else 0
+
+    def publish(self, write_fn: Callable[[str], Optional[Dict]]) -> Dict:
+        """Writes a new generation and atomically makes it the served one.
+
+        Args:
+        write_fn: Called with a temporary path inside the registry that it
+          must write the bundle to. If it returns a dictionary, its "sha256"
+          entry is recorded in the pointer.
+
+        Returns:
+        The new pointer.
+        """
+        with self._publish_lock():
+            generation = max([self.generation()] + self._generations_on_disk()) + 1
+            filename = f"v{generation:06d}.pt"
+            final_path = os.path.join(self.root, filename)
+            tmp_path = final_path + ".tmp"
+            try:
+                meta = write_fn(tmp_path) or {}
+                _fsync_path(tmp_path)
+                os.replace(tmp_path, final_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            pointer = {
+                "generation": generation,
+                "file": filename,
+                "sha256": meta.get("sha256"),
+                "published_at": time.time(),
+            }
+            tmp_pointer = self._pointer_path + ".tmp"
+            with open(tmp_pointer, "w", encoding="utf-8") as f:
+                json.dump(pointer, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_pointer, self._pointer_path)
+            _fsync_path(self.root, directory=True)
+
+            self._prune(generation)
+        pointer["path"] = final_path
+        return pointer
+
+    def _generations_on_disk(self):
+        generations = []
+        for name in os.listdir(self.root):
+            match = _GENERATION_FILE.match(name)
+            if match:
+                generations.append(int(match.group(1)))
+        return generations
+
+    def _prune(self, current_generation: int):
+        # Older files may still be mapped by workers that have not swapped
+        # yet; on POSIX unlinking them is safe, elsewhere we just skip them.
+        for name in os.listdir(self.root):
+            match = _GENERATION_FILE.match(name)
+            if match and int(match.group(1)) <= current_generation - self.keep:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
@@ -0,0 +1,182 @@
+"""
+Contains a cache of pre-resized uint8 image tensors stored in raw shard
+files, so training epochs do not have to decode the original uploads.
+
+Every image occupies one fixed-size slot (3 x H x W bytes) in a shard file,
+which makes a slot addressable by offset and lets readers memory-map the
+shards and hand out tensors without copying.
+"""
+
+import json
+import os
+
+import numpy as np
+import torch
+
+from torch.utils.data import Dataset
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .imaging import decode_resized
+
+INDEX_NAME = "index.json"
+
+
+class TensorShardCache:
+    """Persistent store of pre-resized images keyed by content key.
+
+    Args:
+    root: Directory holding the index and the shard files.
+    size: (height, width) every image is resized to.
+    shard_capacity: Number of slots per shard file.
+    """
+
+    def __init__(self, root: str, size: Sequence[int] = (224, 224), shard_capacity: int = 512):
+        self.root = str(root)
+        self.size = (int(size[0]), int(size[1]))
+        self.shard_capacity = shard_capacity
+        self.slot_bytes = 3 * self.size[0] * self.size[1]
+        self._maps = {}
+        self._index = self._read_index()
+
+    # Index handling
+
+    def _read_index(self) -> Dict:
+        empty = {"size": list(self.size), "entries": {}, "free": [], "next": [0, 0]}
+        try:
+            with open(os.path.join(self.root, INDEX_NAME), encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return empty
+        if index.get("size") != list(self.size):
+            # Different resolution: start over, old shards get overwritten
+            return empty
+        return index
+
+    def _write_index(self):
+        path = os.path.join(self.root, INDEX_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(path + ".tmp", path)
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.root, f"shard-{shard:05d}.u8")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index["entries"]
+
+    def __len__(self) -> int:
+        return len(self._index["entries"])
+
+    # Writing
+
+    def _load_image(self, path: str) -> np.ndarray:
+        return decode_resized(path, self.size)
+
+    def _allocate(self) -> Tuple[int, int]:
+        if self._index["free"]:
+            return tuple(self._index["free"].pop())
+        shard, slot = self._index["next"]
+        self._index["next"] = [shard, slot + 1] if slot + 1 < self.shard_capacity else [shard + 1, 0]
+        return shard, slot
+
+    def update(self, items: Dict[str, str]) -> Dict[str, int]:
+        """Makes the cache hold exactly the images in `items`.
+
+        New keys are decoded, resized and written into a free slot; keys that
+        are no longer present have their slots released for reuse. Images
+        already cached are not touched.
+
+        Args:
+        items: Mapping of content key (e.g. the sha256 of the file) to image path.
+
+        Returns:
+        A dictionary with the number of "added", "removed" and "failed" images.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        entries = self._index["entries"]
+        removed = [key for key in entries if key not in items]
+        for key in removed:
+            self._index["free"].append(entries.pop(key))
+
+        added = failed = 0
+        handles = {}
+        try:
+            for key, path in items.items():
+                if key in entries:
+                    continue
+                try:
+                    array = self._load_image(path)
+                except (OSError, ValueError):
+                    failed += 1
+                    continue
+                shard, slot = self._allocate()
+                if shard not in handles:
+                    shard_path = self._shard_path(shard)
+                    handles[shard] = open(shard_path, "r+b" if os.path.exists(shard_path) else "w+b")
+                handles[shard].seek(slot * self.slot_bytes)
+                handles[shard].write(array.tobytes())
+                entries[key] = [shard, slot]
+                added += 1
+        finally:
+            for handle in handles.values():
+                handle.close()
+            self._maps.clear()
+            self._write_index()
+        return {"added": added, "removed": len(removed), "failed": failed}
+
+    # Reading
+
+    def _map(self, shard: int) -> np.ndarray:
+        array = self._maps.get(shard)
+        if array is None:
+            slots = os.path.getsize(self._shard_path(shard)) // self.slot_bytes
+            # mode="c": copy-on-write, so torch gets a writable view without copying the file
+            array = np.memmap(self._shard_path(shard), dtype=np.uint8, mode="c",
+                              shape=(slots, 3, self.size[0], self.size[1]))
+            self._maps[shard] = array
+        return array
+
+    def tensor(self, key: str) -> torch.Tensor:
+        """Returns the cached image as a uint8 (3, H, W) tensor backed by the shard file."""
+        shard, slot = self._index["entries"][key]
+        return torch.from_numpy(self._map(shard)[slot])
+
+    def __getstate__(self):
+        # Memory maps are reopened lazily in DataLoader worker processes
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+
+class ShardDataset(Dataset):
+    """Dataset reading pre-resized uint8 images from a TensorShardCache.
+
+    Args:
+    cache: The shard cache holding every key in `samples`.
+    samples: List of (content_key, class_index) tuples.
+    classes: Class names, indexed by class_index.
+    transform: Tensor transform (augmentation, dtype conversion, normalization).
+    """
+
+    def __init__(
+        self,
+        cache: TensorShardCache,
+        samples: List[Tuple[str, int]],
+        classes: List[str],
+        transform: Optional[Callable] = None,
+    ):
+        self.cache = cache
+        self.samples = [(key, target) for key, target in samples if key in cache]
+        self.targets = [target for _, target in self.samples]
+        self.classes = list(classes)
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        key, target = self.samples[index]
+        image = self.cache.tensor(key)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, target
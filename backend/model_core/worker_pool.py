@@ -0,0 +1,220 @@
+"""
+Contains a pool of inference worker processes serving published bundles
+over a local Unix socket (see ipc.py for the protocol and client).
+
+Web processes then no longer run the forward pass themselves: web
+concurrency and inference parallelism are sized independently, and each
+worker owns a fixed subset of the CPU cores with an intra-op thread pool
+sized to it, instead of every process fighting over all cores.
+
+Workers memory-map the bundle (load_bundle(mmap=True) + build_model()
+assign the file-backed tensors in place), so the weights live once in the
+page cache however many workers run them and RSS grows with activations
+only.
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+import torch
+
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence
+
+from .backends import bundle_prefix, load_backend
+from .bundle import build_model, load_bundle, state_dict_sha256
+from .ipc import DEFAULT_MAX_PAYLOAD_BYTES, recv_message, send_message, tensor_from_payload
+
+
+def split_cores(workers: int, cores: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """Divides the available cores into `workers` disjoint, contiguous subsets.
+
+    With more workers than cores, workers share single cores round-robin.
+    """
+    if cores is None:
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    cores = list(cores)
+    if workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(workers)]
+    size, extra = divmod(len(cores), workers)
+    subsets, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        subsets.append(cores[start:end])
+        start = end
+    return subsets
+
+
+class _Models:
+    """The runners a worker has loaded, newest last; older bundles are evicted."""
+
+    def __init__(self, root: str, backend: str, keep: int = 2, allowed_paths: Sequence[str] = ()):
+        self.root = os.path.realpath(root)
+        self.allowed_paths = {os.path.realpath(path) for path in allowed_paths}
+        self.backend = backend
+        self.keep = keep
+        self._runners = OrderedDict()
+
+    def get(self, path: str) -> Callable:
+        path = os.path.realpath(path)
+        if path not in self.allowed_paths and os.path.commonpath([self.root, path]) != self.root:
+            raise PermissionError(f"{path} is outside the model directory.")
+        if path not in self._runners:
+            bundle = load_bundle(path, map_location="cpu", mmap=True)
+            class_names = bundle["class_names"]
+            if class_names is None:
+                # legacy checkpoint: only the number of outputs matters here
+                class_names = [""] * bundle["state_dict"]["classifier.1.weight"].shape[0]
+            self._runners[path] = load_backend(
+                self.backend,
+                build_model(bundle, class_names),
+                sha256=bundle["sha256"] or state_dict_sha256(bundle["state_dict"]),
+                prefix=bundle_prefix(path),
+                input_size=bundle["transform"]["resize"],
+                num_threads=torch.get_num_threads(),
+                warmup_runs=1,
+            )
+            while len(self._runners) > self.keep:
+                self._runners.popitem(last=False)
+        self._runners.move_to_end(path)
+        return self._runners[path]
+
+
+def _handle(conn: socket.socket, models: _Models, max_payload: Optional[int]):
+    header, payload = recv_message(conn, max_payload=max_payload)
+    try:
+        X = tensor_from_payload(header, payload)
+        with torch.inference_mode():
+            logits = models.get(header["path"])(X).float().contiguous()
+    except Exception as e:
+        send_message(conn, {"error": f"{type(e).__name__}: {e}"})
+        return
+    send_message(conn, {"shape": list(logits.shape)}, logits.numpy())
+
+
+def _worker_main(
+    listener: socket.socket,
+    root: str,
+    backend: str,
+    cores: List[int],
+    num_threads: Optional[int],
+    timeout: Optional[float],
+    max_payload: Optional[int],
+    allowed_paths: Sequence[str],
+):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent shuts workers down
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads or len(cores))
+    models = _Models(root, backend, allowed_paths=allowed_paths)
+    while True:
+        conn, _ = listener.accept()
+        with conn:
+            # a client that stops sending (or reading) must not hold the worker forever
+            conn.settimeout(timeout)
+            try:
+                _handle(conn, models, max_payload)
+            except (ConnectionError, OSError, ValueError):
+                pass  # client went away, timed out or sent garbage; keep serving others
+
+
+class InferenceWorkerPool:
+    """Forks worker processes that accept inference requests on one Unix socket.
+
+    All workers accept() on the same listening socket, so the kernel hands
+    each connection to an idle worker. Dead workers are restarted.
+
+    Args:
+    socket_path: Path of the Unix socket to listen on (replaced if stale).
+    root: Directory bundles must live in (the model registry); requests
+      for paths outside it are refused.
+    allowed_paths: Individual bundle files outside `root` that may be served
+      too (e.g. the legacy MODEL_PATH checkpoint).
+    workers: Number of worker processes.
+    backend: Inference backend each worker wraps the model in (see backends.py).
+    threads_per_worker: Intra-op threads per worker (default: its core count).
+    timeout: Seconds a worker waits on a silent client before dropping it.
+    max_payload: Largest request payload in bytes; bigger requests are
+      refused before their buffer is allocated.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        root: str,
+        workers: int = 2,
+        backend: str = "eager",
+        threads_per_worker: Optional[int] = None,
+        timeout: Optional[float] = 30.0,
+        max_payload: Optional[int] = DEFAULT_MAX_PAYLOAD_BYTES,
+        allowed_paths: Sequence[str] = (),
+    ):
+        self.socket_path = str(socket_path)
+        self.root = str(root)
+        self.workers = max(1, workers)
+        self.backend = backend
+        self.threads_per_worker = threads_per_worker
+        self.timeout = timeout
+        self.max_payload = max_payload
+        self.allowed_paths = [str(path) for path in allowed_paths]
+        self.cores = split_cores(self.workers)
+        self._listener = None
+        self._processes = []
+
+    def start(self):
+        """Binds the socket and starts the workers; returns immediately."""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.socket_path)
+        self._listener.listen(128)
+        self._processes = [self._spawn(i) for i in range(self.workers)]
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        # fork: workers inherit the listening socket
+        process = multiprocessing.get_context("fork").Process(
+            target=_worker_main,
+            args=(
+                self._listener,
+                self.root,
+                self.backend,
+                self.cores[index],
+                self.threads_per_worker,
+                self.timeout,
+                self.max_payload,
+                self.allowed_paths,
+            ),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def serve_forever(self, poll_interval: float = 1.0):
+        """Starts the pool and supervises it until interrupted or terminated."""
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        self.start()
+        try:
+            while True:
+                time.sleep(poll_interval)
+                for i, process in enumerate(self._processes):
+                    if not process.is_alive():
+                        self._processes[i] = self._spawn(i)
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join(timeout=5)
+        self._processes = []
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,16 @@
+#!/bin/sh
+# Container entry point: the web server plus the training worker that runs
+# queued retrain jobs (RetrainModelView only queues them).
+set -e
+
+python manage.py migrate
+
+# worker در پس‌زمینه؛ اگر از کار بیفتد دوباره اجرا می‌شود
+(
+  while true; do
+    python manage.py run_training_worker || true
+    sleep 5
+  done
+) &
+
+exec python manage.py runserver 0.0.0.0:8000
@@ -141,7 +141,7 @@ const api = {
   },
 
   // متد برای آموزش مجدد مدل
-  async retrainModel() {
+  async retrainModel({ pollInterval = 3000 } = {}) {
     const res = await fetch(`${API_BASE}/retrain/`, {
       method: 'POST',
     });
@@ -151,6 +151,31 @@ const api = {
       throw new Error(errorData.error || 'خطا در آموزش مجدد مدل');
     }
     
+    // آموزش در پس‌زمینه اجرا می‌شود؛ وضعیت job را تا پایان دنبال کن
+    let { job } = await res.json();
+    while (job.status === 'queued' || job.status === 'running') {
+      await new Promise((resolve) => setTimeout(resolve, pollInterval));
+      job = await this.getTrainingJob(job.id);
+      if (job.waiting_for_worker) {
+        // هیچ worker آموزشی job را برنداشته؛ polling بی‌پایان ادامه پیدا نکند
+        throw new Error('هیچ worker آموزشی در حال اجرا نیست (python manage.py run_training_worker)');
+      }
+    }
+    if (job.status !== 'succeeded') {
+      throw new Error(job.error || 'خطا در آموزش مجدد مدل');
+    }
+    return { message: 'Model retrained successfully.', output: job.output, job };
+  },
+
+  async getTrainingJob(id) {
+    const res = await fetch(`${API_BASE}/retrain/jobs/${id}/`);
+    if (!res.ok) throw new Error('خطا در دریافت وضعیت آموزش');
+    return res.json();
+  },
+
+  async cancelTrainingJob(id) {
+    const res = await fetch(`${API_BASE}/retrain/jobs/${id}/cancel/`, { method: 'POST' });
+    if (!res.ok) throw new Error('خطا در لغو آموزش');
     return res.json();
   },
 